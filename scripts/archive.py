@@ -0,0 +1,169 @@
+import concurrent.futures
+import glob
+import gzip
+import os
+import time
+import uuid
+from engine import CrawlResult, ERROR, NUM_PARSERS, get_status
+
+#COMPRESSED RAW HTML ARCHIVE SO ARTICLES CAN BE RE-EXTRACTED OFFLINE
+
+SHARD_SIZE = 1 << 30 #Bytes per shard before a new one is started
+COMPRESS_LEVEL = 6
+FLUSH_EVERY = 100 #Records between flushes of the shard and its index
+REEXTRACT_CHUNK_SIZE = 256 #Records per re-extraction task
+
+#Each record is its own gzip member holding a WARC/1.0 resource record, so a record can be
+#decompressed on its own from the offset stored in the shard's .idx file (offset, length, url per line)
+def build_record(url, body, charset):
+    header = (
+        'WARC/1.0\r\n'
+        'WARC-Type: resource\r\n'
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n'
+        f'WARC-Target-URI: {url}\r\n'
+        f'WARC-Date: {time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}\r\n'
+        f'Content-Type: text/html; charset={charset or "utf-8"}\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        '\r\n'
+    )
+    return gzip.compress(header.encode('utf-8') + body + b'\r\n\r\n', compresslevel=COMPRESS_LEVEL)
+
+#Returns (url, body, charset) from one compressed record
+def parse_record(record):
+    data = gzip.decompress(record)
+    header, _, rest = data.partition(b'\r\n\r\n')
+    fields = {}
+    for line in header.decode('utf-8').split('\r\n')[1:]:
+        key, _, value = line.partition(': ')
+        fields[key] = value
+    body = rest[:int(fields['Content-Length'])]
+    charset = fields['Content-Type'].partition('charset=')[2] or 'utf-8'
+    return fields['WARC-Target-URI'], body, charset
+
+def list_shards(archive_dir):
+    return sorted(glob.glob(os.path.join(archive_dir, 'html-*.warc.gz')))
+
+def iter_index(shard_filepath):
+    with open(shard_filepath[:-len('.warc.gz')] + '.idx', 'r', encoding='utf-8') as index_file:
+        for line in index_file:
+            offset, length, url = line.rstrip('\n').split('\t', 2)
+            yield int(offset), int(length), url
+
+#url -> (shard_filepath, offset) of its newest record. A URL fetched again in a later run or retry is archived
+#again, shards and the records in them are in the order they were written, so the last one seen is the newest
+def latest_records(archive_dir):
+    latest = {}
+    for shard_filepath in list_shards(archive_dir):
+        for offset, _, url in iter_index(shard_filepath):
+            latest[url] = shard_filepath, offset
+    return latest
+
+#Number of archived URLs, each counted once however often it was archived
+def count_records(archive_dir):
+    return len(latest_records(archive_dir))
+
+#Append only: every run starts a new shard after the existing ones, so a crash can never damage old shards
+class HtmlArchive:
+    build_record = staticmethod(build_record) #Called in the parse processes by the engine
+
+    def __init__(self, archive_dir, shard_size = SHARD_SIZE):
+        os.makedirs(archive_dir, exist_ok=True)
+        self.archive_dir = archive_dir
+        self.shard_size = shard_size
+        self.shard_num = len(list_shards(archive_dir))
+        self.shard_file = self.index_file = None
+        self.index_lines = []
+        self.num_unflushed = 0
+        self._open_shard()
+
+    def _open_shard(self):
+        shard_filepath = os.path.join(self.archive_dir, f'html-{self.shard_num:05d}.warc.gz')
+        self.shard_file = open(shard_filepath, 'wb')
+        self.index_file = open(shard_filepath[:-len('.warc.gz')] + '.idx', 'w', encoding='utf-8')
+        self.offset = 0
+
+    def write(self, url, record):
+        if self.offset and self.offset + len(record) > self.shard_size:
+            self.close()
+            self.shard_num += 1
+            self._open_shard()
+
+        self.shard_file.write(record)
+        self.index_lines.append(f'{self.offset}\t{len(record)}\t{url}\n')
+        self.offset += len(record)
+        self.num_unflushed += 1
+        if self.num_unflushed >= FLUSH_EVERY:
+            self.flush()
+
+    #The index is only written after its records are on disk, so every indexed record is complete
+    def flush(self):
+        self.shard_file.flush()
+        self.index_file.writelines(self.index_lines)
+        self.index_file.flush()
+        self.index_lines = []
+        self.num_unflushed = 0
+
+    def close(self):
+        self.flush()
+        self.shard_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#Returns (url, result, num_bytes, error) per entry, error is why extract_article raised, else None
+#A page that raises only fails itself, as in engine.parse_batch
+def extract_chunk(extract_article, shard_filepath, entries):
+    results = []
+    with open(shard_filepath, 'rb') as shard_file:
+        for offset, length, url in entries:
+            shard_file.seek(offset)
+            _, body, charset = parse_record(shard_file.read(length))
+            try:
+                result, error = extract_article(url, body.decode(charset, errors='replace')), None
+            except Exception as e: #Sent back as text, the exception itself may not pickle
+                result, error = None, f'{type(e).__name__}: {e}'
+            results.append((url, result, len(body), error))
+    return results
+
+#Only the newest record of each URL is yielded, so every URL is re-extracted and written once
+def iter_chunks(archive_dir):
+    latest = latest_records(archive_dir)
+    for shard_filepath in list_shards(archive_dir):
+        entries = []
+        for entry in iter_index(shard_filepath):
+            if latest[entry[2]] != (shard_filepath, entry[0]):
+                continue
+            entries.append(entry)
+            if len(entries) == REEXTRACT_CHUNK_SIZE:
+                yield shard_filepath, entries
+                entries = []
+        if entries:
+            yield shard_filepath, entries
+
+#Runs extract_article over the newest archived page of every URL on all cores and yields engine.CrawlResult in archive order
+#A page whose extract_article raises is yielded as ERROR with the exception as its reason
+def reextract(archive_dir, extract_article, num_parsers = NUM_PARSERS):
+    idx = 0
+    with concurrent.futures.ProcessPoolExecutor(num_parsers) as executor:
+        chunks = iter_chunks(archive_dir)
+        pending = []
+        while True:
+            #Keep every process busy without reading the whole index up front
+            for shard_filepath, entries in chunks:
+                pending.append(executor.submit(extract_chunk, extract_article, shard_filepath, entries))
+                if len(pending) >= num_parsers * 2:
+                    break
+            if not pending:
+                return
+
+            for url, result, num_bytes, error in pending.pop(0).result():
+                if error is None:
+                    yield CrawlResult(idx, url, result, get_status(result), num_bytes)
+                else:
+                    print(f'{url}\tParseError: {error}')
+                    yield CrawlResult(idx, url, None, ERROR, num_bytes, reason=f'ParseError: {error}')
+                idx += 1
@@ -0,0 +1,308 @@
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from aiohttp import web
+
+#OFFLINE CRAWLER BENCHMARK
+#Serves sitemaps and articles for every site from a local HTTP server and runs each scraper's full
+#pipeline (URL discovery, fetching, parsing, writing) against it in its own process, then reports
+#docs/sec, CPU time and peak memory. Run from the repository root: python scripts/benchmark.py
+#Each site is served from its own loopback address, so the engine sees one host per site as on the real crawl,
+#and the combined run shows each host's limits and the sites interleaving. Linux routes all of 127.0.0.0/8 to
+#the loopback interface, elsewhere the addresses in SITE_HOSTS may have to be added as loopback aliases.
+
+SITES = ['cna', '8w', 'st', 'zb', 'smd']
+NUM_ARTICLES = 2000 #Articles served per site
+ARTICLES_PER_SITEMAP_PAGE = 200
+NUM_PARAGRAPHS = 12 #Paragraphs per built-in article
+PAGE_PADDING = 60000 #Bytes of navigation/script boilerplate around each built-in article, real pages are mostly this
+LATENCY = 0.05 #Mean seconds before the server answers an article request, each request waits 0.5-1.5x this
+SITE_LATENCY = {} #Per site overrides of LATENCY, e.g. {'zb': 1.0} for one slow host
+ERROR_RATE = 0.0 #Fraction of article requests answered with a 500
+ACCESS_DENIED_RATE = 0.0 #Fraction of article requests answered with an Access denied block page
+COMPRESS = True #Compress responses the client accepts compressed, as the real sites do
+SEED = 0 #Which requests fail depends only on the seed, the URL and how often it was requested, so runs are comparable
+RETRY_FAILED = False #The scrapers' end of run retries wait for backoff, which would dominate the timings
+DEDUP = False #The built-in articles are near copies of each other, so dedup.py would drop almost all of them
+FIXTURES_DIR = 'fixtures' #Recorded pages in <FIXTURES_DIR>/<site>/*.html replace the built-in article template
+RECORD = False #True saves RECORD_ARTICLES live article pages per site into FIXTURES_DIR instead of benchmarking
+RECORD_ARTICLES = 5
+COMBINED = True #Also crawl all SITES together with crawl_all.py, reported as 'all'
+RESULTS_FILEPATH = None #Set to e.g. 'reports/benchmark.json' to also save the results
+PORT = 8750
+SITE_HOSTS = {'cna': '127.0.0.2', '8w': '127.0.0.3', 'st': '127.0.0.4', 'zb': '127.0.0.5', 'smd': '127.0.0.6'}
+
+ACCESS_DENIED_PAGE = '<html><head><title>Access denied</title></head><body><h1>Access denied</h1><p>You don\'t have permission to access this page.</p></body></html>'
+ENGLISH_SENTENCE = 'The quick brown fox jumps over the lazy dog while the committee reviews the annual budget in detail. '
+CHINESE_SENTENCE = '新加坡政府今天宣布一系列新措施，以协助本地企业应对不断上升的营运成本。'
+
+#Article body markup per site, matching what each scraper's extract_article looks for
+ARTICLE_TEMPLATES = {
+    'cna': '<div class="text-long">{paragraphs}</div>',
+    '8w': '<div class="article-content"><div class="text-long">{paragraphs}</div></div>',
+    'st': '<div class="clearfix text-formatted field field--name-field-paragraph-text field--type-text-long field--label-hidden field__item">{paragraphs}</div>',
+    'zb': '<div class="article-content-rawhtml">{paragraphs}</div>',
+}
+SMD_TEMPLATE = '''
+<div id="smcplaceholdercontent_0_ChineseDefinitionContent"><p class="english__text grammarBox__define">{zh}</p></div>
+<div id="smcplaceholdercontent_0_EnglishDefinitionContent"><p class="english__text grammarBox__define">{en}</p></div>
+<div id="smcplaceholdercontent_0_ChineseSentencesContent">{zh}</div>
+<div id="smcplaceholdercontent_0_EnglishSentencesContent">{en}</div>
+<div id="smcplaceholdercontent_0_ChineseTermsUsedContent">{zh}</div>
+<div id="smcplaceholdercontent_0_EnglishTermsUsedContent">{en}</div>
+'''
+
+def site_base(site, port = PORT):
+    return f'http://{SITE_HOSTS[site]}:{port}'
+
+def num_sitemap_pages():
+    return math.ceil(NUM_ARTICLES / ARTICLES_PER_SITEMAP_PAGE)
+
+def padding():
+    nav = '<li><a href="/section">Section link</a></li>'
+    script = '<script>window.dataLayer = window.dataLayer || []; dataLayer.push({"event": "pageview"});</script>'
+    unit = f'<ul class="nav">{nav * 10}</ul>{script}'
+    return unit * max(PAGE_PADDING // len(unit), 1)
+
+#Built-in page for article idx of a site, or one of the recorded fixtures when there are any
+class Fixtures:
+    def __init__(self):
+        self.padding = padding()
+        self.recorded = {}
+        for site in SITES:
+            filepaths = sorted(glob.glob(os.path.join(FIXTURES_DIR, site, '*.html')))
+            self.recorded[site] = [open(filepath, 'rb').read() for filepath in filepaths]
+
+    def article(self, site, idx):
+        if self.recorded[site]:
+            return self.recorded[site][idx % len(self.recorded[site])]
+        if site == 'smd':
+            body = SMD_TEMPLATE.format(zh=f'{CHINESE_SENTENCE}{idx}', en=f'{ENGLISH_SENTENCE}{idx}')
+        else:
+            sentence = CHINESE_SENTENCE if site in ('8w', 'zb') else ENGLISH_SENTENCE
+            paragraphs = ''.join(f'<p>{sentence * 3}{idx}-{paragraph}</p>' for paragraph in range(NUM_PARAGRAPHS))
+            body = ARTICLE_TEMPLATES[site].format(paragraphs=paragraphs)
+        return f'<html><head><title>Article {idx}</title><meta property="article:published_time" content="2021-06-01T08:00:00+08:00"></head><body>{self.padding}{body}{self.padding}</body></html>'.encode('utf-8')
+
+def urlset(locs):
+    return '<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' + \
+        ''.join(f'<url><loc>{loc}</loc><lastmod>2021-06-01T00:00:00+08:00</lastmod></url>' for loc in locs) + '</urlset>'
+
+#Article indexes listed on sitemap page page_num, counting from 1
+def page_range(page_num):
+    return range((page_num - 1) * ARTICLES_PER_SITEMAP_PAGE, min(page_num * ARTICLES_PER_SITEMAP_PAGE, NUM_ARTICLES))
+
+class FixtureServer:
+    def __init__(self, port = PORT):
+        self.bases = {site: site_base(site, port) for site in SITES}
+        self.port = port
+        self.fixtures = Fixtures()
+        self.num_requests = {}
+        self.num_hits = {} #Per path, a refetch of a failed article gets a fresh draw
+
+    def sitemap(self, site, request):
+        base = self.bases[site]
+        if site == 'zb':
+            if request.path == '/zb/sitemap.xml':
+                return '<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' + \
+                    ''.join(f'<sitemap><loc>{base}/zb/sitemaps/sitemap-{page_num}.xml</loc></sitemap>' for page_num in range(1, num_sitemap_pages() + 1)) + '</sitemapindex>'
+            page_num = int(request.path.rsplit('-', 1)[1].split('.')[0])
+            return urlset(f'<![CDATA[ {base}/zb/news/singapore/story-{idx} ]]>' for idx in page_range(page_num))
+
+        page_num = int(request.query.get('page', 1))
+        if site == '8w':
+            page_num -= 3 - 1 #scrape_8w.SITEMAP_START
+            return urlset(f'http://default/news/singapore/article/article-{idx}' for idx in page_range(page_num))
+        if site == 'st':
+            #The front page and multimedia links are filtered out by the scraper
+            return urlset([f'{base}/st/'] + [f'{base}/st/singapore/article-{idx}' for idx in page_range(page_num)] + [f'{base}/st/multimedia/video-{page_num}'])
+        return urlset(f'{base}/cna/singapore/article-{idx}' for idx in page_range(page_num))
+
+    def smd_search(self, request):
+        page_num = int(request.query.get('page', 1))
+        rows = ''.join(f'<div class="table-row" onclick="window.location=\'/smd/terms/term-{idx}\'"><div class="ch">词语{idx}</div><div class="en">term {idx}</div></div>' for idx in page_range(page_num))
+        return f'<html><body><div class="table-row header"><div class="ch">华文</div><div class="en">English</div></div>{rows}</body></html>'
+
+    async def handle(self, request):
+        response = await self.respond(request)
+        if COMPRESS:
+            response.enable_compression()
+        return response
+
+    #Sites are told apart by the first part of the path, every address serves all of them
+    async def respond(self, request):
+        site = request.path.split('/')[1]
+        self.num_requests[site] = self.num_requests.get(site, 0) + 1
+        if site == 'smd' and request.path == '/smd/search':
+            return web.Response(text=self.smd_search(request), content_type='text/html')
+        if 'sitemap' in request.path.lower():
+            return web.Response(text=self.sitemap(site, request), content_type='application/xml')
+
+        self.num_hits[request.path] = self.num_hits.get(request.path, 0) + 1
+        rng = random.Random(f'{SEED}:{request.path}:{self.num_hits[request.path]}')
+        await asyncio.sleep(SITE_LATENCY.get(site, LATENCY) * rng.uniform(0.5, 1.5))
+        draw = rng.random()
+        if draw < ERROR_RATE:
+            return web.Response(status=500, text='Internal Server Error')
+        if draw < ERROR_RATE + ACCESS_DENIED_RATE:
+            return web.Response(status=403, text=ACCESS_DENIED_PAGE, content_type='text/html')
+        idx = int(request.path.rsplit('-', 1)[1])
+        return web.Response(body=self.fixtures.article(site, idx), content_type='text/html', charset='utf-8')
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = web.Application()
+            app.router.add_get('/{path:.*}', self.handle)
+            runner = web.AppRunner(app, access_log=None)
+            loop.run_until_complete(runner.setup())
+            for site in SITES:
+                loop.run_until_complete(web.TCPSite(runner, SITE_HOSTS[site], self.port).start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+
+#Points a scraper module at the fixture server, every path is relative to the worker's scratch directory
+def configure(scraper, site, base):
+    num_pages = num_sitemap_pages()
+    scraper.USE_CACHE = True #The cache is built by discovery in the scratch directory, so it is always timed
+    if site == 'smd':
+        scraper.BASE_WEBSITE = base
+        scraper.SCRAPING_WEBSITE = f'{base}/smd/search'
+        scraper.NUM_PAGES = num_pages
+        return
+
+    scraper.RETRY_FAILED = RETRY_FAILED
+    scraper.DEDUP = DEDUP
+    if site == 'cna':
+        scraper.DEFAULT_WEBSITE = f'{base}/cna'
+        scraper.SITEMAP = f'{base}/cna/sitemap.xml'
+        scraper.SITEMAP_NUM_PAGES = num_pages
+    elif site == '8w':
+        scraper.DEFAULT_WEBSITE = f'{base}/8w/'
+        scraper.SITEMAP = f'{base}/8w/Sitemap.xml'
+        scraper.SITEMAP_NUM_PAGES = scraper.SITEMAP_START + num_pages - 1
+    elif site == 'st':
+        scraper.DEFAULT_WEBSITE = f'{base}/st'
+        scraper.SITEMAP = f'{base}/st/sitemap.xml'
+        scraper.SITEMAP_NUM_PAGES = num_pages
+    elif site == 'zb':
+        scraper.DEFAULT_WEBSITE = f'{base}/zb/'
+        scraper.SITEMAP = f'{base}/zb/sitemap.xml'
+
+#Documents written by the run in the current directory
+def count_documents(site):
+    if site == 'smd':
+        with open('output/smd_corpus.zh', 'r', encoding='utf-8') as zh_file:
+            return zh_file.read().count('\n\n')
+    with open(glob.glob(f'reports/{site}-*.json')[0], 'r', encoding='utf-8') as report_file:
+        return json.load(report_file)['documents']
+
+#host -> limits over every run report in the current directory, see metrics.RunMetrics.observe_host
+def host_limits():
+    hosts = {}
+    for filepath in glob.glob('reports/*.json'):
+        with open(filepath, 'r', encoding='utf-8') as report_file:
+            hosts.update(json.load(report_file).get('hosts', {}))
+    return hosts
+
+#Runs in the child process, from inside its scratch directory. site 'all' crawls every site in SITES with crawl_all.py
+def run_worker(site, port):
+    for directory in ('cache', 'errorlinks', 'output', 'reports'):
+        os.makedirs(directory, exist_ok=True)
+    sites = SITES if site == 'all' else [site]
+    for name in sites:
+        configure(__import__(f'scrape_{name}'), name, site_base(name, port))
+    if site == 'all':
+        crawl_all = __import__('crawl_all')
+        crawl_all.SITES = SITES
+        crawl_all.main()
+    else:
+        __import__(f'scrape_{site}').main()
+    with open('documents.json', 'w', encoding='utf-8') as documents_file:
+        json.dump({'documents': sum(count_documents(name) for name in sites), 'hosts': host_limits()}, documents_file)
+
+#Runs one site, or 'all', in a fresh process and scratch directory, the rusage from wait4 covers the process and its parse processes
+def run_site(server, site):
+    num_requests = sum(server.num_requests.values())
+    with tempfile.TemporaryDirectory(prefix=f'benchmark_{site}_') as workdir:
+        with open(os.path.join(workdir, 'log.txt'), 'w', encoding='utf-8') as log_file:
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', site, str(server.port)], cwd=workdir, stdout=log_file, stderr=subprocess.STDOUT)
+            _, status, rusage = os.wait4(process.pid, 0)
+            wall = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            with open(os.path.join(workdir, 'log.txt'), 'r', encoding='utf-8') as log_file:
+                raise RuntimeError(f'{site} benchmark failed:\n{log_file.read()[-3000:]}')
+        with open(os.path.join(workdir, 'documents.json'), 'r', encoding='utf-8') as documents_file:
+            worker_results = json.load(documents_file)
+
+    return {
+        'site': site,
+        'documents': worker_results['documents'],
+        'requests': sum(server.num_requests.values()) - num_requests,
+        'wall_seconds': wall,
+        'docs_per_second': worker_results['documents'] / wall,
+        'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+        'peak_rss_mb': rusage.ru_maxrss / 1024, #KB on Linux, largest of the process and its parse processes
+        'hosts': worker_results['hosts'], #Concurrency limit per host at the end of the run, with its range and peak in flight
+    }
+
+#Saves a few live article pages per site so the benchmark serves real markup
+def record():
+    import requests
+    for site in SITES:
+        scraper = __import__(f'scrape_{site}')
+        if site == 'smd':
+            scraper.NUM_PAGES = 1
+            article_list = scraper.gather_urls()[0]
+        else:
+            article_list = scraper.gather_urls()
+        os.makedirs(os.path.join(FIXTURES_DIR, site), exist_ok=True)
+        for idx, article in enumerate(article_list[:RECORD_ARTICLES]):
+            r = requests.get(article, headers=scraper.HEADERS)
+            with open(os.path.join(FIXTURES_DIR, site, f'article-{idx}.html'), 'wb') as fixture_file:
+                fixture_file.write(r.content)
+        print(f'Recorded {min(len(article_list), RECORD_ARTICLES)} {site} articles into {os.path.join(FIXTURES_DIR, site)}')
+
+def main():
+    if RECORD:
+        record()
+        return
+
+    print(f'{NUM_ARTICLES=} {LATENCY=} {SITE_LATENCY=} {ERROR_RATE=} {ACCESS_DENIED_RATE=}')
+    server = FixtureServer()
+    server.start()
+    results = []
+    for site in SITES + ['all'] if COMBINED else SITES:
+        result = run_site(server, site)
+        results.append(result)
+        print(f'{site:>4}: {result["documents"]:6d} docs {result["requests"]:6d} requests {result["wall_seconds"]:7.1f}s wall '
+              f'{result["docs_per_second"]:8.1f} docs/s {result["cpu_seconds"]:7.1f}s CPU {result["peak_rss_mb"]:7.1f} MB peak RSS')
+        for host, limits in sorted(result['hosts'].items()):
+            print(f'      {host}: limit {limits["limit"]:.1f} (range {limits["min_limit"]:.1f}-{limits["max_limit"]:.1f}), up to {limits["max_in_flight"]} in flight')
+
+    if RESULTS_FILEPATH:
+        os.makedirs(os.path.dirname(RESULTS_FILEPATH) or '.', exist_ok=True)
+        with open(RESULTS_FILEPATH, 'w', encoding='utf-8') as results_file:
+            json.dump({'num_articles': NUM_ARTICLES, 'latency': LATENCY, 'site_latency': SITE_LATENCY, 'error_rate': ERROR_RATE, 'access_denied_rate': ACCESS_DENIED_RATE, 'results': results}, results_file, indent=2)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
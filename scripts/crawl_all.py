@@ -0,0 +1,152 @@
+import concurrent.futures
+import importlib
+import itertools
+import logging
+import os
+import time
+import engine
+import retryqueue
+import records
+import dedup
+import profiling
+from sitemapsite import SitemapSite
+from tqdm import tqdm
+
+#MULTI SITE WEB CRAWLER FOR BACK TRANSLATION
+#Crawls every site in SITES in one process. engine.crawl_sites interleaves their URLs, so a slow or throttled
+#host only holds the requests it is allowed and the others keep the network busy. All sites share MAX_IN_FLIGHT,
+#the connection pool and the parse processes, every host keeps its own adaptive limit.
+#Each site runs with the settings at the top of its scraper (USE_CACHE, RESUME, INCREMENTAL, RETRY_FAILED...),
+#a sitemap site through the same sitemapsite.SitemapSite its scraper's main() uses
+
+SITES = ['cna', '8w', 'st', 'zb', 'smd']
+MAX_IN_FLIGHT = 2000 #URLs being fetched, parsed or waiting to be written across all sites
+NUM_PARSERS = os.cpu_count() #Parse processes shared by all sites
+#Site registry, name -> scraper module. Scrapers with iter_urls crawl from their sitemaps with a crawl state,
+#the others (SMD) from their own load_terms
+REGISTRY = {
+    'cna': 'scrape_cna',
+    '8w': 'scrape_8w',
+    'st': 'scrape_st',
+    'zb': 'scrape_zb',
+    'smd': 'scrape_smd',
+}
+
+#The scrapers set up the root logger for their errorlinks file on import, which only takes effect for the
+#first one imported, so each site gets a logger of its own
+def site_logger(name, filepath):
+    logger = logging.getLogger(f'errorlinks.{name}')
+    handler = logging.FileHandler(filepath, mode='a', encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.ERROR)
+    logger.propagate = False
+    return logger
+
+#Same steps as scrape_smd.main(), the term pairs come from its search pages and go to two aligned files
+class TermSite:
+    def __init__(self, name, scraper):
+        self.name = name
+        self.scraper = scraper
+        self.retry = False
+        self.terms = scraper.load_terms()
+        self.article_list = (article for article, _, _ in self.terms)
+        self.num_articles = len(self.terms)
+        self.records = scraper.OUTPUT_FORMAT != 'text'
+        if self.records:
+            self.output_file = records.open_output(scraper.OUTPUT_FORMAT, None, scraper.RECORDS_FILEPATH)
+        else:
+            self.zh_file = open(scraper.OUTPUT_ZH, 'w', encoding='utf8')
+            self.en_file = open(scraper.OUTPUT_EN, 'w', encoding='utf8')
+
+    def job(self, article_list):
+        return engine.SiteJob(self.name, article_list, self.scraper.extract_article, self.scraper.handle_fetch_error, self.scraper.HEADERS, self.scraper.ORDERED_OUTPUT)
+
+    def write(self, crawled):
+        if crawled.result is None: #Fetch failed, logged by handle_fetch_error. Skipped whole so both files stay aligned
+            return
+        _, zh_term, en_term = self.terms[crawled.idx]
+        if self.records:
+            self.output_file.write(self.scraper.build_term_record(crawled.url, zh_term, en_term, crawled.result))
+        else:
+            self.scraper.write_term(self.zh_file, self.en_file, zh_term, en_term, crawled.result)
+
+    def close(self):
+        if self.records:
+            self.output_file.close()
+        else:
+            self.zh_file.close()
+            self.en_file.close()
+
+#Yields (name, engine.CrawlResult) for the failed URLs of every site as their retries come due, the due URLs
+#of all sites are crawled together. Stops once nothing is due within max_wait, like retryqueue.crawl_failed.
+def crawl_failed(sites, crawl_jobs, max_wait = retryqueue.MAX_WAIT):
+    while True:
+        jobs = []
+        for site in sites:
+            retry_list = site.due_retries()
+            if retry_list:
+                print(f'{site.name}: retrying {len(retry_list)} failed URLs')
+                jobs.append(site.job(retry_list))
+        if jobs:
+            yield from crawl_jobs(jobs)
+            continue
+
+        waits = [wait for wait in (site.next_retry_wait() for site in sites) if wait is not None]
+        if not waits or min(waits) > max_wait:
+            return
+        time.sleep(min(waits))
+
+def main():
+    print(f'{SITES=}')
+    print(f'{MAX_IN_FLIGHT=}')
+
+    scrapers = {name: importlib.import_module(REGISTRY[name]) for name in SITES}
+    if profiling.enabled(): #python crawl_all.py --profile profiles the sitemap sites one after the other, see profiling.py
+        for name, scraper in scrapers.items():
+            if hasattr(scraper, 'iter_urls'):
+                profiling.profile_site(name, scraper)
+            else:
+                print(f'{name}: only sitemap sites can be profiled')
+        return
+    #One index for all sites, so an article syndicated between them is only written once
+    dedup_index = dedup.DedupIndex() if any(getattr(scraper, 'DEDUP', False) for scraper in scrapers.values()) else None
+    sites = []
+    for name, scraper in scrapers.items():
+        if getattr(scraper, 'REEXTRACT', False):
+            print(f'{name}: REEXTRACT is set, run {REGISTRY[name]}.py on its own to re-extract its archive')
+            continue
+        scraper.logger = site_logger(name, scraper.ERROR_LINK)
+        sites.append(SitemapSite(name, scraper, dedup_index) if hasattr(scraper, 'iter_urls') else TermSite(name, scraper))
+    sites_by_name = {site.name: site for site in sites}
+
+    #Started before the crawl threads exist, the sites' modules and loggers are set up by now
+    parse_executor = concurrent.futures.ProcessPoolExecutor(NUM_PARSERS)
+    parse_executor.submit(int).result()
+
+    def crawl_jobs(jobs):
+        return engine.crawl_sites(jobs, max_in_flight=MAX_IN_FLIGHT, parse_executor=parse_executor)
+
+    print('Starting article scraping...')
+    results = crawl_jobs([site.job(site.article_list) for site in sites])
+    retry_sites = [site for site in sites if site.retry]
+    if retry_sites:
+        results = itertools.chain(results, crawl_failed(retry_sites, crawl_jobs))
+    num_articles = None if any(site.num_articles is None for site in sites) else sum(site.num_articles for site in sites)
+
+    try:
+        for name, crawled in tqdm(results, total=num_articles):
+            sites_by_name[name].write(crawled)
+    finally:
+        for site in sites:
+            site.close()
+        if dedup_index:
+            dedup.print_report(dedup_index)
+            dedup_index.close()
+        parse_executor.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    t1 = time.perf_counter()
+    main()
+    t2 = time.perf_counter()
+    print(f'Program took {t2-t1} seconds to complete')
@@ -0,0 +1,215 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from array import array
+from frontier import url_key
+
+#CORPUS WIDE PARAGRAPH DEDUPLICATION, EXACT AND NEAR DUPLICATES
+#Every paragraph written is checked against one index shared by all sites and runs: an exact hash of its
+#normalized text, and for paragraphs of MIN_NEAR_CHARS or more a MinHash signature whose bands are looked up
+#(LSH) to find paragraphs that are nearly the same, like a wire story with a different byline or a changed figure.
+#The index is a SQLite file, it grows on disk and only its page cache (CACHE_MB) is held in memory.
+#A paragraph belongs to the URL it was first written for, so recrawling, resuming or re-extracting an article
+#never drops its own paragraphs, only the copies of them in other articles.
+
+DEDUP_FILEPATH = 'cache/dedup.sqlite' #Shared by all sites so text syndicated between them is only kept once
+SHINGLE_SIZE = 5 #Characters per shingle, works for English and Chinese alike
+NUM_BINS = 64 #MinHash values per signature
+NUM_BANDS = 16 #LSH bands of NUM_BINS // NUM_BANDS values, 16 of 4 find paragraphs above 0.8 similarity 99.9% of the time
+NEAR_THRESHOLD = 0.8 #Estimated Jaccard similarity of the shingles above which a paragraph is a near duplicate
+MIN_NEAR_CHARS = 50 #Shorter paragraphs (bylines, captions, READ MORE HERE) are only checked for exact duplicates
+CACHE_MB = 64 #SQLite page cache of the index
+BUSY_TIMEOUT = 60 #Seconds to wait for another crawl writing to the same index
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paragraphs (
+    hash INTEGER PRIMARY KEY,
+    owner INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    key INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (key, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sites (
+    site TEXT PRIMARY KEY,
+    paragraphs INTEGER NOT NULL DEFAULT 0,
+    chars INTEGER NOT NULL DEFAULT 0,
+    exact_duplicates INTEGER NOT NULL DEFAULT 0,
+    near_duplicates INTEGER NOT NULL DEFAULT 0,
+    chars_removed INTEGER NOT NULL DEFAULT 0
+);
+'''
+SITE_COUNTS = ('paragraphs', 'chars', 'exact_duplicates', 'near_duplicates', 'chars_removed')
+ADD_COUNTS = f'''
+INSERT INTO sites (site, {", ".join(SITE_COUNTS)}) VALUES (?, {", ".join("?" * len(SITE_COUNTS))})
+ON CONFLICT(site) DO UPDATE SET {", ".join(f"{count} = {count} + excluded.{count}" for count in SITE_COUNTS)}
+'''
+
+#Signed 64 bit hash, what a SQLite INTEGER holds
+def key(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)
+
+#Case and whitespace differences do not make a paragraph new
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+#One permutation MinHash: each shingle is hashed once, the hash picks one of NUM_BINS bins and the smallest
+#value per bin is kept. Bins no shingle fell in take the value of the next filled bin, shifted by the distance,
+#so short paragraphs still get comparable signatures. The text is encoded as UTF-32 so every shingle is a
+#fixed width slice of it, CRC-32 is enough to spread shingles over the bins and far cheaper than a blake2b each.
+def signature(text):
+    data = text.encode('utf-32-le')
+    width = 4 * SHINGLE_SIZE
+    bins = [None] * NUM_BINS
+    for start in range(0, max(len(data) - width, 0) + 1, 4):
+        value = zlib.crc32(data[start:start + width])
+        idx, value = value % NUM_BINS, value // NUM_BINS
+        if bins[idx] is None or value < bins[idx]:
+            bins[idx] = value
+    filled = [idx for idx, value in enumerate(bins) if value is not None]
+    for idx in range(NUM_BINS):
+        if bins[idx] is None:
+            distance = next(((other - idx) % NUM_BINS for other in filled if other > idx), filled[0] + NUM_BINS - idx)
+            bins[idx] = bins[(idx + distance) % NUM_BINS] + distance
+    return array('I', bins)
+
+def band_keys(sig):
+    rows = NUM_BINS // NUM_BANDS
+    return [key(bytes([band]) + sig[band * rows:(band + 1) * rows].tobytes()) for band in range(NUM_BANDS)]
+
+#Share of equal values, an estimate of the Jaccard similarity of the two paragraphs' shingles
+def similarity(sig, other):
+    return sum(a == b for a, b in zip(sig, other)) / NUM_BINS
+
+#The index on disk, shared by the crawls writing to it at the same time. Each article's paragraphs are looked up
+#and added in one short transaction that takes the write lock up front, so two crawls never both add the same
+#paragraph and neither holds the lock while it crawls. The per site counts are added when the writers flush.
+#A commit that is lost in a crash only means the paragraphs of the last articles are not known yet.
+class DedupIndex:
+    def __init__(self, filepath = DEDUP_FILEPATH):
+        self.filepath = filepath
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT, isolation_level=None) #Transactions are begun explicitly
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL') #No fsync per article, WAL still keeps the file consistent
+        self.conn.execute(f'PRAGMA cache_size={-CACHE_MB * 1024}') #Negative is in KB
+        self.conn.executescript(SCHEMA)
+        self.counts = {} #site -> counts added since the last commit
+
+    #'exact', 'near' or None if the normalized paragraph is new, in which case it is added to the index for owner
+    def check(self, normalized, owner):
+        paragraph_hash = key(normalized.encode('utf-8'))
+        row = self.conn.execute('SELECT owner FROM paragraphs WHERE hash = ?', (paragraph_hash,)).fetchone()
+        if row is not None:
+            return 'exact' if row[0] != owner else None
+
+        if len(normalized) >= MIN_NEAR_CHARS:
+            sig = signature(normalized)
+            keys = band_keys(sig)
+            candidates = self.conn.execute(f'''
+                SELECT DISTINCT signatures.owner, signatures.signature FROM bands JOIN signatures ON signatures.id = bands.id
+                WHERE bands.key IN ({",".join("?" * len(keys))})''', keys).fetchall()
+            for candidate_owner, candidate in candidates:
+                if candidate_owner != owner and similarity(sig, array('I', candidate)) >= NEAR_THRESHOLD:
+                    return 'near' #Not added, so the article is judged the same way when it is crawled again
+            sig_id = self.conn.execute('INSERT INTO signatures (owner, signature) VALUES (?, ?)', (owner, sig.tobytes())).lastrowid
+            self.conn.executemany('INSERT OR IGNORE INTO bands (key, id) VALUES (?, ?)', [(band_key, sig_id) for band_key in keys])
+        self.conn.execute('INSERT INTO paragraphs (hash, owner) VALUES (?, ?)', (paragraph_hash, owner))
+        return None
+
+    #The paragraphs of one article that are not duplicates, repeats within the article are dropped too
+    def filter_paragraphs(self, paragraphs, url, site, metrics = None):
+        owner = key(url_key(url).encode('utf-8'))
+        counts = self.counts.setdefault(site, dict.fromkeys(SITE_COUNTS, 0))
+        seen = set()
+        kept = []
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for paragraph in paragraphs:
+                if not paragraph.strip():
+                    kept.append(paragraph)
+                    continue
+                normalized = normalize(paragraph)
+                duplicate = 'exact' if normalized in seen else self.check(normalized, owner)
+                seen.add(normalized)
+                counts['paragraphs'] += 1
+                counts['chars'] += len(paragraph)
+                if duplicate is None:
+                    kept.append(paragraph)
+                    continue
+                counts[f'{duplicate}_duplicates'] += 1
+                counts['chars_removed'] += len(paragraph)
+                if metrics is not None:
+                    metrics.count_duplicate(duplicate, len(paragraph))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return kept
+
+    #Article text with one paragraph per line, or a records.py record, without its duplicate paragraphs
+    #None when nothing is left
+    def filter(self, article, url, site, metrics = None):
+        if isinstance(article, dict):
+            paragraphs = self.filter_paragraphs(article['paragraphs'], url, site, metrics)
+            return {**article, 'paragraphs': paragraphs} if paragraphs else None
+        lines = self.filter_paragraphs(article.split('\n'), url, site, metrics)
+        return '\n'.join(lines) if any(line.strip() for line in lines) else None
+
+    def commit(self):
+        if not self.counts:
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for site, counts in self.counts.items():
+                self.conn.execute(ADD_COUNTS, (site, *counts.values()))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.counts = {}
+
+    #{site: counts} over every run that used the index
+    def site_counts(self):
+        return {row[0]: dict(zip(SITE_COUNTS, row[1:])) for row in self.conn.execute(f'SELECT site, {", ".join(SITE_COUNTS)} FROM sites ORDER BY site')}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+#What a writer is given to deduplicate one site's articles against the shared index
+class SiteDedup:
+    def __init__(self, index, site, metrics = None):
+        self.index = index
+        self.site = site
+        self.metrics = metrics
+
+    def filter(self, article, url):
+        return self.index.filter(article, url, self.site, self.metrics)
+
+    def commit(self):
+        self.index.commit()
+
+def print_report(index):
+    for site, counts in index.site_counts().items():
+        removed = counts['exact_duplicates'] + counts['near_duplicates']
+        share = counts['chars_removed'] / counts['chars'] if counts['chars'] else 0.0
+        print(f"{site}: {removed} of {counts['paragraphs']} paragraphs removed ({counts['exact_duplicates']} exact, {counts['near_duplicates']} near), "
+            f"{counts['chars_removed']} of {counts['chars']} chars ({share:.1%})")
+
+if __name__ == '__main__':
+    t1 = time.perf_counter()
+    dedup_index = DedupIndex(sys.argv[1] if len(sys.argv) > 1 else DEDUP_FILEPATH)
+    print_report(dedup_index)
+    dedup_index.close()
+    t2 = time.perf_counter()
+    print(f'Program took {t2-t1} seconds to complete')
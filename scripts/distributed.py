@@ -0,0 +1,210 @@
+import importlib
+import os
+import socket
+import sys
+import threading
+import time
+import engine
+import linkcache
+import metrics
+import records
+import sitemapsite
+import workqueue
+from crawl_all import REGISTRY, site_logger
+from frontier import Frontier
+from state import MAX_ATTEMPTS
+from writer import ArticleWriter
+from tqdm import tqdm
+
+#CRAWLS ONE SITE FROM SEVERAL MACHINES THROUGH A SHARED workqueue.py QUEUE
+#  python distributed.py enqueue   fills the queue from the site's link cache (discovering it first if needed), run once
+#  python distributed.py node      crawls leased batches until the queue is empty, run on every machine
+#  python distributed.py status    prints how far the crawl is
+#Each node writes its own output file, OUTPUT_FILEPATH output/zb_corpus.txt becomes output/zb_corpus.<NODE_ID>.txt,
+#and every batch is written and committed as a whole. A batch a node did not complete, because it died or lost
+#its lease, is crawled again by another node and cut out of the first node's file, so every article is in
+#exactly one node file. The site's own settings (HEADERS, OUTPUT_FORMAT, QUALITY_FILTER, SPLIT_SENTENCES...) are
+#taken from its scraper, rejected paragraphs go to a node file next to REJECTED_FILEPATH. Nodes do not dedup,
+#the shared index is written by one process at a time.
+
+SITE = 'zb' #Any sitemap site of crawl_all.REGISTRY
+QUEUE_BACKEND = workqueue.SqliteQueue #Needs QUEUE_FILEPATH on a disk every node can reach, see workqueue.py
+QUEUE_FILEPATH = f'cache/queue_{SITE}.sqlite'
+NODE_ID = socket.gethostname() #Has to be unique per node and stay the same when a node is restarted
+PARTITIONS = None #Partitions this node takes first, e.g. range(0, 32) and range(32, 64) on two nodes, None for any
+NUM_PARTITIONS = workqueue.NUM_PARTITIONS
+BATCH_SIZE = workqueue.BATCH_SIZE
+LEASE_SECONDS = workqueue.LEASE_SECONDS
+POLL_INTERVAL = 5 #Seconds between looks at the queue while the last batches are leased by other nodes
+WRITERS = {'text': ArticleWriter, 'jsonl': records.JsonlWriter} #Output formats a node can cut back to a batch boundary
+
+#Output file of a node, next to the scraper's
+def node_filepath(filepath, node_id):
+    root, ext = os.path.splitext(filepath)
+    return f'{root}.{node_id}{ext}'
+
+#One machine's share of the crawl. URLs are leased batch by batch as the engine asks for more, each batch's
+#results are held until all of them are in and then written to the node file and committed with the queue.
+class Node:
+    def __init__(self, scraper, work_queue, node_id):
+        if scraper.OUTPUT_FORMAT not in WRITERS or scraper.OUTPUT_SHARDS:
+            raise ValueError(f"A node writes OUTPUT_FORMAT 'text' or 'jsonl' to a single file, not {scraper.OUTPUT_FORMAT!r} with {scraper.OUTPUT_SHARDS=}")
+        self.scraper = scraper
+        self.queue = work_queue
+        self.node_id = node_id
+        self.metrics = metrics.RunMetrics(f'{SITE}.{node_id}')
+        self.filepath = node_filepath(scraper.RECORDS_FILEPATH if scraper.OUTPUT_FORMAT == 'jsonl' else scraper.OUTPUT_FILEPATH, node_id)
+
+        #Batches written after the last commit are cut off, the queue hands them out again
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        with open(self.filepath, 'a', encoding='utf-8'):
+            pass
+        os.truncate(self.filepath, work_queue.get_offset(self.filepath))
+        #No dedup_index, see above
+        self.options = records.scraper_options(SITE, scraper, self.metrics, rejected_filepath=node_filepath(scraper.REJECTED_FILEPATH, node_id))
+        self.output_file = WRITERS[scraper.OUTPUT_FORMAT](self.filepath, mode='a', **self.options)
+
+        self.lock = threading.Lock()
+        self.leases = {} #batch -> Lease of the batches being crawled
+        self.results = {} #batch -> CrawlResults in so far
+        self.lease_of = {} #Position of a URL in leased_urls(), the engine's CrawlResult.idx -> Lease it came from
+        self.num_leased_urls = 0
+        self.stopped = threading.Event()
+        self.num_lost = 0
+
+    #Read by the engine's feeder thread, leases a batch whenever the URLs of the last one are taken
+    #Once nothing is queued it waits for the batches still leased, by this or other nodes, as they
+    #may fail or run out and come back, and ends when every batch is completed
+    def leased_urls(self):
+        while not self.stopped.is_set():
+            lease = self.queue.lease(self.node_id, LEASE_SECONDS, PARTITIONS)
+            if lease is None:
+                if self.queue.requeue_failed(MAX_ATTEMPTS, BATCH_SIZE):
+                    continue
+                if not self.queue.num_pending():
+                    return
+                self.stopped.wait(POLL_INTERVAL)
+                continue
+            if not lease.urls:
+                self.queue.complete(lease, [], None, None) #All its URLs were moved to retry batches
+                continue
+            #A batch this node lost and leased again gets a new token, results of the old lease still coming in are dropped
+            with self.lock:
+                self.leases[lease.batch] = lease
+                self.results[lease.batch] = []
+                for idx in range(self.num_leased_urls, self.num_leased_urls + len(lease.urls)):
+                    self.lease_of[idx] = lease
+                self.num_leased_urls += len(lease.urls)
+            yield from lease.urls
+
+    #Renews the leases of the batches being crawled every third of LEASE_SECONDS, a batch whose lease is
+    #lost is dropped, its results are thrown away as they come in
+    def renew_leases(self):
+        while not self.stopped.wait(LEASE_SECONDS / 3):
+            with self.lock:
+                leases = list(self.leases.values())
+            for lease in leases:
+                if not self.queue.renew(lease, LEASE_SECONDS):
+                    self.drop(lease)
+
+    def is_current(self, lease):
+        current = self.leases.get(lease.batch)
+        return current is not None and current.token == lease.token
+
+    def drop(self, lease):
+        with self.lock:
+            if self.is_current(lease):
+                del self.leases[lease.batch]
+                del self.results[lease.batch]
+                self.num_lost += 1
+
+    def add_result(self, crawled):
+        with self.lock:
+            lease = self.lease_of.pop(crawled.idx)
+            if not self.is_current(lease):
+                return
+            batch_results = self.results[lease.batch]
+            batch_results.append(crawled)
+            if len(batch_results) < len(lease.urls):
+                return
+            del self.leases[lease.batch]
+            del self.results[lease.batch]
+        self.commit(lease, batch_results)
+
+    #Writes a finished batch to the node file and completes it with the offset after it. If the lease was lost
+    #in the meantime the file is cut back to where the batch started.
+    def commit(self, lease, batch_results):
+        output_file = self.output_file.output_file
+        start = output_file.tell()
+        for crawled in batch_results:
+            self.output_file.write(self.scraper.format_output(crawled), crawled)
+        self.output_file.flush()
+        os.fsync(output_file.fileno())
+        if not self.queue.complete(lease, [(crawled.url, crawled.status, crawled.reason) for crawled in batch_results], self.filepath, output_file.tell()):
+            os.truncate(self.filepath, start)
+            output_file.seek(0, os.SEEK_END)
+            self.num_lost += 1
+
+    def run(self):
+        renewer = threading.Thread(target=self.renew_leases, daemon=True)
+        renewer.start()
+        results = engine.crawl_job(sitemapsite.site_job(SITE, self.scraper, self.leased_urls(), run_metrics=self.metrics))
+        try:
+            for crawled in tqdm(results):
+                self.add_result(crawled)
+        finally:
+            self.stopped.set()
+            results.close()
+            with self.lock:
+                leases = list(self.leases.values())
+                self.leases.clear()
+            for lease in leases: #Handed back so the other nodes need not wait for them to run out
+                self.queue.release(lease)
+            self.output_file.close()
+            if self.options['quality']:
+                self.options['quality'].close()
+            self.metrics.finish()
+            print(f'{self.node_id}: run report saved to {self.metrics.write_json(self.scraper.REPORT_DIR)}')
+            print(f'{self.node_id}: {self.num_lost} batches lost to other nodes after their lease ran out')
+
+def load_scraper():
+    scraper = importlib.import_module(REGISTRY[SITE])
+    if not hasattr(scraper, 'iter_urls'):
+        raise ValueError(f'{SITE} has no sitemap, only the sitemap sites of crawl_all.REGISTRY can be crawled by nodes')
+    return scraper
+
+def enqueue(scraper, work_queue):
+    link_list, _ = linkcache.load_articles(scraper.CACHE_FILEPATH, scraper.iter_urls, scraper.USE_CACHE, getattr(scraper, 'NUM_URLS_TO_SCRAPE', -1), sample=scraper.SAMPLE_URLS)
+    frontier = Frontier()
+    num_added = work_queue.enqueue((link for link, _ in frontier.filter(link_list)), NUM_PARTITIONS, BATCH_SIZE)
+    print(f'Queued {num_added} new URLs from {scraper.CACHE_FILEPATH}, skipped {frontier.num_duplicates} duplicate URLs')
+
+def print_status(work_queue):
+    batch_counts, url_counts = work_queue.counts()
+    print(f'Batches: {batch_counts}')
+    print(f'URLs: {url_counts}')
+
+def main(role):
+    print(f'{SITE=}')
+    print(f'{QUEUE_FILEPATH=}')
+    work_queue = QUEUE_BACKEND(QUEUE_FILEPATH)
+    if role == 'status':
+        print_status(work_queue)
+        return
+
+    scraper = load_scraper()
+    if role == 'enqueue':
+        enqueue(scraper, work_queue)
+    elif role == 'node':
+        print(f'{NODE_ID=}')
+        scraper.logger = site_logger(SITE, scraper.ERROR_LINK)
+        Node(scraper, work_queue, NODE_ID).run()
+    else:
+        raise ValueError(f"Unknown role {role!r}, use 'enqueue', 'node' or 'status'")
+    print_status(work_queue)
+
+if __name__ == '__main__':
+    t1 = time.perf_counter()
+    main(sys.argv[1] if len(sys.argv) > 1 else 'node')
+    t2 = time.perf_counter()
+    print(f'Program took {t2-t1} seconds to complete')
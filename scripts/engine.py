@@ -0,0 +1,474 @@
+import asyncio
+import aiohttp
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+import streaming
+import transport
+from ratecontrol import HostController, THROTTLE_STATUSES, parse_retry_after
+
+#SHARED ASYNC CRAWL ENGINE FOR THE BACK TRANSLATION SCRAPERS
+
+MAX_IN_FLIGHT = 1000 #Max URLs being fetched, parsed or waiting to be consumed at any time
+NUM_PARSERS = os.cpu_count() #Processes in the parse stage, sized separately from the fetch stage
+PARSE_BATCH_SIZE = 16 #Pages sent to a parse process per task to cut pickling/IPC overhead
+PARSE_BATCH_WAIT = 0.05 #Seconds a partial batch waits for more pages before it is sent anyway
+PER_HOST_LIMIT = 100 #Default max concurrent requests to a single host, the adaptive limit never goes above it
+ADAPTIVE = True #Let ratecontrol.HostController find each host's limit from its responses
+THROTTLE_RETRIES = 3 #Times a throttled request or blocked page is fetched again after the host has been paused
+TIMEOUT = 60 #Seconds allowed per request
+CONNECT_RETRIES = 3 #Same policy as Retry(connect=3, backoff_factor=0.5) used with requests
+BACKOFF_FACTOR = 0.5
+
+#Outcome of each URL, stored by state.CrawlState
+DONE = 'done'
+EMPTY = 'empty'
+ACCESS_DENIED = 'access_denied'
+ERROR = 'error'
+NOT_MODIFIED = 'not_modified' #304 to a conditional request, nothing is parsed
+
+#result is whatever extract_article or handle_fetch_error returned, num_bytes is the downloaded body size
+#etag and last_modified are the response validators, used for conditional requests on the next crawl
+#reason says why an ERROR or ACCESS_DENIED URL failed, kept by the state for retries
+CrawlResult = collections.namedtuple('CrawlResult', ['idx', 'url', 'result', 'status', 'num_bytes', 'etag', 'last_modified', 'reason'], defaults=[None, None, None])
+
+#Server errors are failures to retry later rather than pages to parse
+class HTTPStatusError(Exception):
+    pass
+
+#extract_article raised on a page, the message names the original exception
+class ParseError(Exception):
+    pass
+
+_END = object()
+
+def get_status(result):
+    if result == -1:
+        return ACCESS_DENIED
+    return DONE if result else EMPTY
+
+#One ratecontrol.HostController per host, per_host_limit is either an int or a {host: limit} dict
+#With adaptive=False each host simply gets per_host_limit concurrent requests
+#on_wake() is called whenever a host may be able to take another request
+class HostLimiter:
+    def __init__(self, per_host_limit = PER_HOST_LIMIT, adaptive = ADAPTIVE, on_wake = None):
+        self.per_host_limit = per_host_limit
+        self.adaptive = adaptive
+        self.on_wake = on_wake
+        self.controllers = {}
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.controllers:
+            if isinstance(self.per_host_limit, dict):
+                limit = self.per_host_limit.get(host, PER_HOST_LIMIT)
+            else:
+                limit = self.per_host_limit
+            self.controllers[host] = HostController(limit, self.adaptive, self.on_wake)
+        return self.controllers[host]
+
+#Returns (status_code, body, charset, etag, last_modified)
+#Connection errors are retried with backoff, 429/503 after the host has been paused for their Retry-After
+#Raises HTTPStatusError for server errors and for 429/503 once THROTTLE_RETRIES is used up
+#metrics, a metrics.RunMetrics, gets the latency, size, status code and encoding of every response, the
+#connections they used and the host's limits. With a streaming.StreamRule the read stops at a skip marker.
+async def fetch(session, host_limiter, article, request_headers = None, metrics = None, stream_rule = None):
+    controller = host_limiter.get(article)
+    num_throttled = 0
+    attempt = 0
+    while True:
+        await controller.acquire()
+        in_flight = controller.in_flight
+        start = controller.loop.time()
+        try:
+            async with session.get(article, headers=request_headers, trace_request_ctx=metrics) as r:
+                stream_stop = None
+                if stream_rule is None or r.status != 200:
+                    body = await r.read()
+                    num_read = len(body)
+                else:
+                    body, stream_stop, num_read = await read_streamed(r, stream_rule)
+                response = r.status, body, r.charset, r.headers.get('ETag'), r.headers.get('Last-Modified')
+                retry_after = parse_retry_after(r.headers.get('Retry-After'))
+                content_encoding, content_length = r.headers.get('Content-Encoding', 'identity'), r.content_length
+        except asyncio.TimeoutError:
+            controller.on_error()
+            raise
+        except aiohttp.ClientConnectorError:
+            controller.on_error()
+            if attempt == CONNECT_RETRIES:
+                raise
+            await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
+            continue
+        finally:
+            controller.release()
+        if metrics is not None:
+            metrics.observe('fetch', controller.loop.time() - start, len(response[1]))
+            metrics.count_status_code(response[0])
+            metrics.observe_host(urlsplit(article).netloc, controller.limit, in_flight)
+            #Content-Length is the size on the wire, before decompression. Without it, or for a page cut short, only the size read is known
+            metrics.count_transfer(content_encoding, num_read if content_length is None or stream_stop else content_length)
+            if stream_stop:
+                metrics.count_stream_stop(stream_stop)
+
+        if response[0] in THROTTLE_STATUSES and num_throttled < THROTTLE_RETRIES:
+            controller.on_throttle(retry_after)
+            num_throttled += 1
+            continue
+        if response[0] >= 500 or response[0] in THROTTLE_STATUSES:
+            controller.on_error()
+            raise HTTPStatusError(f'HTTP {response[0]}')
+        controller.on_response(controller.loop.time() - start)
+        return response
+
+#Reads a response, returns (body up to where rule says the rest is not needed, why it stopped or None, bytes read)
+#A page cut short is not read any further. Its connection is closed, as one with unread data cannot go back to the
+#keep-alive pool, so the next page to the host may need a new connection
+async def read_streamed(r, rule):
+    scanner = streaming.StreamScanner(rule)
+    num_read = 0
+    async for chunk in r.content.iter_any():
+        num_read += len(chunk)
+        stop = scanner.feed(chunk)
+        if stop is not None:
+            r.close()
+            return bytes(scanner.body), stop, num_read
+    return bytes(scanner.body), None, num_read
+
+#Runs in a parse process, raw bytes are decoded here so the event loop only moves bytes
+#Returns (result, record, seconds, error) per page, record is the compressed archive record when build_record is
+#given, seconds the time spent decoding and extracting and error why extract_article raised, else None.
+#A page that raises only fails itself, the rest of the batch is still parsed.
+def parse_batch(extract_article, build_record, batch):
+    parsed = []
+    for article, body, charset in batch:
+        start = time.perf_counter()
+        try:
+            result, error = extract_article(article, body.decode(charset or 'utf-8', errors='replace')), None
+        except Exception as e: #Sent back as text, the exception itself may not pickle
+            result, error = None, f'{type(e).__name__}: {e}'
+        seconds = time.perf_counter() - start
+        parsed.append((result, build_record(article, body, charset) if build_record else None, seconds, error))
+    return parsed
+
+#Collects fetched pages into batches and sends each batch to the parse executor as one task
+class BatchParser:
+    def __init__(self, executor, extract_article, build_record = None, batch_size = PARSE_BATCH_SIZE, batch_wait = PARSE_BATCH_WAIT):
+        self.executor = executor
+        self.extract_article = extract_article
+        self.build_record = build_record
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.batch = []
+        self.futures = []
+        self.flush_handle = None
+
+    def parse(self, article, body, charset):
+        future = asyncio.get_running_loop().create_future()
+        self.batch.append((article, body, charset))
+        self.futures.append(future)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_wait, self.flush)
+        return future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.batch:
+            return
+
+        batch, futures = self.batch, self.futures
+        self.batch, self.futures = [], []
+
+        def done(batch_future):
+            if batch_future.cancelled():
+                return
+            e = batch_future.exception()
+            batch_results = batch_future.result() if e is None else [None] * len(futures)
+            for future, result in zip(futures, batch_results):
+                if future.cancelled():
+                    continue
+                if e is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(e)
+
+        asyncio.wrap_future(self.executor.submit(parse_batch, self.extract_article, self.build_record, batch)).add_done_callback(done)
+
+#Pulls article_list in its own thread, so a slow iterator (sitemap discovery, state lookups, a cache
+#file on a slow disk) never blocks the event loop. At most buffer_size URLs are read ahead.
+#on_ready() is called on the event loop for every URL read and once article_list is exhausted.
+class Feeder:
+    def __init__(self, article_list, buffer_size, on_ready):
+        self.items = collections.deque()
+        self.space = threading.Semaphore(buffer_size)
+        self.on_ready = on_ready
+        self.loop = asyncio.get_running_loop()
+        self.finished = False
+        self.stopped = False
+        self.error = None
+        threading.Thread(target=self.run, args=(article_list,), daemon=True).start()
+
+    def run(self, article_list):
+        try:
+            for item in enumerate(article_list):
+                self.space.acquire()
+                if self.stopped:
+                    return
+                self.items.append(item)
+                self.loop.call_soon_threadsafe(self.on_ready)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished = True
+            try:
+                self.loop.call_soon_threadsafe(self.on_ready)
+            except RuntimeError: #Event loop already closed, the crawl was stopped
+                pass
+
+    #Returns the next (idx, article), only called when items is not empty
+    def take(self):
+        item = self.items.popleft()
+        self.space.release()
+        return item
+
+    def stop(self):
+        self.stopped = True
+        self.space.release()
+
+#Hands the workers URLs from every job in round robin order, skipping jobs whose next URL is for a host
+#that is at its limit or paused. A slow or throttled host then only ties up the requests it is allowed,
+#the other workers keep fetching from the other sites.
+class Scheduler:
+    def __init__(self, jobs, host_limiter, buffer_size):
+        self.loop = asyncio.get_running_loop()
+        self.waiters = collections.deque()
+        self.timer = None
+        self.turn = 0
+        self.host_limiter = host_limiter
+        host_limiter.on_wake = self.notify
+        self.feeders = [Feeder(job.article_list, buffer_size, self.notify) for job in jobs]
+
+    #Wakes one waiting worker. A worker that finds a URL wakes the next one, so a change that lets
+    #several requests start is used fully without waking every worker on each request.
+    def notify(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _on_timer(self):
+        self.timer = None
+        self.notify()
+
+    #Returns (job_idx, (idx, article)), _END once every job is exhausted, or None if nothing can start now
+    def _pick(self):
+        num_finished = 0
+        wait = None
+        for offset in range(len(self.feeders)):
+            job_idx = (self.turn + offset) % len(self.feeders)
+            feeder = self.feeders[job_idx]
+            finished = feeder.finished #Read before items, the last item lands just before finished is set
+            if not feeder.items:
+                if finished:
+                    if feeder.error is not None:
+                        raise feeder.error
+                    num_finished += 1
+                continue
+            host_wait = self.host_limiter.get(feeder.items[0][1]).wait_time()
+            if host_wait == 0:
+                self.turn = job_idx + 1
+                return job_idx, feeder.take()
+            if host_wait is not None:
+                wait = host_wait if wait is None else min(wait, host_wait)
+
+        if num_finished == len(self.feeders):
+            return _END
+        #Paused hosts do not call notify when the pause ends
+        if wait is not None and (self.timer is None or self.timer.when() > self.loop.time() + wait):
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = self.loop.call_later(wait, self._on_timer)
+        return None
+
+    #Returns (job_idx, (idx, article)) or None once every job is exhausted
+    async def next(self):
+        while True:
+            item = self._pick()
+            if item is not None:
+                self.notify()
+                return None if item is _END else item
+            waiter = self.loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self.notify()
+                raise
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        for feeder in self.feeders:
+            feeder.stop()
+
+async def _crawl(jobs, per_host_limit, adaptive, max_in_flight, parse_executor, parse_batch_size, slots, results):
+    host_limiter = HostLimiter(per_host_limit, adaptive)
+    scheduler = Scheduler(jobs, host_limiter, max_in_flight)
+    #One batcher per job as each site has its own extract_article, they all share parse_executor
+    parsers = [BatchParser(parse_executor, job.extract_article, job.archive.build_record if job.archive else None, parse_batch_size) for job in jobs]
+
+    async def worker(session):
+        while True:
+            #Slots are given back by the consumer, so a slow writer stops new URLs from being pulled
+            await slots.acquire()
+            item = await scheduler.next()
+            if item is None:
+                slots.release()
+                return
+            job_idx, (idx, article) = item
+            job, parser = jobs[job_idx], parsers[job_idx]
+            extra_headers = job.request_headers(article) if job.request_headers else None
+            if job.headers and extra_headers:
+                extra_headers = {**job.headers, **extra_headers}
+            else:
+                extra_headers = extra_headers or job.headers
+
+            for num_blocked in range(THROTTLE_RETRIES + 1):
+                try:
+                    #An archived page is kept whole, so re-extracting it later sees what a full fetch would
+                    status_code, body, charset, etag, last_modified = await fetch(session, host_limiter, article, extra_headers, job.metrics, job.stream_rule if job.archive is None else None)
+                except Exception as e:
+                    crawled = CrawlResult(idx, article, job.handle_fetch_error(article, e), ERROR, 0, reason=f'{type(e).__name__}: {e}')
+                    break
+                if status_code == 304:
+                    crawled = CrawlResult(idx, article, None, NOT_MODIFIED, 0, etag, last_modified)
+                    break
+                #Parsing is CPU bound so it is kept off the event loop
+                try:
+                    result, record, parse_seconds, error = await parser.parse(article, body, charset)
+                except Exception as e: #The whole batch failed, e.g. a parse process died
+                    result, record, parse_seconds, error = None, None, 0.0, f'{type(e).__name__}: {e}'
+                if job.metrics is not None:
+                    job.metrics.observe('parse', parse_seconds, len(body))
+                #Pages that fail to parse are archived too, they are the ones to re-extract once the extractor is fixed
+                if error is not None and job.archive is not None and record is not None:
+                    job.archive.write(article, record)
+                if error is not None:
+                    e = ParseError(error)
+                    #No validators, a retry has to fetch the page again rather than get a 304 for it
+                    crawled = CrawlResult(idx, article, job.handle_fetch_error(article, e), ERROR, len(body), reason=f'ParseError: {e}')
+                    break
+                status = get_status(result)
+                crawled = CrawlResult(idx, article, result, status, len(body), etag, last_modified, 'Access denied' if status == ACCESS_DENIED else None)
+                if status != ACCESS_DENIED or num_blocked == THROTTLE_RETRIES:
+                    if job.archive is not None:
+                        job.archive.write(article, record)
+                    break
+                #A block page such as 8world's Access denied backs the host off like a 429 would
+                host_limiter.get(article).on_throttle()
+            results.put((job_idx, crawled))
+
+    #One keep-alive connection pool for every site, sized to the URLs that can be in flight
+    connector = transport.connector(max_in_flight, per_host_limit)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    try:
+        async with transport.session(connector, timeout) as session:
+            await asyncio.gather(*(worker(session) for _ in range(max_in_flight)))
+    finally:
+        scheduler.stop()
+
+#One site's share of crawl_sites, the fields are the per site arguments of crawl
+#name is yielded with each of the site's results
+SiteJob = collections.namedtuple('SiteJob', ['name', 'article_list', 'extract_article', 'handle_fetch_error', 'headers', 'ordered', 'archive', 'request_headers', 'metrics', 'stream_rule'], defaults=[None, False, None, None, None, None])
+
+#Fetches every article on a single event loop and parses them in a process pool, yielding a CrawlResult per URL
+#extract_article(article, html) and handle_fetch_error(article, e) return the same values as scrape_article
+#article_list can be any iterable, even one still discovering URLs, it is read in a Feeder thread
+#At most max_in_flight URLs and their results are held in memory at once
+#ordered=True yields in article_list order, a slow URL then holds back the others until it finishes
+#per_host_limit caps the concurrent requests per host, adaptive=True finds the limit each host tolerates below it
+#A ProcessPoolExecutor of num_parsers is created unless parse_executor is given
+#archive is an optional archive.HtmlArchive that keeps the raw HTML of every fetched page
+#request_headers(article) can return extra headers per URL, e.g. state.CrawlState.request_headers for conditional requests
+#metrics is an optional metrics.RunMetrics for the fetch and parse stages
+#stream_rule is an optional streaming.StreamRule, pages with one of its skip markers are then only downloaded and parsed up to it,
+#it is ignored while archive is given
+def crawl(article_list, extract_article, handle_fetch_error, headers = None, per_host_limit = PER_HOST_LIMIT, adaptive = ADAPTIVE, max_in_flight = MAX_IN_FLIGHT, ordered = False, num_parsers = NUM_PARSERS, parse_batch_size = PARSE_BATCH_SIZE, parse_executor = None, archive = None, request_headers = None, metrics = None, stream_rule = None):
+    job = SiteJob(None, article_list, extract_article, handle_fetch_error, headers, ordered, archive, request_headers, metrics, stream_rule)
+    return crawl_job(job, per_host_limit, adaptive, max_in_flight, num_parsers, parse_batch_size, parse_executor)
+
+#crawl for a SiteJob that is already built, yields its CrawlResults
+def crawl_job(job, per_host_limit = PER_HOST_LIMIT, adaptive = ADAPTIVE, max_in_flight = MAX_IN_FLIGHT, num_parsers = NUM_PARSERS, parse_batch_size = PARSE_BATCH_SIZE, parse_executor = None):
+    results = crawl_sites([job], per_host_limit, adaptive, max_in_flight, num_parsers, parse_batch_size, parse_executor)
+    try:
+        for _, crawled in results:
+            yield crawled
+    finally:
+        results.close()
+
+#Crawls the SiteJobs together and yields (job.name, CrawlResult) as they complete
+#The jobs' URLs are interleaved by a Scheduler and share max_in_flight, one connection pool and the parse processes,
+#while every host keeps its own limit. Results of an ordered job are yielded in its article_list order,
+#they hold their share of max_in_flight until they are yielded.
+def crawl_sites(jobs, per_host_limit = PER_HOST_LIMIT, adaptive = ADAPTIVE, max_in_flight = MAX_IN_FLIGHT, num_parsers = NUM_PARSERS, parse_batch_size = PARSE_BATCH_SIZE, parse_executor = None):
+    own_executor = parse_executor is None
+    if own_executor:
+        parse_executor = concurrent.futures.ProcessPoolExecutor(num_parsers)
+        parse_executor.submit(int).result() #Start the parse processes before the event loop thread exists
+
+    results = queue.Queue() #Bounded by the slots, workers cannot put more than max_in_flight results
+    loop = asyncio.new_event_loop()
+    slots = asyncio.Semaphore(max_in_flight)
+    crawl_task = loop.create_task(_crawl(jobs, per_host_limit, adaptive, max_in_flight, parse_executor, parse_batch_size, slots, results))
+
+    def run():
+        try:
+            loop.run_until_complete(crawl_task)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(_END)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    pending = [{} for _ in jobs] #Results waiting for an earlier idx of their job, only used when ordered
+    next_idx = [0] * len(jobs)
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            job_idx, crawled = item
+            job = jobs[job_idx]
+            if not job.ordered:
+                yield job.name, crawled
+                loop.call_soon_threadsafe(slots.release)
+                continue
+
+            pending[job_idx][crawled.idx] = crawled
+            while next_idx[job_idx] in pending[job_idx]:
+                yield job.name, pending[job_idx].pop(next_idx[job_idx])
+                next_idx[job_idx] += 1
+                loop.call_soon_threadsafe(slots.release)
+    finally:
+        if thread.is_alive(): #Consumer stopped early
+            loop.call_soon_threadsafe(crawl_task.cancel)
+        thread.join()
+        loop.close()
+        if own_executor:
+            parse_executor.shutdown(cancel_futures=True)
@@ -0,0 +1,77 @@
+from lxml import etree
+
+#PRECOMPILED LXML SELECTORS FOR THE FAST EXTRACTION BACKEND
+#Each helper mirrors the BeautifulSoup call named next to it so both backends give identical output
+
+HTML_PARSER = etree.HTMLParser()
+#get_text() leaves out comments and the contents of script/style/template tags
+TEXT = etree.XPath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]', smart_strings=False)
+#find_all('p', class_=''), paragraphs without a class as matched by the bs4 4.9 releases the corpora were built with
+PARAGRAPHS = etree.XPath('.//p[not(normalize-space(@class))]')
+TITLE = etree.XPath('(//title)[1]')
+LIST_ITEMS = etree.XPath('.//li') #find_all('li')
+META_CONTENT = etree.XPath('//meta[@property = $name or @name = $name or @itemprop = $name]/@content', smart_strings=False)
+TIME_DATETIME = etree.XPath('(//time/@datetime)[1]', smart_strings=False)
+TITLE_META = ('og:title', 'twitter:title')
+#Publication date, the first one found is used
+DATE_META = ('article:published_time', 'og:article:published_time', 'datePublished', 'publishdate', 'pubdate', 'date', 'dcterms.created')
+
+#Returns the root element, or None for an empty document
+def parse_html(html):
+    try:
+        return etree.fromstring(html, HTML_PARSER)
+    except ValueError: #Unicode string with an XML encoding declaration
+        return etree.fromstring(html.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
+
+#find(tag, class_=name) with a single class name matches any element carrying that class
+def find_by_class(tag, class_name, relative = False):
+    return etree.XPath(f'({"." if relative else ""}//{tag}[contains(concat(" ", normalize-space(@class), " "), " {class_name} ")])[1]')
+
+#find(tag, class_='a b c') with several names only matches that exact class attribute
+def find_by_class_string(tag, class_string, relative = False):
+    return etree.XPath(f'({"." if relative else ""}//{tag}[normalize-space(@class) = "{class_string}"])[1]')
+
+def find_by_id(tag, element_id):
+    return etree.XPath(f'(//{tag}[@id = "{element_id}"])[1]')
+
+#Runs a precompiled find() selector, returns the element or None
+def first(selector, node):
+    if node is None:
+        return None
+    found = selector(node)
+    return found[0] if found else None
+
+def get_text(element):
+    return ''.join(TEXT(element))
+
+#soup.find('title').string
+def title_string(root):
+    title = first(TITLE, root)
+    if title is None:
+        return None
+    return get_text(title)
+
+#element.next_sibling.get_text(), the next node can be the text right after the element
+def next_sibling_text(element):
+    if element.tail:
+        return element.tail
+    return get_text(element.getnext())
+
+#content of the first <meta> with one of names as its property, name or itemprop
+def meta_content(root, names):
+    for name in names:
+        found = META_CONTENT(root, name=name)
+        if found and found[0].strip():
+            return found[0].strip()
+    return None
+
+#Returns (title, date) of an article page, either can be None
+def page_metadata(root):
+    if root is None:
+        return None, None
+    title = meta_content(root, TITLE_META) or title_string(root)
+    date = meta_content(root, DATE_META)
+    if date is None:
+        found = TIME_DATETIME(root)
+        date = found[0].strip() if found else None
+    return title.strip() if title else None, date
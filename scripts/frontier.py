@@ -0,0 +1,108 @@
+import bisect
+import hashlib
+import math
+from array import array
+from urllib.parse import urlsplit
+
+#COMPACT URL FRONTIER, DROPS DUPLICATE URLS AND MARKS URLS SEEN IN EARLIER RUNS
+#URLs are kept as 8 byte fingerprints instead of strings, a few million URLs take tens of MB
+
+NUM_BUCKETS = 1 << 16 #Fingerprints are split into sorted arrays by their top 16 bits
+BLOOM_ERROR_RATE = 0.01
+IGNORE_QUERY = True #Article URLs of the scraped sites never need their query string, only tracking parameters
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'ref', 'cid') #Dropped even when IGNORE_QUERY is False
+DEFAULT_PORTS = (':80', ':443')
+
+#Same key for variants of a URL: scheme, host case, default port, fragment, trailing slash and query string
+def url_key(url):
+    parts = urlsplit(url.strip())
+    netloc = parts.netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS):
+        netloc = netloc.rpartition(':')[0]
+    path = parts.path.rstrip('/') or '/'
+    if IGNORE_QUERY:
+        return netloc + path
+    params = sorted(param for param in parts.query.split('&') if param and not param.lower().startswith(TRACKING_PARAMS))
+    return netloc + path + ('?' + '&'.join(params) if params else '')
+
+def fingerprint(url):
+    return int.from_bytes(hashlib.blake2b(url_key(url).encode('utf-8'), digest_size=8).digest(), 'little')
+
+#Exact set of 64 bit fingerprints, 8 bytes each instead of a Python int in a set
+class FingerprintSet:
+    def __init__(self):
+        self.buckets = [None] * NUM_BUCKETS
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, fp):
+        bucket = self.buckets[fp >> 48]
+        if bucket is None:
+            return False
+        idx = bisect.bisect_left(bucket, fp)
+        return idx < len(bucket) and bucket[idx] == fp
+
+    #Returns True if fp was not in the set yet
+    def add(self, fp):
+        bucket = self.buckets[fp >> 48]
+        if bucket is None:
+            bucket = self.buckets[fp >> 48] = array('Q')
+        idx = bisect.bisect_left(bucket, fp)
+        if idx < len(bucket) and bucket[idx] == fp:
+            return False
+        bucket.insert(idx, fp)
+        self.size += 1
+        return True
+
+#Probabilistic set using about 1.2 bytes per fingerprint at a 1% error rate, never misses an added fingerprint
+class BloomFilter:
+    def __init__(self, capacity, error_rate = BLOOM_ERROR_RATE):
+        self.num_bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(round(self.num_bits / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    #Double hashing on the two halves of the fingerprint
+    def _positions(self, fp):
+        h1, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, fp):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fp))
+
+    def add(self, fp):
+        for pos in self._positions(fp):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.size += 1
+        return True
+
+#Passes on each URL once, however many sitemap pages or sites list it. One Frontier can be shared
+#by the crawls of several sites so a URL listed by more than one of them is only fetched once.
+#URLs from earlier runs are added with mark_seen, bloom_capacity > 0 keeps them in a Bloom filter
+#sized for that many URLs instead of the exact set.
+class Frontier:
+    def __init__(self, bloom_capacity = 0, error_rate = BLOOM_ERROR_RATE):
+        self.queued = FingerprintSet()
+        self.seen = BloomFilter(bloom_capacity, error_rate) if bloom_capacity > 0 else FingerprintSet()
+        self.num_duplicates = 0
+
+    def mark_seen(self, urls):
+        for url in urls:
+            self.seen.add(fingerprint(url))
+
+    #False only for URLs that were definitely not seen in an earlier run
+    def may_have_seen(self, url):
+        return fingerprint(url) in self.seen
+
+    #Takes and yields (url, lastmod) pairs, dropping URLs already passed on
+    def filter(self, links):
+        for link, lastmod in links:
+            if not self.queued.add(fingerprint(link)):
+                self.num_duplicates += 1
+                continue
+            yield link, lastmod
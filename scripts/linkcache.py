@@ -0,0 +1,157 @@
+import itertools
+import mmap
+import os
+import random
+from array import array
+
+#LINK CACHE HELPERS SHARED BY THE SCRAPERS
+#One URL per line, optionally followed by a tab and the sitemap <lastmod> of that URL
+#Next to each cache file is an index <cache>.offsets with the byte offset of every line, so a LinkCache can
+#memory-map both and reach any line without reading the ones before it. The cache itself stays a text file:
+#a cache from an older run or written by hand gets its index the first time it is opened.
+
+SAMPLE_SEED = 0 #Seed of LinkCache.sample, the same seed and cache give the same sample
+HEADER = array('Q', [0, 0]) #Index header: size and mtime_ns of the cache file the offsets are for
+
+def index_filepath(filepath):
+    return filepath + '.offsets'
+
+#(url, lastmod) of a cache line, lastmod is '' when the sitemap had none
+def parse_link(line):
+    link, _, lastmod = line.strip().partition('\t')
+    return link, lastmod
+
+#Writes the line offsets of a cache file to its index, one pass over the file
+def build_index(filepath):
+    offsets = array('Q')
+    with open(filepath, 'rb') as cache_file:
+        offset = 0
+        for line in cache_file:
+            offsets.append(offset)
+            offset += len(line)
+    stat = os.stat(filepath)
+    with open(index_filepath(filepath) + '.tmp', 'wb') as index_file:
+        array('Q', [stat.st_size, stat.st_mtime_ns]).tofile(index_file)
+        offsets.tofile(index_file)
+    os.replace(index_filepath(filepath) + '.tmp', index_filepath(filepath))
+
+#A cache file is indexed when its index was built for its current size and modification time
+def is_indexed(filepath):
+    if not os.path.isfile(index_filepath(filepath)):
+        return False
+    header = array('Q')
+    with open(index_filepath(filepath), 'rb') as index_file:
+        header.frombytes(index_file.read(len(HEADER) * HEADER.itemsize))
+    stat = os.stat(filepath)
+    return list(header) == [stat.st_size, stat.st_mtime_ns]
+
+#Read-only view of a cache file, opening it only maps the file and its index, however many URLs it has
+#cache[idx] is line idx parsed by parse, cache[start:stop] a list of lines, iter_range and sample yield them lazily
+#parse defaults to parse_link, SMD passes its own for its url|zh|en lines
+class LinkCache:
+    def __init__(self, filepath, parse = parse_link):
+        self.filepath = filepath
+        self.parse = parse
+        if not is_indexed(filepath):
+            build_index(filepath)
+        self.size = os.path.getsize(filepath)
+        self.data = self.index = None
+        self.offsets = memoryview(b'').cast('Q')
+        if self.size == 0: #Nothing to map
+            return
+        with open(filepath, 'rb') as cache_file:
+            self.data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(index_filepath(filepath), 'rb') as index_file:
+            self.index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self.index)[len(HEADER) * HEADER.itemsize:].cast('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, idx):
+        end = self.offsets[idx + 1] if idx + 1 < len(self.offsets) else self.size
+        return self.data[self.offsets[idx]:end].decode('utf-8')
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return list(self.iter_range(*key.indices(len(self))))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('link cache index out of range')
+        return self.parse(self.line(key))
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def iter_range(self, start = 0, stop = None, step = 1):
+        for idx in range(start, len(self) if stop is None else min(stop, len(self)), step):
+            yield self.parse(self.line(idx))
+
+    #Indices of num lines picked at random from the whole cache, in cache order, the same seed picks the same lines
+    def sample_indices(self, num, seed = SAMPLE_SEED):
+        return sorted(random.Random(seed).sample(range(len(self)), min(num, len(self))))
+
+    def sample(self, num, seed = SAMPLE_SEED):
+        for idx in self.sample_indices(num, seed):
+            yield self.parse(self.line(idx))
+
+    #Copies the lines at indices, e.g. a sample or a range, to a new text cache file with its index, all lines if None
+    def export(self, filepath, indices = None):
+        with open(filepath, 'w', encoding='utf-8') as cache_file:
+            for idx in range(len(self)) if indices is None else indices:
+                cache_file.write(self.line(idx).rstrip('\n') + '\n')
+        build_index(filepath)
+
+    def close(self):
+        self.offsets.release()
+        if self.index is not None:
+            self.index.close()
+            self.data.close()
+
+def save_links(filepath, article_list, lastmod_list = None):
+    with open(filepath, 'w', encoding='utf-8') as cache_file:
+        for idx, link in enumerate(article_list):
+            lastmod = lastmod_list[idx] if lastmod_list else ''
+            cache_file.write(f'{link}\t{lastmod}\n' if lastmod else f'{link}\n')
+    build_index(filepath)
+
+#Writes links to the cache file as they are discovered and passes them on straight away,
+#the new cache only replaces the old one once discovery has finished
+def stream_to_cache(filepath, links, limit = -1):
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as cache_file:
+        for idx, (link, lastmod) in enumerate(links):
+            cache_file.write(f'{link}\t{lastmod}\n' if lastmod else f'{link}\n')
+            if limit == -1 or idx < limit:
+                yield link, lastmod
+    os.replace(tmp_filepath, filepath)
+    build_index(filepath)
+
+#Returns (links, num_articles), links lazily yields (url, lastmod) pairs
+#iter_urls() is the scraper's sitemap discovery, its links are crawled while discovery is still running,
+#num_articles is None in that case. refresh=True rediscovers even if the cache exists.
+#sample > 0 crawls that many URLs picked at random from the whole cache (see LinkCache.sample) instead of
+#the first limit, discovery then has to finish before the crawl starts
+def load_articles(cache_filepath, iter_urls, use_cache = True, limit = -1, refresh = False, sample = 0):
+    if not use_cache and not sample:
+        return itertools.islice(iter_urls(), None if limit == -1 else limit), None
+
+    if refresh or not use_cache:
+        print('Refreshing cache file from the sitemaps')
+    elif os.path.isfile(cache_filepath) and os.path.getsize(cache_filepath) > 0:
+        print('Using URLs from cache file')
+        link_cache = LinkCache(cache_filepath)
+        if sample:
+            return link_cache.sample(sample), min(sample, len(link_cache))
+        return link_cache.iter_range(0, None if limit == -1 else limit), len(link_cache) if limit == -1 else min(len(link_cache), limit)
+    else:
+        print('Cache file does not exist... creating now')
+
+    links = stream_to_cache(cache_filepath, iter_urls(), limit)
+    if sample:
+        for _ in links: #The sample is drawn from the whole site, so discovery finishes first
+            pass
+        link_cache = LinkCache(cache_filepath)
+        return link_cache.sample(sample), min(sample, len(link_cache))
+    return links, None
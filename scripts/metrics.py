@@ -0,0 +1,253 @@
+import bisect
+import collections
+import json
+import os
+import resource
+import threading
+import time
+
+#PER STAGE CRAWL METRICS, SAVED AS A JSON RUN REPORT PER SITE AND OPTIONALLY AS PROMETHEUS TEXT
+
+STAGES = ('discovery', 'connect', 'fetch', 'parse', 'write') #connect is the setup time of each new connection, see transport.py
+#Upper bounds in seconds, the same cumulative buckets a Prometheus histogram uses
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+QUANTILES = (0.5, 0.9, 0.99)
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else str(bound)
+
+class Histogram:
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    #Upper bound of the bucket the q quantile falls in
+    def quantile(self, q):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= q * self.count:
+                return bound
+
+    def cumulative_counts(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+    def to_dict(self):
+        if not self.count:
+            return {'count': 0}
+        report = {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count}
+        for q in QUANTILES:
+            report[f'p{round(q * 100)}'] = format_bound(self.quantile(q))
+        report['buckets'] = {format_bound(bound): cumulative for bound, cumulative in self.cumulative_counts()}
+        return report
+
+#Collects the metrics of one site's run. Observations come from the sitemap thread, the engine's
+#event loop thread and the writer, so every update takes the lock.
+class RunMetrics:
+    def __init__(self, site):
+        self.site = site
+        self.started = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+        self.latency = {stage: Histogram() for stage in STAGES}
+        self.num_bytes = collections.Counter() #Per stage
+        self.status_codes = collections.Counter() #Article responses, including throttled ones that were retried
+        self.results = collections.Counter() #engine statuses, done, empty, error...
+        self.failure_reasons = collections.Counter() #Exception type or block signal of failed URLs
+        self.connections = collections.Counter() #created, reused, dns_cache_hit, dns_cache_miss
+        self.content_encodings = collections.Counter() #Article responses per Content-Encoding
+        self.num_wire_bytes = 0 #Article bytes as transferred, before decompression
+        self.stream_stops = collections.Counter() #Pages cut short by a streaming.StreamRule, per reason
+        self.duplicates = collections.Counter() #Paragraphs dropped by dedup.py, exact and near
+        self.num_duplicate_chars = 0
+        self.rejected = collections.Counter() #Paragraphs dropped by quality.py, per reason
+        self.hosts = {} #host -> limits of its ratecontrol.HostController as seen at each response
+        self.num_rejected_chars = 0
+        self.num_links = 0
+        self.num_documents = 0
+        self.num_paragraphs = 0
+        self.num_chars = 0
+        self.num_sentences = 0 #Only counted with SPLIT_SENTENCES, see segment.py
+
+    def observe(self, stage, seconds, num_bytes = 0):
+        with self.lock:
+            self.latency[stage].observe(seconds)
+            self.num_bytes[stage] += num_bytes
+
+    def count_status_code(self, status_code):
+        with self.lock:
+            self.status_codes[status_code] += 1
+
+    #event is 'created' with the seconds it took to connect, or 'reused', 'dns_cache_hit', 'dns_cache_miss'
+    def count_connection(self, event, seconds = None):
+        with self.lock:
+            self.connections[event] += 1
+            if seconds is not None:
+                self.latency['connect'].observe(seconds)
+
+    def count_transfer(self, content_encoding, num_bytes):
+        with self.lock:
+            self.content_encodings[content_encoding] += 1
+            self.num_wire_bytes += num_bytes
+
+    def count_stream_stop(self, reason):
+        with self.lock:
+            self.stream_stops[reason] += 1
+
+    def count_duplicate(self, kind, num_chars):
+        with self.lock:
+            self.duplicates[kind] += 1
+            self.num_duplicate_chars += num_chars
+
+    def count_rejected(self, reason, num_chars):
+        with self.lock:
+            self.rejected[reason] += 1
+            self.num_rejected_chars += num_chars
+
+    #limit is the host's concurrency limit when a response came in, in_flight its requests at that time
+    def observe_host(self, host, limit, in_flight):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = {'limit': limit, 'min_limit': limit, 'max_limit': limit, 'max_in_flight': in_flight}
+                return
+            limits = self.hosts[host]
+            limits['limit'] = limit
+            limits['min_limit'] = min(limits['min_limit'], limit)
+            limits['max_limit'] = max(limits['max_limit'], limit)
+            limits['max_in_flight'] = max(limits['max_in_flight'], in_flight)
+
+    def count_links(self, num_links):
+        with self.lock:
+            self.num_links += num_links
+
+    #crawled is the engine.CrawlResult, text what was written to the output for it, either text or a records.py record,
+    #before it is split into sentences
+    def count_result(self, crawled, text):
+        with self.lock:
+            self.results[crawled.status] += 1
+            if crawled.reason:
+                self.failure_reasons[crawled.reason.partition(':')[0]] += 1
+            if text and isinstance(text, str):
+                self.num_documents += 1
+                self.num_paragraphs += sum(1 for line in text.split('\n') if line.strip())
+                self.num_chars += len(text)
+            elif text and isinstance(text, dict):
+                self.num_documents += 1
+                self.num_paragraphs += len(text['paragraphs'])
+                self.num_chars += sum(len(paragraph) for paragraph in text['paragraphs'])
+
+    #text is what count_result was given once it is split into sentences
+    def count_sentences(self, text):
+        with self.lock:
+            if isinstance(text, str):
+                self.num_sentences += sum(1 for line in text.split('\n') if line.strip())
+            elif isinstance(text, dict):
+                self.num_sentences += len(text['sentences'])
+
+    def finish(self):
+        self.finished = time.time()
+
+    def report(self):
+        duration = (self.finished or time.time()) - self.started
+        with self.lock:
+            num_requests = self.connections['created'] + self.connections['reused']
+            return {
+                'site': self.site,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+                'duration_seconds': duration,
+                'stages': {stage: {'latency_seconds': self.latency[stage].to_dict(), 'bytes': self.num_bytes[stage]} for stage in STAGES},
+                'links_discovered': self.num_links,
+                'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+                'results': dict(self.results),
+                'failure_reasons': dict(self.failure_reasons.most_common()),
+                'hosts': {host: dict(limits) for host, limits in self.hosts.items()},
+                'connections': {**self.connections, 'reuse_ratio': self.connections['reused'] / num_requests if num_requests else 0.0},
+                'content_encodings': dict(self.content_encodings),
+                'fetch_wire_bytes': self.num_wire_bytes,
+                'stream_stops': dict(self.stream_stops),
+                'duplicates': {**self.duplicates, 'chars': self.num_duplicate_chars,
+                    'chars_share': self.num_duplicate_chars / (self.num_duplicate_chars + self.num_chars) if self.num_duplicate_chars else 0.0},
+                'rejected': {**self.rejected, 'chars': self.num_rejected_chars},
+                'documents': self.num_documents,
+                'documents_per_second': self.num_documents / duration if duration else 0.0,
+                'paragraphs': self.num_paragraphs,
+                'sentences': self.num_sentences,
+                'chars': self.num_chars,
+                #ru_maxrss is in KB on Linux, the children figure is the largest parse process
+                'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                'peak_rss_children_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+            }
+
+    #Saves the report as <report_dir>/<site>-<start time>.json so runs can be compared, returns the filepath
+    def write_json(self, report_dir):
+        os.makedirs(report_dir, exist_ok=True)
+        filepath = os.path.join(report_dir, f'{self.site}-{time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))}.json')
+        with open(filepath, 'w', encoding='utf-8') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        return filepath
+
+    #Prometheus text exposition format, e.g. for node_exporter's textfile collector
+    def write_prometheus(self, filepath):
+        report = self.report()
+        site = f'site="{self.site}"'
+        lines = ['# TYPE crawl_stage_latency_seconds histogram']
+        for stage in STAGES:
+            histogram = self.latency[stage]
+            for bound, cumulative in histogram.cumulative_counts():
+                lines.append(f'crawl_stage_latency_seconds_bucket{{{site},stage="{stage}",le="{format_bound(bound)}"}} {cumulative}')
+            lines.append(f'crawl_stage_latency_seconds_sum{{{site},stage="{stage}"}} {histogram.sum}')
+            lines.append(f'crawl_stage_latency_seconds_count{{{site},stage="{stage}"}} {histogram.count}')
+        lines.append('# TYPE crawl_stage_bytes_total counter')
+        lines += [f'crawl_stage_bytes_total{{{site},stage="{stage}"}} {self.num_bytes[stage]}' for stage in STAGES]
+        lines.append('# TYPE crawl_http_responses_total counter')
+        lines += [f'crawl_http_responses_total{{{site},code="{code}"}} {count}' for code, count in report['status_codes'].items()]
+        lines.append('# TYPE crawl_results_total counter')
+        lines += [f'crawl_results_total{{{site},status="{status}"}} {count}' for status, count in report['results'].items()]
+        lines.append('# TYPE crawl_failures_total counter')
+        lines += [f'crawl_failures_total{{{site},reason="{reason}"}} {count}' for reason, count in report['failure_reasons'].items()]
+        lines.append('# TYPE crawl_connections_total counter')
+        lines += [f'crawl_connections_total{{{site},event="{event}"}} {count}' for event, count in report['connections'].items() if event != 'reuse_ratio']
+        lines.append('# TYPE crawl_stream_stops_total counter')
+        lines += [f'crawl_stream_stops_total{{{site},reason="{reason}"}} {count}' for reason, count in report['stream_stops'].items()]
+        lines.append('# TYPE crawl_duplicate_paragraphs_total counter')
+        lines += [f'crawl_duplicate_paragraphs_total{{{site},kind="{kind}"}} {count}' for kind, count in self.duplicates.items()]
+        lines.append('# TYPE crawl_duplicate_chars_total counter')
+        lines.append(f'crawl_duplicate_chars_total{{{site}}} {self.num_duplicate_chars}')
+        lines.append('# TYPE crawl_rejected_paragraphs_total counter')
+        lines += [f'crawl_rejected_paragraphs_total{{{site},reason="{reason}"}} {count}' for reason, count in self.rejected.items()]
+        lines.append('# TYPE crawl_rejected_chars_total counter')
+        lines.append(f'crawl_rejected_chars_total{{{site}}} {self.num_rejected_chars}')
+        lines.append('# TYPE crawl_host_limit gauge')
+        lines += [f'crawl_host_limit{{{site},host="{host}"}} {limits["limit"]}' for host, limits in report['hosts'].items()]
+        lines.append('# TYPE crawl_host_max_in_flight gauge')
+        lines += [f'crawl_host_max_in_flight{{{site},host="{host}"}} {limits["max_in_flight"]}' for host, limits in report['hosts'].items()]
+        lines.append('# TYPE crawl_responses_by_encoding_total counter')
+        lines += [f'crawl_responses_by_encoding_total{{{site},encoding="{encoding}"}} {count}' for encoding, count in report['content_encodings'].items()]
+        for name, key, kind in (
+            ('crawl_links_discovered_total', 'links_discovered', 'counter'),
+            ('crawl_documents_total', 'documents', 'counter'),
+            ('crawl_paragraphs_total', 'paragraphs', 'counter'),
+            ('crawl_sentences_total', 'sentences', 'counter'),
+            ('crawl_chars_total', 'chars', 'counter'),
+            ('crawl_fetch_wire_bytes_total', 'fetch_wire_bytes', 'counter'),
+            ('crawl_documents_per_second', 'documents_per_second', 'gauge'),
+            ('crawl_duration_seconds', 'duration_seconds', 'gauge'),
+            ('crawl_peak_rss_bytes', 'peak_rss_bytes', 'gauge'),
+            ('crawl_peak_rss_children_bytes', 'peak_rss_children_bytes', 'gauge')):
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name}{{{site}}} {report[key]}')
+
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        with open(filepath + '.tmp', 'w', encoding='utf-8') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
+        os.replace(filepath + '.tmp', filepath) #The collector never sees a half written file
@@ -0,0 +1,283 @@
+import cProfile
+import collections
+import gc
+import hashlib
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import engine
+import extractors
+import linkcache
+import metrics
+import records
+import dedup
+
+#PROFILING MODE FOR THE SCRAPING HOT PATH
+#  python scrape_st.py --profile   any sitemap scraper, or crawl_all.py --profile for all of its sitemap sites
+#Instead of crawling, the PROFILE_FRACTION of the site's links whose URL hash falls below it (the same articles
+#every run, so two runs can be compared) are fetched, parsed, extracted and written one at a time, each stage on
+#its own so it can be measured on its own:
+#  fetch    the request with the scraper's requests session and decoding the page
+#  parse    building the tree, extractors.parse_html or BeautifulSoup
+#  extract  the rest of extract_article, its selectors, find() and get_text() calls
+#  write    the writer chain, quality filter, dedup, sentence splitting and the output file
+#The profilers slow down what they measure and each other, so they take turns: of every three articles one runs
+#under cProfile, one under tracemalloc and one is only timed and sampled for the flamegraphs.
+#Saved to PROFILE_DIR/<site>-<start time>/:
+#  <stage>.prof     cProfile stats, for pstats or snakeviz
+#  <stage>.folded   collapsed stacks in microseconds, 'frame;frame;frame count' per line, for flamegraph.pl or speedscope
+#  report.txt       time per stage, the TOP_FUNCTIONS functions of each stage by own time, the TOP_ALLOCATIONS lines
+#                   whose allocations each stage left behind, and the object types that grew over the run
+#tracemalloc only sees memory allocated through Python, the trees lxml builds are allocated by libxml2 and do not
+#show up in it, BeautifulSoup's do. Time spent in C code that holds the GIL (regular expressions, numpy) shows
+#up in the flamegraphs under the Python function that called it.
+#The output and rejected paragraphs are written to the profile directory with a dedup index of its own, the
+#corpus, crawl state, error links and shared dedup index are not touched.
+
+PROFILE_FLAG = '--profile'
+PROFILE_FRACTION = 0.02 #Share of the site's links that are profiled
+MAX_ARTICLES = 300 #At most this many articles per site
+PROFILE_DIR = 'profiles'
+SAMPLE_INTERVAL = 0.001 #Seconds between stack samples of the timed articles
+TOP_FUNCTIONS = 20
+TOP_ALLOCATIONS = 20
+TOP_TYPES = 20 #Object types in the gc growth report
+
+STAGES = ('fetch', 'parse', 'extract', 'write')
+#What each article is run under, in turn
+CPROFILE = 'cprofile'
+TRACEMALLOC = 'tracemalloc'
+SAMPLED = 'sampled'
+MODES = (CPROFILE, TRACEMALLOC, SAMPLED)
+
+def enabled():
+    return PROFILE_FLAG in sys.argv
+
+#Whether url is in the sample, decided by its hash so the sample does not depend on the order of the links
+def sampled(url, fraction = PROFILE_FRACTION):
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little') < fraction * 2 ** 64
+
+#Live objects per type, as the ad hoc gc.get_objects() prints counted them
+def count_objects():
+    gc.collect()
+    return collections.Counter(type(obj).__name__ for obj in gc.get_objects())
+
+#Runs one stage at a time for the article being profiled. Stages nest, parse runs inside extract_article, so
+#entering one pauses the stage it was called from and leaving it resumes that stage.
+class StageProfiler:
+    def __init__(self):
+        self.profiles = {stage: cProfile.Profile() for stage in STAGES}
+        self.allocations = {stage: collections.Counter() for stage in STAGES} #(filename, lineno) -> bytes left behind
+        self.num_blocks = {stage: collections.Counter() for stage in STAGES}
+        self.peaks = collections.Counter() #Largest traced memory of a single run of each stage
+        self.stacks = {stage: collections.Counter() for stage in STAGES} #Collapsed stack -> microseconds
+        self.seconds = collections.Counter() #Wall time per stage of the SAMPLED articles
+        self.num_articles = collections.Counter() #Per mode
+        self.mode = None
+        self.running = []
+        self.segment_start = None
+        self.current = None #Stage the sampler thread attributes its samples to, None while not sampling
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+
+    def start(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SAMPLE_INTERVAL) #So the sampler gets the GIL about as often as it asks for it
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+        sys.setswitchinterval(self.switch_interval)
+
+    def begin_article(self, idx):
+        self.mode = MODES[idx % len(MODES)]
+        self.num_articles[self.mode] += 1
+
+    def begin(self, stage):
+        if self.running:
+            self.pause()
+        self.running.append(stage)
+        self.resume()
+
+    def end(self):
+        self.pause()
+        self.running.pop()
+        if self.running:
+            self.resume()
+
+    def resume(self):
+        stage = self.running[-1]
+        self.segment_start = time.perf_counter()
+        if self.mode == TRACEMALLOC:
+            tracemalloc.start()
+        elif self.mode == SAMPLED:
+            self.current = stage
+        else:
+            self.profiles[stage].enable() #Last, so as little of the profiler's own code as possible is in the profile
+
+    #Ends the running stage's part, what tracemalloc traced since resume() and is still alive is what it left behind
+    def pause(self):
+        stage = self.running[-1]
+        if self.mode == CPROFILE:
+            self.profiles[stage].disable()
+        elif self.mode == SAMPLED:
+            self.current = None
+            self.seconds[stage] += time.perf_counter() - self.segment_start
+        else:
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+            self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            for stat in snapshot.statistics('lineno'):
+                frame = stat.traceback[0]
+                self.allocations[stage][frame.filename, frame.lineno] += stat.size
+                self.num_blocks[stage][frame.filename, frame.lineno] += stat.count
+
+    #fn that runs as stage
+    def wrap(self, stage, fn):
+        def call(*args, **kwargs):
+            self.begin(stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.end()
+        return call
+
+    #Sampler thread, every SAMPLE_INTERVAL the profiled thread's stack is added to its stage's collapsed stacks,
+    #weighted by the time since the last sample. Frames of this module and the ones above profile_article are left out.
+    def sample(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            now = time.perf_counter()
+            stage, frame = self.current, sys._current_frames().get(self.thread_id)
+            if stage is not None and frame is not None:
+                stack = []
+                while frame is not None and frame.f_code is not profile_article.__code__:
+                    code = frame.f_code
+                    if code.co_filename != __file__:
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[stage][';'.join(reversed(stack))] += round((now - last) * 1e6)
+            last = now
+
+    def write(self, profile_dir):
+        os.makedirs(profile_dir, exist_ok=True)
+        for stage in STAGES:
+            if self.num_articles[CPROFILE]:
+                self.profiles[stage].dump_stats(os.path.join(profile_dir, f'{stage}.prof'))
+            with open(os.path.join(profile_dir, f'{stage}.folded'), 'w', encoding='utf-8') as folded_file:
+                folded_file.write(''.join(f'{stack} {count}\n' for stack, count in self.stacks[stage].most_common() if count))
+
+    def report(self):
+        lines = []
+        total = sum(self.seconds.values())
+        num_sampled = self.num_articles[SAMPLED]
+        lines.append(f'Time per stage over the {num_sampled} timed articles')
+        for stage in STAGES:
+            share = self.seconds[stage] / total if total else 0.0
+            per_article = self.seconds[stage] / num_sampled * 1000 if num_sampled else 0.0
+            lines.append(f'  {stage:<8} {per_article:10.2f} ms/article {share:7.1%}')
+        for stage in STAGES:
+            lines.append('')
+            lines.append(f'== {stage} ==')
+            if self.num_articles[CPROFILE]:
+                lines.append(f'Top functions by own time over the {self.num_articles[CPROFILE]} cProfile articles')
+                stream = io.StringIO()
+                try:
+                    pstats.Stats(self.profiles[stage], stream=stream).sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+                except TypeError: #The stage never ran, e.g. every fetch failed
+                    pass
+                lines.append(stream.getvalue().strip('\n'))
+            if self.num_articles[TRACEMALLOC]:
+                lines.append(f'Allocations left behind, summed over the {self.num_articles[TRACEMALLOC]} tracemalloc articles, largest peak of one run {self.peaks[stage] / 1024:.1f} KB')
+                for (filename, lineno), size in self.allocations[stage].most_common(TOP_ALLOCATIONS):
+                    lines.append(f'  {size / 1024:10.1f} KB {self.num_blocks[stage][filename, lineno]:8} blocks  {filename}:{lineno}')
+        return lines
+
+#Fetches, parses, extracts and writes one article, returns False if its fetch or extraction failed
+def profile_article(profiler, scraper, idx, article, output_file):
+    profiler.begin_article(idx)
+    profiler.begin('fetch')
+    try:
+        r = scraper.s.get(article)
+        html = r.text
+    except Exception as e:
+        print(f'{article}\t{e}')
+        return False
+    finally:
+        profiler.end()
+
+    profiler.begin('extract')
+    try:
+        result = scraper.extract_article(article, html)
+        crawled = engine.CrawlResult(idx, article, result, engine.get_status(result), len(r.content))
+    except Exception as e: #Only fails this article, as a parse error does in engine.crawl
+        print(f'{article}\tParseError: {type(e).__name__}: {e}')
+        crawled = engine.CrawlResult(idx, article, None, engine.ERROR, len(r.content), reason=f'ParseError: {type(e).__name__}: {e}')
+    finally:
+        profiler.end()
+
+    profiler.begin('write')
+    try:
+        output_file.write(scraper.format_output(crawled), crawled)
+    finally:
+        profiler.end()
+    return crawled.status != engine.ERROR
+
+#Profiles the sample of one sitemap scraper's links, returns the directory the profiles were saved to
+def profile_site(name, scraper, run_metrics = None):
+    run_metrics = run_metrics or metrics.RunMetrics(name)
+    link_list, _ = linkcache.load_articles(scraper.CACHE_FILEPATH, lambda: scraper.iter_urls(run_metrics), scraper.USE_CACHE, getattr(scraper, 'NUM_URLS_TO_SCRAPE', -1), sample=scraper.SAMPLE_URLS)
+    profile_dir = os.path.join(PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}')
+    os.makedirs(profile_dir, exist_ok=True)
+
+    dedup_index = dedup.DedupIndex(os.path.join(profile_dir, 'dedup.sqlite')) if scraper.DEDUP else None
+    options = records.scraper_options(name, scraper, run_metrics, dedup_index, os.path.join(profile_dir, os.path.basename(scraper.REJECTED_FILEPATH)))
+    quality_filter = options['quality']
+    output_file = records.open_output(scraper.OUTPUT_FORMAT, os.path.join(profile_dir, os.path.basename(scraper.OUTPUT_FILEPATH)), os.path.join(profile_dir, os.path.basename(scraper.RECORDS_FILEPATH)), scraper.OUTPUT_SHARDS, **options)
+
+    profiler = StageProfiler()
+    #The scrapers parse inside extract_article, so for the run their parsers are swapped for ones that run as the parse stage
+    parse_html, beautiful_soup = extractors.parse_html, scraper.BeautifulSoup
+    extractors.parse_html, scraper.BeautifulSoup = profiler.wrap('parse', parse_html), profiler.wrap('parse', beautiful_soup)
+    objects_before = count_objects()
+    num_profiled = num_failed = 0
+    profiler.start()
+    try:
+        for article, _ in link_list:
+            if num_profiled >= MAX_ARTICLES:
+                break
+            if not sampled(article, PROFILE_FRACTION):
+                continue
+            if not profile_article(profiler, scraper, num_profiled, article, output_file):
+                num_failed += 1
+            num_profiled += 1
+            print(f'Profiled {num_profiled} articles', end='\r')
+        print()
+    finally:
+        profiler.stop()
+        extractors.parse_html, scraper.BeautifulSoup = parse_html, beautiful_soup
+        output_file.close()
+        if quality_filter:
+            quality_filter.close()
+        if dedup_index:
+            dedup_index.close()
+    growth = count_objects()
+    growth.subtract(objects_before)
+
+    profiler.write(profile_dir)
+    lines = [f'{name}: profiled {num_profiled} articles, {num_failed} failed to fetch or extract, {PROFILE_FRACTION:.1%} sample of the links up to {MAX_ARTICLES}', '']
+    lines += profiler.report()
+    lines += ['', 'Object types that grew over the run (gc)']
+    lines += [f'  {count:+10} {type_name}' for type_name, count in growth.most_common(TOP_TYPES) if count > 0]
+    with open(os.path.join(profile_dir, 'report.txt'), 'w', encoding='utf-8') as report_file:
+        report_file.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines[:len(STAGES) + 3]))
+    print(f'{name}: profiles saved to {profile_dir}')
+    return profile_dir
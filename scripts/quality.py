@@ -0,0 +1,124 @@
+import collections
+import os
+import re
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#LANGUAGE AND QUALITY FILTER FOR THE PARAGRAPHS WRITTEN TO THE CORPUS
+#Each paragraph is scored on its script (share of its letters that are CJK or Latin), its length and its share
+#of punctuation, and dropped if it falls below its site's QualityRule: English lines in the Chinese corpora,
+#Chinese lines in the English ones, and short junk like captions, bylines and lone symbols.
+#All paragraphs of an article are scored together. With numpy they are one array of code points: every code
+#point is classed with one table lookup and the counts per paragraph and class come from one bincount, so an
+#article costs a handful of array operations however long it is. Without numpy the same counts come from
+#regular expressions, several times slower.
+#Rejected paragraphs are written to a side file with their URL and reason, so thresholds can be checked and tuned.
+
+#script is 'cjk' or 'latin', the share of the paragraph's letters that have to be in it is min_script_ratio
+#min_chars counts the characters that are not whitespace, max_punct_ratio is the most of them that may be punctuation
+QualityRule = collections.namedtuple('QualityRule', ['script', 'min_script_ratio', 'min_chars', 'max_punct_ratio'])
+
+#Why a paragraph was rejected, counted by metrics.RunMetrics.count_rejected
+SHORT = 'short'
+SCRIPT = 'script'
+PUNCTUATION = 'punctuation'
+
+#Code point classes
+OTHER, SPACE, LATIN, CJK, PUNCT = range(5)
+NUM_CLASSES = 5
+CLASS_RANGES = {
+    SPACE: [(0x00, 0x20), (0x7f, 0xa0), (0x2000, 0x200b), (0x2028, 0x2029), (0x3000, 0x3000), (0xfeff, 0xfeff)],
+    LATIN: [(0x41, 0x5a), (0x61, 0x7a), (0xc0, 0xd6), (0xd8, 0xf6), (0xf8, 0x24f), (0x1e00, 0x1eff)],
+    CJK: [(0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff), (0x20000, 0x2ffff)],
+    PUNCT: [(0x21, 0x2f), (0x3a, 0x40), (0x5b, 0x60), (0x7b, 0x7e), (0xa1, 0xbf), (0x2010, 0x2027), (0x2030, 0x205e),
+        (0x3001, 0x303f), (0xfe30, 0xfe4f), (0xff01, 0xff0f), (0xff1a, 0xff20), (0xff3b, 0xff40), (0xff5b, 0xff65)],
+}
+COUNTED = (SPACE, LATIN, CJK, PUNCT)
+
+#Class of every code point of the Basic Multilingual Plane, code points above it are OTHER or CJK (extension B on)
+if numpy is not None:
+    CLASS_TABLE = numpy.zeros(0x10000, dtype=numpy.uint8)
+    for class_id, ranges in CLASS_RANGES.items():
+        for low, high in ranges:
+            if low <= 0xffff:
+                CLASS_TABLE[low:min(high, 0xffff) + 1] = class_id
+#The same classes as regular expressions for the fallback without numpy
+CLASS_PATTERNS = {class_id: re.compile('[' + ''.join(f'\\U{low:08x}-\\U{high:08x}' for low, high in ranges) + ']') for class_id, ranges in CLASS_RANGES.items()}
+
+#{class: counts} for a list of paragraphs, one count per paragraph
+def count_classes(paragraphs):
+    if numpy is None:
+        return {class_id: [len(CLASS_PATTERNS[class_id].findall(paragraph)) for paragraph in paragraphs] for class_id in COUNTED}
+
+    codes = numpy.frombuffer('\n'.join(paragraphs).encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+    classes = CLASS_TABLE[numpy.minimum(codes, 0xffff)]
+    astral = codes > 0xffff
+    if astral.any():
+        classes[astral] = numpy.where((codes[astral] >= 0x20000) & (codes[astral] <= 0x2ffff), CJK, OTHER)
+    #One bincount over (paragraph, class) pairs, the \n after each paragraph is counted as one of its spaces
+    lengths = numpy.array([len(paragraph) + 1 for paragraph in paragraphs])
+    lengths[-1] -= 1
+    pairs = numpy.repeat(numpy.arange(len(paragraphs)) * NUM_CLASSES, lengths) + classes
+    counts = numpy.bincount(pairs, minlength=len(paragraphs) * NUM_CLASSES).reshape(len(paragraphs), NUM_CLASSES).T
+    counts[SPACE, :-1] -= 1
+    return {class_id: counts[class_id].tolist() for class_id in COUNTED}
+
+#Reason each paragraph fails rule, None for the ones that pass
+def check(paragraphs, rule):
+    counts = count_classes(paragraphs)
+    script = CJK if rule.script == 'cjk' else LATIN
+    reasons = []
+    for idx, paragraph in enumerate(paragraphs):
+        num_chars = len(paragraph) - counts[SPACE][idx]
+        num_letters = counts[LATIN][idx] + counts[CJK][idx]
+        if num_chars < rule.min_chars:
+            reasons.append(SHORT)
+        elif not num_letters or counts[script][idx] / num_letters < rule.min_script_ratio:
+            reasons.append(SCRIPT)
+        elif counts[PUNCT][idx] / num_chars > rule.max_punct_ratio:
+            reasons.append(PUNCTUATION)
+        else:
+            reasons.append(None)
+    return reasons
+
+#Filters one site's articles by its QualityRule and appends what it drops to rejected_filepath as
+#url<TAB>reason<TAB>paragraph lines. The writers flush the side file when they flush the corpus.
+class QualityFilter:
+    def __init__(self, rule, rejected_filepath, metrics = None):
+        self.rule = rule
+        self.metrics = metrics
+        os.makedirs(os.path.dirname(rejected_filepath) or '.', exist_ok=True)
+        self.rejected_file = open(rejected_filepath, 'a', encoding='utf-8')
+        self.num_rejected = collections.Counter()
+
+    def filter_paragraphs(self, paragraphs, url):
+        scored = [idx for idx, paragraph in enumerate(paragraphs) if paragraph.strip()]
+        reasons = dict(zip(scored, check([paragraphs[idx] for idx in scored], self.rule))) if scored else {}
+        kept = []
+        for idx, paragraph in enumerate(paragraphs):
+            reason = reasons.get(idx)
+            if reason is None:
+                kept.append(paragraph)
+                continue
+            self.rejected_file.write(f'{url}\t{reason}\t{paragraph}\n')
+            self.num_rejected[reason] += 1
+            if self.metrics is not None:
+                self.metrics.count_rejected(reason, len(paragraph))
+        return kept
+
+    #Article text with one paragraph per line, or a records.py record, without its rejected paragraphs
+    #None when nothing is left
+    def filter(self, article, url):
+        if isinstance(article, dict):
+            paragraphs = self.filter_paragraphs(article['paragraphs'], url)
+            return {**article, 'paragraphs': paragraphs} if paragraphs else None
+        lines = self.filter_paragraphs(article.split('\n'), url)
+        return '\n'.join(lines) if any(line.strip() for line in lines) else None
+
+    def flush(self):
+        self.rejected_file.flush()
+
+    def close(self):
+        self.rejected_file.close()
@@ -0,0 +1,171 @@
+import asyncio
+import collections
+import email.utils
+import time
+
+#ADAPTIVE PER HOST RATE CONTROL
+#Concurrency grows by one per round trip while responses are fine and halves when the host throttles (AIMD).
+#A throttle also starts a token bucket at half the measured request rate, raised again steadily and
+#dropped after THROTTLE_RESET seconds without a throttle.
+
+INITIAL_LIMIT = 4 #Concurrent requests per host before anything has been learnt about it
+MIN_LIMIT = 1
+DECREASE_FACTOR = 0.5
+RATE_INCREASE = 5.0 #Requests per second added to the token bucket rate per second without throttling
+MIN_RATE = 0.2 #Requests per second
+RATE_WINDOW = 5 #Seconds of completed requests used to measure the current rate
+LATENCY_ALPHA = 0.1 #Weight of the newest sample in the moving average latency
+BASELINE_ALPHA = 0.01 #Same for the slow moving baseline it is compared with
+LATENCY_FACTOR = 3 #Moving average above this many times the baseline counts as the host slowing down
+LATENCY_WARMUP = 20 #Responses before latency is used as a signal
+THROTTLE_PAUSE = 1 #Seconds the host is paused after a throttle, doubled for each throttle in a row
+THROTTLE_RESET = 30 #Seconds without a throttle before the token bucket is dropped and the pause starts again from THROTTLE_PAUSE
+MAX_PAUSE = 120
+THROTTLE_STATUSES = (429, 503)
+
+#Seconds to wait from a Retry-After header, either a number of seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+class HostController:
+    #on_wake() is called whenever a request may be able to start, e.g. engine.Scheduler.notify
+    def __init__(self, max_limit, adaptive = True, on_wake = None):
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.on_wake = on_wake
+        self.limit = min(INITIAL_LIMIT, max_limit) if adaptive else max_limit
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.loop = asyncio.get_running_loop()
+        self.rate = None #No token bucket until the host first throttles
+        self.tokens = 1.0
+        self.refilled = self.loop.time()
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.last_throttle = 0
+        self.num_throttles_in_row = 0
+        self.completed = collections.deque() #Finish times within RATE_WINDOW
+        self.latency = None
+        self.baseline_latency = None
+        self.num_responses = 0
+        self.num_throttles = 0
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = self.loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._wake()
+                raise
+        self.in_flight += 1
+        try:
+            await self._take_token()
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    async def _take_token(self):
+        while True:
+            now = self.loop.time()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.rate is None:
+                return
+            self.tokens = min(self.tokens + (now - self.refilled) * self.rate, max(self.rate, 1.0))
+            self.refilled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    #0 when a request can start now, the seconds left of a pause, or None while the limit is reached
+    def wait_time(self):
+        if self.in_flight >= int(self.limit):
+            return None
+        return max(self.paused_until - self.loop.time(), 0)
+
+    def _wake(self):
+        num_free = int(self.limit) - self.in_flight
+        while num_free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                num_free -= 1
+        if self.on_wake is not None:
+            self.on_wake()
+
+    #Returns False when the limit was already lowered within the last round trip,
+    #requests that were in flight together tend to fail together
+    def _decrease(self):
+        now = self.loop.time()
+        if now - self.last_decrease < (self.latency or 1.0):
+            return False
+        self.last_decrease = now
+        self.limit = max(self.limit * DECREASE_FACTOR, MIN_LIMIT)
+        return True
+
+    def on_response(self, latency):
+        now = self.loop.time()
+        self.num_responses += 1
+        self.completed.append(now)
+        while self.completed[0] < now - RATE_WINDOW:
+            self.completed.popleft()
+        if not self.adaptive:
+            return
+
+        if self.latency is None:
+            self.latency = self.baseline_latency = latency
+        self.latency = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+        self.baseline_latency = BASELINE_ALPHA * latency + (1 - BASELINE_ALPHA) * self.baseline_latency
+        if self.num_responses >= LATENCY_WARMUP and self.latency > LATENCY_FACTOR * self.baseline_latency:
+            self._decrease()
+            return
+
+        self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+        if self.rate is not None:
+            self.rate += RATE_INCREASE / self.rate
+            if now - self.last_throttle > THROTTLE_RESET:
+                self.rate = None
+        self._wake()
+
+    #Connection failures and timeouts, the host may be overloaded but nothing says to stop
+    def on_error(self):
+        if self.adaptive:
+            self._decrease()
+
+    #429/503 or a site specific block page, e.g. 8world's Access denied
+    def on_throttle(self, retry_after = None):
+        now = self.loop.time()
+        self.num_throttles += 1
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, now + min(retry_after, MAX_PAUSE))
+        if now < self.paused_until and retry_after is None: #Sent before the pause started, already dealt with
+            return
+
+        if now - self.last_throttle > THROTTLE_RESET:
+            self.num_throttles_in_row = 0
+        self.last_throttle = now
+        self.num_throttles_in_row += 1
+        if retry_after is None:
+            self.paused_until = now + min(THROTTLE_PAUSE * 2 ** (self.num_throttles_in_row - 1), MAX_PAUSE)
+        if not self.adaptive:
+            return
+
+        current_rate = len(self.completed) / RATE_WINDOW
+        if self._decrease() and current_rate:
+            self.rate = max(min(self.rate or current_rate, current_rate) * DECREASE_FACTOR, MIN_RATE)
+            self.tokens = 0.0
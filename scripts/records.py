@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+import dedup
+import extractors
+import quality
+from writer import ArticleWriter
+from shards import ShardWriter
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#STRUCTURED RECORD OUTPUT, ONE RECORD PER ARTICLE INSTEAD OF FLATTENED TEXT
+#A record is a dict: url, site, title, date and the list of paragraphs (SMD has its own fields, see scrape_smd.py)
+#OUTPUT_FORMAT 'jsonl' writes one JSON object per line, 'parquet' writes columnar part files
+#<root>-00000.parquet, <root>-00001.parquet... that pyarrow, pandas or DuckDB can read column by column
+
+OUTPUT_FORMATS = ('text', 'jsonl', 'parquet')
+PARQUET_ROWS = 10000 #Records per parquet part file, each part is committed with the crawl state as a whole
+PARQUET_COMPRESSION = 'zstd'
+
+#Record for an article page, root is its parsed tree and paragraphs the scraper's paragraph texts
+def build_record(site, article, root, paragraphs):
+    title, date = extractors.page_metadata(root)
+    return {'url': article, 'site': site, 'title': title, 'date': date, 'paragraphs': paragraphs}
+
+#UTF-8 bytes of the record's text, what the write stage metrics count
+def record_size(record):
+    num_bytes = 0
+    for value in record.values():
+        for text in value if isinstance(value, list) else [value]:
+            num_bytes += len(text.encode('utf-8')) if text else 0
+    return num_bytes
+
+#Streams records to a .jsonl file, same crash safety as ArticleWriter
+class JsonlWriter(ArticleWriter):
+    def _write_text(self, record, crawled):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        self.output_file.write(line)
+        return len(line.encode('utf-8'))
+
+def list_parts(filepath):
+    return sorted(glob.glob(f'{os.path.splitext(filepath)[0]}-[0-9][0-9][0-9][0-9][0-9].parquet'))
+
+#Buffers records and writes every flush_every of them as a parquet part file. A part is written to a temporary
+#file, renamed into place and only then committed with the state, so after a crash every part on disk is complete
+#and parts the state does not know are deleted on open. Without a state, mode 'w' deletes the existing parts.
+class ParquetWriter(ArticleWriter):
+    def __init__(self, filepath, mode = 'w', flush_every = PARQUET_ROWS, state = None, metrics = None, dedup = None, quality = None, sentence_language = None):
+        if pyarrow is None:
+            raise ImportError("OUTPUT_FORMAT 'parquet' needs the pyarrow package")
+        self.filepath = filepath
+        self.state = state
+        self.metrics = metrics
+        self.dedup = dedup
+        self.quality = quality
+        self.sentence_language = sentence_language
+        self.flush_every = flush_every
+        self.num_unflushed = 0
+        self.num_written = 0
+        self.records = []
+
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        for part in list_parts(filepath):
+            if (state is not None and state.get_offset(part) == 0) or (state is None and mode == 'w'):
+                os.remove(part)
+        parts = list_parts(filepath)
+        self.part_num = int(parts[-1][-len('00000.parquet'):-len('.parquet')]) + 1 if parts else 0
+
+    def _write_text(self, record, crawled):
+        self.records.append(record)
+        return record_size(record)
+
+    def flush(self):
+        self.num_unflushed = 0
+        if self.dedup is not None:
+            self.dedup.commit()
+        if self.quality is not None:
+            self.quality.flush()
+        if not self.records:
+            if self.state is not None:
+                self.state.commit()
+            return
+
+        schema = pyarrow.schema([(key, pyarrow.list_(pyarrow.string()) if isinstance(value, list) else pyarrow.string()) for key, value in self.records[0].items()])
+        part_filepath = f'{os.path.splitext(self.filepath)[0]}-{self.part_num:05d}.parquet'
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(self.records, schema=schema), part_filepath + '.tmp', compression=PARQUET_COMPRESSION)
+        os.replace(part_filepath + '.tmp', part_filepath)
+        if self.state is not None:
+            self.state.commit(part_filepath, len(self.records)) #The offset of a part is its number of rows
+        self.part_num += 1
+        self.records = []
+
+    def close(self):
+        self.flush()
+
+#Yields the records written to filepath with OUTPUT_FORMAT 'jsonl' or 'parquet'
+def iter_records(filepath):
+    if filepath.endswith('.jsonl'):
+        with open(filepath, 'r', encoding='utf-8') as records_file:
+            for line in records_file:
+                yield json.loads(line)
+        return
+    for part in list_parts(filepath):
+        yield from pyarrow.parquet.read_table(part).to_pylist()
+
+#Keyword arguments of open_output and the writers for a scraper's DEDUP, QUALITY_FILTER and SPLIT_SENTENCES settings
+#dedup_index is the dedup.DedupIndex to use if DEDUP is set, rejected_filepath replaces REJECTED_FILEPATH
+#The 'quality' filter, if any, is closed by the caller after the writer
+def scraper_options(name, scraper, metrics = None, dedup_index = None, rejected_filepath = None):
+    return {
+        'metrics': metrics,
+        'dedup': dedup.SiteDedup(dedup_index, name, metrics) if dedup_index and scraper.DEDUP else None,
+        'quality': quality.QualityFilter(scraper.QUALITY_RULE, rejected_filepath or scraper.REJECTED_FILEPATH, metrics) if scraper.QUALITY_FILTER else None,
+        'sentence_language': scraper.LANGUAGE if scraper.SPLIT_SENTENCES else None,
+    }
+
+#Writer for a scraper's output settings: records go to records_filepath, text to filepath,
+#as shards.ShardWriter shards when sharded is True
+def open_output(output_format, filepath, records_filepath, sharded = False, state = None, metrics = None, dedup = None, quality = None, sentence_language = None):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'OUTPUT_FORMAT must be one of {OUTPUT_FORMATS}, not {output_format!r}')
+    if output_format == 'jsonl':
+        return JsonlWriter(records_filepath, state=state, metrics=metrics, dedup=dedup, quality=quality, sentence_language=sentence_language)
+    if output_format == 'parquet':
+        return ParquetWriter(records_filepath, state=state, metrics=metrics, dedup=dedup, quality=quality, sentence_language=sentence_language)
+    if sharded:
+        return ShardWriter(filepath, state=state, metrics=metrics, dedup=dedup, quality=quality, sentence_language=sentence_language)
+    return ArticleWriter(filepath, state=state, metrics=metrics, dedup=dedup, quality=quality, sentence_language=sentence_language)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import time
+from state import MAX_ATTEMPTS
+
+#RETRY QUEUE FOR FAILED URLS, KEPT IN THE CRAWL STATE
+#Failed URLs are retried with exponential backoff up to state.MAX_ATTEMPTS times, at the end of a run
+#and on later runs, and recovered articles are appended to the existing output
+
+MAX_WAIT = 300 #Longest the end of run retries wait for the next failed URL to become due
+IMPORTED_SUFFIX = '.imported' #The errorlinks lines read by the last import are kept in a file with this suffix
+
+#Adds every URL of an errorlinks file (url or url<TAB>reason per line) to the retry queue and empties the file,
+#so it only holds the failures logged after this. Returns the number of lines read.
+#The file is only emptied once the URLs are committed to the state, a run that dies before that reads them again.
+#What was read is kept in <filepath>.imported until the next import, e.g. to queue it again after a state reset.
+def import_errorlinks(filepath, state):
+    if not os.path.isfile(filepath):
+        return 0
+    failures = []
+    with open(filepath, 'r', encoding='utf-8') as errorlinks_file:
+        for line in errorlinks_file:
+            link, _, reason = line.strip().partition('\t')
+            if link:
+                failures.append((link, reason or None))
+    state.add_failures(failures) #Committed before it returns
+    if failures:
+        #Copied rather than renamed, the logging handler keeps the file open and would follow a rename
+        shutil.copyfile(filepath, filepath + IMPORTED_SUFFIX)
+    open(filepath, 'w').close() #The logging handler appends, so it keeps writing at the new end of the file
+    return len(failures)
+
+#Yields engine.CrawlResult for failed URLs as their retries come due, until none is due within max_wait seconds
+#crawl_urls(urls) crawls a list of URLs. output_file, the state's ArticleWriter, is flushed before each pass
+#so the outcome of the previous pass is committed before the state is asked what is due.
+def crawl_failed(state, output_file, crawl_urls, max_wait = MAX_WAIT):
+    while True:
+        output_file.flush()
+        retry_list = state.due_retries()
+        if retry_list:
+            print(f'Retrying {len(retry_list)} failed URLs')
+            yield from crawl_urls(retry_list)
+            continue
+
+        wait = state.next_retry_wait()
+        if wait is None or wait > max_wait:
+            return
+        time.sleep(wait)
+
+def print_summary(state):
+    num_retrying, num_given_up = state.count_failed()
+    print(f'{num_retrying} failed URLs left to retry, {num_given_up} given up after {MAX_ATTEMPTS} attempts')
@@ -1,21 +1,47 @@
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import sys
 from bs4 import BeautifulSoup
-import os
-import concurrent.futures
+import extractors
 import time
-from tqdm import tqdm
+import engine
+import streaming
+import transport
+import linkcache
+import sitemaps
+import records
+import quality
+import sitemapsite
 import logging
 
 #8WORLD WEB CRAWLER FOR BACK TRANSLATION
 
 USE_CACHE = True
+EXTRACTOR = 'lxml' #'lxml' uses the precompiled selectors below, 'bs4' the original BeautifulSoup path
+RESUME = True #Skip URLs finished by an earlier run, False starts over and overwrites OUTPUT_FILEPATH
 SITEMAP_START = 3 #Access denied from page 1 and 2
 SITEMAP_NUM_PAGES = 63 #MAX 63
 NUM_URLS_TO_SCRAPE = -1 #change to -1 for all URLs to be scraped per sitemap page
+SAMPLE_URLS = 0 #Crawl this many URLs picked at random from the whole link cache instead, reproducible with linkcache.SAMPLE_SEED, 0 for all
 OUTPUT_FILEPATH = 'output/8w_corpus.txt'
+OUTPUT_SHARDS = False #True writes OUTPUT_FILEPATH as compressed shards with a document index, see shards.py
+OUTPUT_FORMAT = 'text' #'jsonl' or 'parquet' write one record per article (url, site, title, date, paragraphs) to RECORDS_FILEPATH instead, see records.py
+RECORDS_FILEPATH = 'output/8w_corpus.jsonl' #'parquet' writes output/8w_corpus-00000.parquet...
 CACHE_FILEPATH = 'cache/linkcache_8w.txt'
+STATE_FILEPATH = 'cache/state_8w.sqlite'
+ARCHIVE_DIR = None #Set to e.g. 'archive/8w' to keep the raw HTML of every fetched article
+STREAM_FETCH = False #True only downloads and parses a block page as far as its Access denied title, see streaming.py. Ignored while ARCHIVE_DIR is set
+DEDUP = False #True drops paragraphs already written for another article of any site, exact or near copies, see dedup.py
+QUALITY_FILTER = False #True drops paragraphs failing QUALITY_RULE (other language, too short, mostly punctuation) and logs them to REJECTED_FILEPATH, see quality.py
+#Chinese paragraphs, Latin letters of names and terms in them count one each so 30% CJK letters is enough
+QUALITY_RULE = quality.QualityRule('cjk', 0.3, 4, 0.35) #script, min_script_ratio, min_chars, max_punct_ratio
+REJECTED_FILEPATH = 'output/8w_rejected.txt'
+SPLIT_SENTENCES = False #True writes one sentence per line instead of one paragraph per line, split by the rules of LANGUAGE, see segment.py
+LANGUAGE = 'zh'
+INCREMENTAL = False #True refreshes the link cache and only fetches new or changed URLs, changed articles are appended to OUTPUT_FILEPATH
+REEXTRACT = False #True re-runs extract_article over the newest page of each URL in ARCHIVE_DIR instead of crawling, overwrites OUTPUT_FILEPATH
+RETRY_FAILED = True #Retry failed URLs at the end of the run as their backoff runs out, see retryqueue.py
+RETRY_ONLY = False #True only retries URLs that failed in earlier runs and appends what is recovered to OUTPUT_FILEPATH
+REPORT_DIR = 'reports' #A JSON run report with per stage metrics is saved here after every run
+PROMETHEUS_FILEPATH = None #Set to e.g. 'reports/8w.prom' to also save the metrics in Prometheus text format
 DEFAULT_WEBSITE = 'https://www.8world.com/'
 SITEMAP = 'https://www.8world.com/Sitemap.xml'
 ERROR_LINK = 'errorlinks/errorlinks_8w.txt'
@@ -27,68 +53,122 @@ BLACKLISTED_LINKS = ['/horoscope', '/zodiac', '/videos/']
 
 Log_Format = "%(message)s"
 logging.basicConfig(filename = ERROR_LINK,
-                    filemode = "w",
+                    filemode = "a", #Emptied by retryqueue.import_errorlinks once its URLs are committed to the crawl state
                     format = Log_Format, 
                     level = logging.ERROR)
 logger = logging.getLogger()
 
-s = requests.Session()
-s.headers.update(HEADERS)
-retry = Retry(connect=3, backoff_factor=0.5)
-adapter = HTTPAdapter(max_retries=retry)
-s.mount('http://', adapter)
-s.mount('https://', adapter)
+s = transport.requests_session(HEADERS)
 
-def gather_urls(save_to_cache = False):
-    article_list = []
-
-    #Returns 1 if link needs to be skipped, 0 if okay
-    def determine_skip_link(link):
-        if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
+#Returns 1 if link needs to be skipped, 0 if okay
+def determine_skip_link(link):
+    if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
+        return True
+    for blacklisted_link in BLACKLISTED_LINKS:
+        if link.find(blacklisted_link) != -1:
             return True
-        for blacklisted_link in BLACKLISTED_LINKS:
-            if link.find(blacklisted_link) != -1:
-                return True
-        
-        return False
     
-    for sitemap_page in range(SITEMAP_START, SITEMAP_NUM_PAGES+1):
-        r = s.get(SITEMAP, params={'page' : sitemap_page})
-        soup = BeautifulSoup(r.text, 'lxml') #Parse XML file
+    return False
 
-        for loc_element in soup.find_all('loc'):
-            link = loc_element.get_text().replace('http://default/', DEFAULT_WEBSITE)
-            if determine_skip_link(link): 
-                continue
-            article_list.append(link)
-        
-        print(f'Scraping URLs from page {sitemap_page}/{SITEMAP_NUM_PAGES}')
+#Yields (link, lastmod) as each sitemap page is parsed, all pages are fetched concurrently
+def iter_urls(run_metrics = None):
+    sitemap_urls = [f'{SITEMAP}?page={sitemap_page}' for sitemap_page in range(SITEMAP_START, SITEMAP_NUM_PAGES+1)]
+    for link, lastmod in sitemaps.discover(sitemap_urls, HEADERS, metrics=run_metrics):
+        link = link.replace('http://default/', DEFAULT_WEBSITE)
+        if determine_skip_link(link): 
+            continue
+        yield link, lastmod
+
+def gather_urls(save_to_cache = False):
+    article_list = []
+    lastmod_list = [] #Sitemap <lastmod> of each link, '' if missing
+
+    for link, lastmod in iter_urls():
+        article_list.append(link)
+        lastmod_list.append(lastmod)
+        print(f'Found {len(article_list)} URLs', end = '\r')
 
     if save_to_cache:
-        with open(CACHE_FILEPATH, 'w', encoding='utf-8') as cache_file:
-            for link in article_list:
-                cache_file.write(link + '\n')
-            print(f'Saved URLs into {CACHE_FILEPATH}')
+        linkcache.save_links(CACHE_FILEPATH, article_list, lastmod_list)
+        print(f'Saved URLs into {CACHE_FILEPATH}')
 
     return article_list
 
-def scrape_article(article):
-    output = ''
+def handle_fetch_error(article, e):
+    print(e)
+    logger.error(f'{article}\t{e}')
+    return
 
+def scrape_article(article):
     try:
         r = s.get(article)
     except Exception as e:
-        print(e)
+        return handle_fetch_error(article, e)
+
+    return extract_article(article, r.text)
+
+def extract_article(article, html):
+    if OUTPUT_FORMAT != 'text':
+        return extract_record(article, html)
+    if EXTRACTOR == 'lxml':
+        return extract_article_lxml(article, html)
+    return extract_article_bs4(article, html)
+
+ARTICLE_CONTENT = extractors.find_by_class('div', 'article-content')
+TEXT_LONG = extractors.find_by_class('div', 'text-long')
+#Block page title as the streaming fetch finds it in the raw page
+STREAM_RULE = streaming.StreamRule((b'<title>Access denied',))
+
+#Paragraph texts of the article, -1 for an Access denied page
+def extract_paragraphs_lxml(article, root):
+    title = extractors.title_string(root)
+    if title is not None and title.find('Access denied') != -1:
         logger.error(article)
+        return -1
+
+    paragraphs = []
+    if extractors.first(ARTICLE_CONTENT, root) is not None:
+        text_long = extractors.first(TEXT_LONG, root)
+        if text_long is None: #Raised so the engine records the page as an error to retry, not as empty
+            raise ValueError('article-content without a text-long container')
+        for paragraph in extractors.PARAGRAPHS(text_long):
+            text = extractors.get_text(paragraph)
+            if text.find('\u00A0') != -1: #Ignore non breaking space chars
+                continue
+            paragraphs.append(text)
+
+    return paragraphs
+
+#Same output as extract_article_bs4, but each selector runs once on a plain lxml tree
+def extract_article_lxml(article, html):
+    paragraphs = extract_paragraphs_lxml(article, extractors.parse_html(html))
+    if paragraphs == -1:
+        return -1
+    output = ''.join(text + '\n' for text in paragraphs)
+    return output if output else None
+
+#One record per article for OUTPUT_FORMAT 'jsonl' or 'parquet', always from the lxml selectors
+def extract_record(article, html):
+    root = extractors.parse_html(html)
+    paragraphs = extract_paragraphs_lxml(article, root)
+    if paragraphs == -1:
+        return -1
+    if not paragraphs:
         return
+    return records.build_record('8w', article, root, paragraphs)
+
+def extract_article_bs4(article, html):
+    output = ''
 
-    soup = BeautifulSoup(r.text, 'lxml')
+    soup = BeautifulSoup(html, 'lxml')
 
     if soup.find('title') and soup.find('title').string.find('Access denied') != -1:
         logger.error(article)
         return -1
 
     if soup.find('div', class_='article-content'):
+        if not soup.find('div', class_='text-long'):
+            raise ValueError('article-content without a text-long container')
         for paragraph in soup.find('div', class_='text-long').find_all('p', class_=''):
             if paragraph.get_text().find('\u00A0') != -1: #Ignore non breaking space chars
                 continue
@@ -96,40 +176,12 @@ def scrape_article(article):
     
     return output if output else None
 
+#Text written to OUTPUT_FILEPATH for an engine.CrawlResult, None writes nothing
+def format_output(crawled):
+    return crawled.result if crawled.status == engine.DONE else None
+
 def main():
-    print(f'{USE_CACHE=}')
-
-    if USE_CACHE:
-        if os.path.isfile(CACHE_FILEPATH) and os.path.getsize(CACHE_FILEPATH) > 0:
-            print('Using URLs from cache file')
-
-            with open(CACHE_FILEPATH, 'r', encoding='utf-8') as cache_file:
-                article_list = [line.strip() for line in cache_file]
-        else:
-            print('Cache file does not exist... creating now')
-            article_list = gather_urls(save_to_cache=True)
-    else:
-        article_list = gather_urls(save_to_cache=False)
-    
-    print('Starting article scraping...')
-
-    if NUM_URLS_TO_SCRAPE != -1:
-        article_list = article_list[:NUM_URLS_TO_SCRAPE]
-
-    num_access_denied = 0
-    num_nones = 0
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        with open(OUTPUT_FILEPATH, 'w', encoding='utf8') as output_file:
-            for article in tqdm(executor.map(scrape_article, article_list), total=len(article_list)):
-                if article == -1:
-                    num_access_denied += 1
-                elif article == None:
-                    num_nones += 1
-                else:
-                    output_file.write(article)
-
-    print(f'{num_access_denied=}')
-    print(f'{num_nones=}')
+    sitemapsite.main('8w', sys.modules[__name__])
 
 if __name__ == '__main__':
     t1 = time.perf_counter()
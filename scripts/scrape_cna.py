@@ -1,20 +1,45 @@
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import sys
 from bs4 import BeautifulSoup
-import os
-import concurrent.futures
+import extractors
 import time
-from tqdm import tqdm
+import streaming
+import transport
+import linkcache
+import sitemaps
+import records
+import quality
+import sitemapsite
 import logging
 
 #CNA WEB CRAWLER FOR BACK TRANSLATION
 
 USE_CACHE = True
+EXTRACTOR = 'lxml' #'lxml' uses the precompiled selectors below, 'bs4' the original BeautifulSoup path
+RESUME = True #Skip URLs finished by an earlier run, False starts over and overwrites OUTPUT_FILEPATH
 SITEMAP_NUM_PAGES = 55 #MAX 55, change for debugging
 NUM_URLS_TO_SCRAPE = -1 #change to -1 for all URLs to be scraped per sitemap page
+SAMPLE_URLS = 0 #Crawl this many URLs picked at random from the whole link cache instead, reproducible with linkcache.SAMPLE_SEED, 0 for all
 OUTPUT_FILEPATH = 'output/cna_corpus.txt'
+OUTPUT_SHARDS = False #True writes OUTPUT_FILEPATH as compressed shards with a document index, see shards.py
+OUTPUT_FORMAT = 'text' #'jsonl' or 'parquet' write one record per article (url, site, title, date, paragraphs) to RECORDS_FILEPATH instead, see records.py
+RECORDS_FILEPATH = 'output/cna_corpus.jsonl' #'parquet' writes output/cna_corpus-00000.parquet...
 CACHE_FILEPATH = 'cache/linkcache_cna.txt'
+STATE_FILEPATH = 'cache/state_cna.sqlite'
+ARCHIVE_DIR = None #Set to e.g. 'archive/cna' to keep the raw HTML of every fetched article
+STREAM_FETCH = False #True only downloads and parses a missing page as far as its Page Not found title, see streaming.py. Ignored while ARCHIVE_DIR is set
+DEDUP = False #True drops paragraphs already written for another article of any site, exact or near copies, see dedup.py
+QUALITY_FILTER = False #True drops paragraphs failing QUALITY_RULE (other language, too short, mostly punctuation) and logs them to REJECTED_FILEPATH, see quality.py
+#English paragraphs, a quoted Chinese name or two still passes
+QUALITY_RULE = quality.QualityRule('latin', 0.9, 15, 0.2) #script, min_script_ratio, min_chars, max_punct_ratio
+REJECTED_FILEPATH = 'output/cna_rejected.txt'
+SPLIT_SENTENCES = False #True writes one sentence per line instead of one paragraph per line, split by the rules of LANGUAGE, see segment.py
+LANGUAGE = 'en'
+INCREMENTAL = False #True refreshes the link cache and only fetches new or changed URLs, changed articles are appended to OUTPUT_FILEPATH
+REEXTRACT = False #True re-runs extract_article over the newest page of each URL in ARCHIVE_DIR instead of crawling, overwrites OUTPUT_FILEPATH
+RETRY_FAILED = True #Retry failed URLs at the end of the run as their backoff runs out, see retryqueue.py
+RETRY_ONLY = False #True only retries URLs that failed in earlier runs and appends what is recovered to OUTPUT_FILEPATH
+REPORT_DIR = 'reports' #A JSON run report with per stage metrics is saved here after every run
+PROMETHEUS_FILEPATH = None #Set to e.g. 'reports/cna.prom' to also save the metrics in Prometheus text format
 DEFAULT_WEBSITE = 'https://www.channelnewsasia.com/'
 ERROR_LINK = 'errorlinks/errorlinks_cna.txt'
 SITEMAP = 'https://www.channelnewsasia.com/sitemap.xml'
@@ -24,66 +49,113 @@ HEADERS = {
     }
 BLACKLISTED_LINKS = ['/brandstudio/', '/tokyo-2020/', '/taxonomy/', '/author/', '/rss/', '/interactives/', '/node/', '/about-us/', '/contact-us/']
 
-s = requests.Session()
-s.headers.update(HEADERS)
-retry = Retry(connect=3, backoff_factor=0.5)
-adapter = HTTPAdapter(max_retries=retry)
-s.mount('http://', adapter)
-s.mount('https://', adapter)
+s = transport.requests_session(HEADERS)
 
 Log_Format = "%(message)s"
 logging.basicConfig(filename = ERROR_LINK,
-                    filemode = "w",
+                    filemode = "a", #Emptied by retryqueue.import_errorlinks once its URLs are committed to the crawl state
                     format = Log_Format, 
                     level = logging.ERROR)
 logger = logging.getLogger()
 
+#Returns 1 if link needs to be skipped, 0 if okay
+def determine_skip_link(link):
+    if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
+        return True
+    if link.split(DEFAULT_WEBSITE)[1].find('/') == -1: #Ignore section pages like https://www.channelnewsasia.com/international
+        return True
+    for blacklisted_link in BLACKLISTED_LINKS:
+        if link.find(blacklisted_link) != -1:
+            return True
+    
+    return False
+
+#Yields (link, lastmod) as each sitemap page is parsed, all pages are fetched concurrently
+def iter_urls(run_metrics = None):
+    sitemap_urls = [f'{SITEMAP}?page={sitemap_page}' for sitemap_page in range(1, SITEMAP_NUM_PAGES+1)]
+    for link, lastmod in sitemaps.discover(sitemap_urls, HEADERS, metrics=run_metrics):
+        if determine_skip_link(link): 
+            continue
+        yield link, lastmod
+
 def gather_urls(save_to_cache = False):
     article_list = []
+    lastmod_list = [] #Sitemap <lastmod> of each link, '' if missing
 
-    #Returns 1 if link needs to be skipped, 0 if okay
-    def determine_skip_link(link):
-        if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
-            return True
-        if link.split(DEFAULT_WEBSITE)[1].find('/') == -1: #Ignore section pages like https://www.channelnewsasia.com/international
-            return True
-        for blacklisted_link in BLACKLISTED_LINKS:
-            if link.find(blacklisted_link) != -1:
-                return True
-        
-        return False
-
-    for sitemap_page in range(1, SITEMAP_NUM_PAGES+1):
-        r = s.get(SITEMAP, params={'page' : sitemap_page})
-        soup = BeautifulSoup(r.text, 'lxml') #Parse XML file
-
-        for loc_element in soup.find_all('loc'):
-            link = loc_element.get_text()
-            if determine_skip_link(link): 
-                continue
-            article_list.append(link)
-        
-        print(f'Scraping URLs from page {sitemap_page}/{SITEMAP_NUM_PAGES}', end = '\r')
+    for link, lastmod in iter_urls():
+        article_list.append(link)
+        lastmod_list.append(lastmod)
+        print(f'Found {len(article_list)} URLs', end = '\r')
 
     if save_to_cache:
-        with open(CACHE_FILEPATH, 'w', encoding='utf-8') as cache_file:
-            for link in article_list:
-                cache_file.write(link + '\n')
-            print(f'Saved URLs into {CACHE_FILEPATH}')
+        linkcache.save_links(CACHE_FILEPATH, article_list, lastmod_list)
+        print(f'Saved URLs into {CACHE_FILEPATH}')
 
     return article_list
 
-def scrape_article(article):
-    output = ''
+def handle_fetch_error(article, e):
+    print(e)
+    logger.error(f'{article}\t{e}')
+    return
 
+def scrape_article(article):
     try:
         r = s.get(article)
     except Exception as e:
-        print(e)
+        return handle_fetch_error(article, e)
+
+    return extract_article(article, r.text)
+
+def extract_article(article, html):
+    if OUTPUT_FORMAT != 'text':
+        return extract_record(article, html)
+    if EXTRACTOR == 'lxml':
+        return extract_article_lxml(article, html)
+    return extract_article_bs4(article, html)
+
+TEXT_LONG = extractors.find_by_class('div', 'text-long')
+PODCAST_DESCRIPTION = extractors.find_by_class('div', 'podcast-main__description')
+#Not found title as the streaming fetch finds it in the raw page
+STREAM_RULE = streaming.StreamRule((b'<title>Page Not found',))
+
+#Paragraph texts of the article, None for a missing page
+def extract_paragraphs_lxml(article, root):
+    title = extractors.title_string(root)
+    if title is not None and title.find('Page Not found') != -1:
         logger.error(article)
         return
 
-    soup = BeautifulSoup(r.text, 'lxml')
+    paragraphs = []
+    for content_div in (extractors.first(TEXT_LONG, root), extractors.first(PODCAST_DESCRIPTION, root)):
+        if content_div is None:
+            continue
+        for paragraph in extractors.PARAGRAPHS(content_div):
+            text = extractors.get_text(paragraph)
+            if text.find('\u00A0') != -1: #Ignore non breaking space chars
+                continue
+            paragraphs.append(text)
+
+    return paragraphs
+
+#Same output as extract_article_bs4, but each selector runs once on a plain lxml tree
+def extract_article_lxml(article, html):
+    paragraphs = extract_paragraphs_lxml(article, extractors.parse_html(html))
+    if paragraphs is None:
+        return
+    return ''.join(text + '\n' for text in paragraphs)
+
+#One record per article for OUTPUT_FORMAT 'jsonl' or 'parquet', always from the lxml selectors
+def extract_record(article, html):
+    root = extractors.parse_html(html)
+    paragraphs = extract_paragraphs_lxml(article, root)
+    if not paragraphs:
+        return
+    return records.build_record('cna', article, root, paragraphs)
+
+def extract_article_bs4(article, html):
+    output = ''
+
+    soup = BeautifulSoup(html, 'lxml')
 
     if soup.find('title') and soup.find('title').string.find('Page Not found') != -1:
         logger.error(article)
@@ -104,38 +176,12 @@ def scrape_article(article):
     return output
 
 
+#Text written to OUTPUT_FILEPATH for an engine.CrawlResult, None writes nothing
+def format_output(crawled):
+    return crawled.result
+
 def main():
-    print(f'{USE_CACHE=}')
-
-    if USE_CACHE:
-        if os.path.isfile(CACHE_FILEPATH) and os.path.getsize(CACHE_FILEPATH) > 0:
-            print('Using URLs from cache file')
-
-            with open(CACHE_FILEPATH, 'r', encoding='utf-8') as cache_file:
-                article_list = [line.strip() for line in cache_file]
-        else:
-            print('Cache file does not exist... creating now')
-            article_list = gather_urls(save_to_cache=True)
-    else:
-        article_list = gather_urls(save_to_cache=False)
-    
-    print('Starting article scraping...')
-
-    if NUM_URLS_TO_SCRAPE != -1:
-        article_list = article_list[:NUM_URLS_TO_SCRAPE]
-
-    num_access_denied = 0
-    num_nones = 0
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        with open(OUTPUT_FILEPATH, 'w', encoding='utf8') as output_file:
-            for article in tqdm(executor.map(scrape_article, article_list), total=len(article_list)):
-                if article == None:
-                    num_nones += 1
-                else:
-                    output_file.write(article)
-
-    print(f'{num_access_denied=}')
-    print(f'{num_nones=}')
+    sitemapsite.main('cna', sys.modules[__name__])
 
 if __name__ == '__main__':
     t1 = time.perf_counter()
@@ -1,20 +1,26 @@
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
+import extractors
 import os
-import concurrent.futures
 import time
+import engine
+import transport
+import linkcache
+import records
+import segment
 from tqdm import tqdm
 import logging
-from itertools import zip_longest
 
 #SINGAPORE MANDARIN DATABASE WEB CRAWLER FOR BACK TRANSLATION
 
 USE_CACHE = True
+EXTRACTOR = 'lxml' #'lxml' uses the precompiled selectors below, 'bs4' the original BeautifulSoup path
 NUM_PAGES = 20
 OUTPUT_EN = 'output/smd_corpus.en'
 OUTPUT_ZH = 'output/smd_corpus.zh'
+SPLIT_SENTENCES = False #True splits each zh line and its en line into sentences when both have as many, see segment.py
+ORDERED_OUTPUT = True #Writes the terms in search page order. False writes them as they complete, the zh and en files stay aligned either way
+OUTPUT_FORMAT = 'text' #'jsonl' or 'parquet' write one record per term with its zh and en fields side by side to RECORDS_FILEPATH instead, see records.py
+RECORDS_FILEPATH = 'output/smd_corpus.jsonl' #'parquet' writes output/smd_corpus-00000.parquet...
 CACHE_FILEPATH = 'cache/linkcache_smd.txt'
 BASE_WEBSITE = 'https://www.languagecouncils.sg'
 SCRAPING_WEBSITE = 'https://www.languagecouncils.sg/mandarin/ch/learning-resources/singaporean-mandarin-database/search'
@@ -30,12 +36,7 @@ logging.basicConfig(filename = ERROR_LINK,
                     level = logging.ERROR)
 logger = logging.getLogger()
 
-s = requests.Session()
-s.headers.update(HEADERS)
-retry = Retry(connect=3, backoff_factor=0.5)
-adapter = HTTPAdapter(max_retries=retry)
-s.mount('http://', adapter)
-s.mount('https://', adapter)
+s = transport.requests_session(HEADERS)
 
 def gather_urls(save_to_cache = False):
     article_list = []
@@ -49,30 +50,96 @@ def gather_urls(save_to_cache = False):
         for row in soup.find_all('div', class_='table-row'):
             if 'header' in row.get('class'):
                 continue
-            article_list.append(row.get('onclick').split('\'')[1]) #['window.location=', '/mandarin/ch/learning-resources/singaporean-mandarin-database/terms/loan-shark', '']
+            article_list.append(BASE_WEBSITE + row.get('onclick').split('\'')[1]) #['window.location=', '/mandarin/ch/learning-resources/singaporean-mandarin-database/terms/loan-shark', '']
             zh_chars.append(row.find(class_='ch').get_text())
             en_chars.append(row.find(class_='en').get_text())
 
     if save_to_cache:
         with open(CACHE_FILEPATH, 'w', encoding='utf-8') as cache_file:
             for idx, link in enumerate(article_list):
-                cache_file.write(f'{BASE_WEBSITE}{link}|{zh_chars[idx]}|{en_chars[idx]}\n')
+                cache_file.write(f'{link}|{zh_chars[idx]}|{en_chars[idx]}\n')
             print(f'Saved URLs into {CACHE_FILEPATH}')
 
     return article_list, zh_chars, en_chars
 
-def scrape_article(article):
-    zh_output = []
-    en_output = []
+def handle_fetch_error(article, e):
+    print(e)
+    logger.error(article)
+    return
 
+def scrape_article(article):
     try:
         r = s.get(article)
     except Exception as e:
-        print(e)
-        logger.error(article)
-        return
+        return handle_fetch_error(article, e)
+
+    return extract_article(article, r.text)
+
+#Remove &nbsp; \n , strip string
+def clean_string(string):
+    return string.replace(u'\u00a0', '').replace('\n', ' ').strip()
+
+def extract_article(article, html):
+    if EXTRACTOR == 'lxml':
+        return extract_article_lxml(article, html)
+    return extract_article_bs4(article, html)
+
+ZH_DEFINITION = extractors.find_by_id('div', 'smcplaceholdercontent_0_ChineseDefinitionContent')
+EN_DEFINITION = extractors.find_by_id('div', 'smcplaceholdercontent_0_EnglishDefinitionContent')
+ZH_SAMPLE = extractors.find_by_id('div', 'smcplaceholdercontent_0_ChineseSentencesContent')
+EN_SAMPLE = extractors.find_by_id('div', 'smcplaceholdercontent_0_EnglishSentencesContent')
+ZH_REGION = extractors.find_by_id('div', 'smcplaceholdercontent_0_ChineseTermsUsedContent')
+EN_REGION = extractors.find_by_id('div', 'smcplaceholdercontent_0_EnglishTermsUsedContent')
+COLUMN = extractors.find_by_class('div', 'column', relative=True)
+DEFINE = extractors.find_by_class_string('p', 'english__text grammarBox__define', relative=True)
+
+#Returns (definition, from_sibling), from_sibling is True when the define paragraph was empty
+def read_definition_lxml(definition_div):
+    list_items = extractors.LIST_ITEMS(definition_div)
+    if list_items: #If definition is a list, only the last item is kept
+        return clean_string(extractors.get_text(list_items[-1])), False
+    column = extractors.first(COLUMN, definition_div)
+    if column is not None:
+        return clean_string(extractors.get_text(column)), False
+    define = extractors.first(DEFINE, definition_div)
+    if clean_string(extractors.get_text(define)) == '':
+        return clean_string(extractors.next_sibling_text(define)), True
+    return clean_string(extractors.get_text(define)), False
+
+#Same output as extract_article_bs4, but each selector runs once on a plain lxml tree
+def extract_article_lxml(article, html):
+    root = extractors.parse_html(html)
+
+    #Definition
+    zh_definition = en_definition = '-'
+    zh_definition_div = extractors.first(ZH_DEFINITION, root)
+    if zh_definition_div is not None:
+        zh_definition, _ = read_definition_lxml(zh_definition_div)
+    en_definition_div = extractors.first(EN_DEFINITION, root)
+    if en_definition_div is not None:
+        definition, from_sibling = read_definition_lxml(en_definition_div)
+        if from_sibling: #The bs4 path stores this case in zh_definition, kept for identical output
+            zh_definition = definition
+        else:
+            en_definition = definition
+
+    zh_output = [zh_definition]
+    en_output = [en_definition]
+
+    #Sample sentence, terms used in other regions
+    for zh_selector, en_selector in ((ZH_SAMPLE, EN_SAMPLE), (ZH_REGION, EN_REGION)):
+        zh_div = extractors.first(zh_selector, root)
+        en_div = extractors.first(en_selector, root)
+        zh_output.append(clean_string(extractors.get_text(zh_div)) if zh_div is not None else '-')
+        en_output.append(clean_string(extractors.get_text(en_div)) if en_div is not None else '-')
+
+    return zh_output, en_output
 
-    soup = BeautifulSoup(r.text, 'lxml')
+def extract_article_bs4(article, html):
+    zh_output = []
+    en_output = []
+
+    soup = BeautifulSoup(html, 'lxml')
     
     # #Etymology
     # zh_etymology_id = 'smcplaceholdercontent_0_ChineseEtymologyContent'
@@ -99,10 +166,6 @@ def scrape_article(article):
     #         zh_output += (zh_para + '\n') if zh_para else '-\n'
     #         en_output += (en_para + '\n') if en_para else '-\n'
 
-    #Remove &nbsp; \n , strip string
-    def clean_string(string):
-        return string.replace(u'\u00a0', '').replace('\n', ' ').strip()
-
     #Definition
     zh_definition_div = soup.find('div', id='smcplaceholdercontent_0_ChineseDefinitionContent')
     en_definition_div = soup.find('div', id='smcplaceholdercontent_0_EnglishDefinitionContent')
@@ -156,40 +219,68 @@ def scrape_article(article):
 
     return zh_output, en_output
 
-def main():
-    print(f'{USE_CACHE=}')
+#(url, zh term, en term) of a cache line
+def parse_term(line):
+    article, zh, en = line.strip().split('|')
+    return article, zh, en
 
-    article_list = []
-    zh_list = []
-    en_list = []
+#Returns the (url, zh term, en term) of every term, indexed like the crawl's idx. From the cache file this is a
+#linkcache.LinkCache that reads each term when it is needed, from the search pages a list.
+def load_terms():
     if USE_CACHE:
         if os.path.isfile(CACHE_FILEPATH) and os.path.getsize(CACHE_FILEPATH) > 0:
             print('Using URLs from cache file')
+            return linkcache.LinkCache(CACHE_FILEPATH, parse_term)
 
-            with open(CACHE_FILEPATH, 'r', encoding='utf-8') as cache_file:
-                for line in cache_file:
-                    article, zh, en = line.strip().split('|')
-                    article_list.append(article)
-                    zh_list.append(zh)
-                    en_list.append(en)
-        else:
-            print('Cache file does not exist... creating now')
-            article_list, zh_list, en_list = gather_urls(save_to_cache=True)
-    else:
-        article_list, zh_list, en_list = gather_urls(save_to_cache=False)
+        print('Cache file does not exist... creating now')
+        return list(zip(*gather_urls(save_to_cache=True)))
+    return list(zip(*gather_urls(save_to_cache=False)))
+
+#Writes one term and its (zh_output, en_output) to both files, line by line aligned
+def write_term(zh_file, en_file, zh_term, en_term, result):
+    zh_output, en_output = result
+    zh_file.write(zh_term + '\n')
+    en_file.write(en_term + '\n')
+    for line_zh, line_en in zip(zh_output, en_output):
+        zh_lines, en_lines = segment.split_pair(line_zh, line_en) if SPLIT_SENTENCES else ([line_zh], [line_en])
+        zh_file.write(''.join(line + '\n' for line in zh_lines))
+        en_file.write(''.join(line + '\n' for line in en_lines))
+    zh_file.write('\n')
+    en_file.write('\n')
+
+#Record of one term, each zh field sits next to the en field it translates
+def build_term_record(article, zh_term, en_term, result):
+    zh_output, en_output = result
+    record = {'url': article, 'site': 'smd', 'zh_term': zh_term, 'en_term': en_term}
+    for field, zh, en in zip(('definition', 'sample', 'region'), zh_output, en_output):
+        record[f'zh_{field}'] = zh
+        record[f'en_{field}'] = en
+    return record
+
+def main():
+    print(f'{USE_CACHE=}')
+    print(f'{OUTPUT_FORMAT=}')
+
+    terms = load_terms()
+    article_list = (article for article, _, _ in terms)
 
     print('Starting article scraping...')
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        with open(OUTPUT_EN, 'w', encoding='utf8') as en_file, open(OUTPUT_ZH, 'w', encoding='utf8') as zh_file:
-            for idx, (zh_output, en_output) in enumerate(tqdm(executor.map(scrape_article, article_list), total=len(article_list))):
-                zh_file.write(zh_list[idx] + '\n')
-                en_file.write(en_list[idx] + '\n')
-                for line_zh, line_en in zip(zh_output, en_output):
-                    zh_file.write(line_zh + '\n')
-                    en_file.write(line_en + '\n')
-                zh_file.write('\n')
-                en_file.write('\n')
+    if OUTPUT_FORMAT != 'text':
+        with records.open_output(OUTPUT_FORMAT, None, RECORDS_FILEPATH) as output_file:
+            for crawled in tqdm(engine.crawl(article_list, extract_article, handle_fetch_error, HEADERS, ordered=ORDERED_OUTPUT), total=len(terms)):
+                if crawled.result is None: #Fetch failed, logged by handle_fetch_error
+                    continue
+                _, zh_term, en_term = terms[crawled.idx]
+                output_file.write(build_term_record(crawled.url, zh_term, en_term, crawled.result))
+        return
+
+    with open(OUTPUT_EN, 'w', encoding='utf8') as en_file, open(OUTPUT_ZH, 'w', encoding='utf8') as zh_file:
+        for crawled in tqdm(engine.crawl(article_list, extract_article, handle_fetch_error, HEADERS, ordered=ORDERED_OUTPUT), total=len(terms)):
+            if crawled.result is None: #Fetch failed, logged by handle_fetch_error. Skipped whole so both files stay aligned
+                continue
+            _, zh_term, en_term = terms[crawled.idx]
+            write_term(zh_file, en_file, zh_term, en_term, crawled.result)
 
 if __name__ == '__main__':
     t1 = time.perf_counter()
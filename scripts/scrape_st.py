@@ -1,17 +1,46 @@
-import requests
+import sys
 from bs4 import BeautifulSoup
-import os
-import concurrent.futures
+import extractors
 import time
-from tqdm import tqdm
-import gc
+import streaming
+import transport
+import linkcache
+import sitemaps
+import records
+import quality
+import sitemapsite
+import logging
 
 #STRAITS TIMES WEB CRAWLER FOR BACK TRANSLATION
 
 USE_CACHE = True
+EXTRACTOR = 'lxml' #'lxml' uses the precompiled selectors below, 'bs4' the original BeautifulSoup path
+RESUME = True #Skip URLs finished by an earlier run, False starts over and overwrites OUTPUT_FILEPATH
+SAMPLE_URLS = 0 #Crawl this many URLs picked at random from the whole link cache instead, reproducible with linkcache.SAMPLE_SEED, 0 for all
 SITEMAP_NUM_PAGES = 30 #MAX 30
+ORDERED_OUTPUT = False #True keeps the output in cache file order, a slow article then holds back the ones after it
 OUTPUT_FILEPATH = 'output/st_corpus.txt'
+OUTPUT_SHARDS = False #True writes OUTPUT_FILEPATH as compressed shards with a document index, see shards.py
+OUTPUT_FORMAT = 'text' #'jsonl' or 'parquet' write one record per article (url, site, title, date, paragraphs) to RECORDS_FILEPATH instead, see records.py
+RECORDS_FILEPATH = 'output/st_corpus.jsonl' #'parquet' writes output/st_corpus-00000.parquet...
 CACHE_FILEPATH = 'cache/linkcache_st.txt'
+STATE_FILEPATH = 'cache/state_st.sqlite'
+ARCHIVE_DIR = None #Set to e.g. 'archive/st' to keep the raw HTML of every fetched article
+STREAM_FETCH = False #True only downloads and parses a premium article as far as its premium flag, see streaming.py. Ignored while ARCHIVE_DIR is set
+DEDUP = False #True drops paragraphs already written for another article of any site, exact or near copies, see dedup.py
+QUALITY_FILTER = False #True drops paragraphs failing QUALITY_RULE (other language, too short, mostly punctuation) and logs them to REJECTED_FILEPATH, see quality.py
+#English paragraphs, a quoted Chinese name or two still passes
+QUALITY_RULE = quality.QualityRule('latin', 0.9, 15, 0.2) #script, min_script_ratio, min_chars, max_punct_ratio
+REJECTED_FILEPATH = 'output/st_rejected.txt'
+SPLIT_SENTENCES = False #True writes one sentence per line instead of one paragraph per line, split by the rules of LANGUAGE, see segment.py
+LANGUAGE = 'en'
+INCREMENTAL = False #True refreshes the link cache and only fetches new or changed URLs, changed articles are appended to OUTPUT_FILEPATH
+REEXTRACT = False #True re-runs extract_article over the newest page of each URL in ARCHIVE_DIR instead of crawling, overwrites OUTPUT_FILEPATH
+RETRY_FAILED = True #Retry failed URLs at the end of the run as their backoff runs out, see retryqueue.py
+RETRY_ONLY = False #True only retries URLs that failed in earlier runs and appends what is recovered to OUTPUT_FILEPATH
+REPORT_DIR = 'reports' #A JSON run report with per stage metrics is saved here after every run
+PROMETHEUS_FILEPATH = None #Set to e.g. 'reports/st.prom' to also save the metrics in Prometheus text format
+ERROR_LINK = 'errorlinks/errorlinks_st.txt'
 DEFAULT_WEBSITE = 'https://www.straitstimes.com'
 SITEMAP = 'https://www.straitstimes.com/sitemap.xml'
 HEADERS = {
@@ -19,44 +48,103 @@ HEADERS = {
     'hl'        :  'en'
     }
 
-s = requests.Session()
-s.headers.update(HEADERS)
+Log_Format = "%(message)s"
+logging.basicConfig(filename = ERROR_LINK,
+                    filemode = "a", #Emptied by retryqueue.import_errorlinks once its URLs are committed to the crawl state
+                    format = Log_Format, 
+                    level = logging.ERROR)
+logger = logging.getLogger()
 
-def gather_urls(save_to_cache = False):
-    article_list = []
+s = transport.requests_session(HEADERS)
 
-    for sitemap_page in range(1, SITEMAP_NUM_PAGES+1):
-        r = s.get(SITEMAP, params={'page' : sitemap_page})
-        soup = BeautifulSoup(r.text, 'lxml') #Parse XML file
+#Yields (link, lastmod) as each sitemap page is parsed, all pages are fetched concurrently
+def iter_urls(run_metrics = None):
+    sitemap_urls = [f'{SITEMAP}?page={sitemap_page}' for sitemap_page in range(1, SITEMAP_NUM_PAGES+1)]
+    for link, lastmod in sitemaps.discover(sitemap_urls, HEADERS, metrics=run_metrics):
+        if link == f'{DEFAULT_WEBSITE}/': #Ignore straitstimes.com front page
+            continue
+        if link.find('multimedia') != -1: #Ignore multimedia articles
+            continue
+        yield link, lastmod
 
-        for loc_element in soup.find_all('loc'):
-            link = loc_element.get_text()
-            if link == f'{DEFAULT_WEBSITE}/': #Ignore straitstimes.com front page
-                continue
-            if link.find('multimedia') != -1: #Ignore multimedia articles
-                continue
+def gather_urls(save_to_cache = False):
+    article_list = []
+    lastmod_list = [] #Sitemap <lastmod> of each link, '' if missing
 
-            article_list.append(link)
-        print(f'Scraping URLs from page {sitemap_page}/{SITEMAP_NUM_PAGES}')
+    for link, lastmod in iter_urls():
+        article_list.append(link)
+        lastmod_list.append(lastmod)
+        print(f'Found {len(article_list)} URLs', end = '\r')
 
     if save_to_cache:
-        with open(CACHE_FILEPATH, 'w', encoding='utf-8') as cache_file:
-            for link in article_list:
-                cache_file.write(link + '\n')
-            print(f'Saved URLs into {CACHE_FILEPATH}')
+        linkcache.save_links(CACHE_FILEPATH, article_list, lastmod_list)
+        print(f'Saved URLs into {CACHE_FILEPATH}')
 
     return article_list
 
-def scrape_article(article):
-    output = ''
+def handle_fetch_error(article, e):
+    print(e)
+    logger.error(f'{article}\t{e}')
+    return
 
+def scrape_article(article):
     try:
         r = s.get(article)
     except Exception as e:
-        print(e)
-        return 'ERROR\n'
+        return handle_fetch_error(article, e)
+
+    return extract_article(article, r.text)
+
+def extract_article(article, html):
+    if OUTPUT_FORMAT != 'text':
+        return extract_record(article, html)
+    if EXTRACTOR == 'lxml':
+        return extract_article_lxml(article, html)
+    return extract_article_bs4(article, html)
 
-    soup = BeautifulSoup(r.text, 'lxml')
+PREMIUM_FLAG = extractors.find_by_class_string('div', 'paid-premium st-flag-1')
+PARAGRAPH_TEXT = extractors.find_by_class_string('div', 'clearfix text-formatted field field--name-field-paragraph-text field--type-text-long field--label-hidden field__item')
+#Premium flag as the streaming fetch finds it in the raw page
+STREAM_RULE = streaming.StreamRule((b'class="paid-premium st-flag-1"',))
+
+#Paragraph texts of the article, None for premium articles and pages without paragraphs
+def extract_paragraphs_lxml(article, root):
+    if extractors.first(PREMIUM_FLAG, root) is not None: #Do not scrape premium articles
+        return
+    paragraph_div = extractors.first(PARAGRAPH_TEXT, root)
+    if paragraph_div is None: #Skip if article has no paragraph
+        return
+
+    paragraphs = []
+    for paragraph in extractors.PARAGRAPHS(paragraph_div):
+        text = extractors.get_text(paragraph)
+        if text == "READ MORE HERE": #Ignore the READ MORE HERE from Morning Briefing articles
+            continue
+        if text.find('\u00A0') != -1: #Ignore non breaking space chars
+            continue
+        paragraphs.append(text)
+
+    return paragraphs
+
+#Same output as extract_article_bs4, but each selector runs once on a plain lxml tree
+def extract_article_lxml(article, html):
+    paragraphs = extract_paragraphs_lxml(article, extractors.parse_html(html))
+    if paragraphs is None:
+        return
+    return ''.join(text + '\n' for text in paragraphs)
+
+#One record per article for OUTPUT_FORMAT 'jsonl' or 'parquet', always from the lxml selectors
+def extract_record(article, html):
+    root = extractors.parse_html(html)
+    paragraphs = extract_paragraphs_lxml(article, root)
+    if not paragraphs:
+        return
+    return records.build_record('st', article, root, paragraphs)
+
+def extract_article_bs4(article, html):
+    output = ''
+
+    soup = BeautifulSoup(html, 'lxml')
 
     if soup.find('div', class_='paid-premium st-flag-1'): #Do not scrape premium articles
         return
@@ -73,34 +161,14 @@ def scrape_article(article):
     return output
 
 
+#Text written to OUTPUT_FILEPATH for an engine.CrawlResult, None writes nothing
+def format_output(crawled):
+    if OUTPUT_FORMAT != 'text':
+        return crawled.result
+    return crawled.result + '\n' if crawled.result else None
+
 def main():
-    print(f'{USE_CACHE=}')
-
-    if USE_CACHE:
-        if os.path.isfile(CACHE_FILEPATH) and os.path.getsize(CACHE_FILEPATH) > 0:
-            print('Using URLs from cache file')
-
-            with open(CACHE_FILEPATH, 'r', encoding='utf-8') as cache_file:
-                article_list = [line.strip() for line in cache_file]
-        else:
-            print('Cache file does not exist... creating now')
-            article_list = gather_urls(save_to_cache=True)
-    else:
-        article_list = gather_urls(save_to_cache=False)
-    
-    print('Starting article scraping...')
-
-    results = []
-    print(len(gc.get_objects()))
-    with concurrent.futures.ProcessPoolExecutor() as executor: 
-        for article in tqdm(executor.map(scrape_article, article_list), total=len(article_list)):
-            results.append(article)
-    gc.collect()
-    print(len(gc.get_objects()))
-    with open(OUTPUT_FILEPATH, 'a', encoding='utf-8') as output_file:
-        for page in results:
-            if page:
-                output_file.write(page + '\n')
+    sitemapsite.main('st', sys.modules[__name__])
 
 if __name__ == '__main__':
     t1 = time.perf_counter()
@@ -1,18 +1,45 @@
-import requests
+import sys
 from bs4 import BeautifulSoup
-import bs4
-import os
-import concurrent.futures
+import extractors
 import time
-from tqdm import tqdm
-import gc
+import transport
+import linkcache
+import sitemaps
+import records
+import quality
+import sitemapsite
+import logging
 
 #ZAOBAO WEB CRAWLER FOR BACK TRANSLATION
 
 USE_CACHE = True
+EXTRACTOR = 'lxml' #'lxml' uses the precompiled selectors below, 'bs4' the original BeautifulSoup path
+RESUME = True #Skip URLs finished by an earlier run, False starts over and overwrites OUTPUT_FILEPATH
 NUM_URLS_TO_SCRAPE = -1 #change to -1 for all URLs to be scraped per sitemap page
+SAMPLE_URLS = 0 #Crawl this many URLs picked at random from the whole link cache instead, reproducible with linkcache.SAMPLE_SEED, 0 for all
+ORDERED_OUTPUT = False #True keeps the output in cache file order, a slow article then holds back the ones after it
 OUTPUT_FILEPATH = 'output/zb_corpus.txt'
+OUTPUT_SHARDS = False #True writes OUTPUT_FILEPATH as compressed shards with a document index, see shards.py
+OUTPUT_FORMAT = 'text' #'jsonl' or 'parquet' write one record per article (url, site, title, date, paragraphs) to RECORDS_FILEPATH instead, see records.py
+RECORDS_FILEPATH = 'output/zb_corpus.jsonl' #'parquet' writes output/zb_corpus-00000.parquet...
 CACHE_FILEPATH = 'cache/linkcache_zb.txt'
+STATE_FILEPATH = 'cache/state_zb.sqlite'
+ARCHIVE_DIR = None #Set to e.g. 'archive/zb' to keep the raw HTML of every fetched article
+STREAM_FETCH = False #ZaoBao pages have no skip marker, so there is nothing to stream for, see streaming.py
+DEDUP = False #True drops paragraphs already written for another article of any site, exact or near copies, see dedup.py
+QUALITY_FILTER = False #True drops paragraphs failing QUALITY_RULE (other language, too short, mostly punctuation) and logs them to REJECTED_FILEPATH, see quality.py
+#Chinese paragraphs, Latin letters of names and terms in them count one each so 30% CJK letters is enough
+QUALITY_RULE = quality.QualityRule('cjk', 0.3, 4, 0.35) #script, min_script_ratio, min_chars, max_punct_ratio
+REJECTED_FILEPATH = 'output/zb_rejected.txt'
+SPLIT_SENTENCES = False #True writes one sentence per line instead of one paragraph per line, split by the rules of LANGUAGE, see segment.py
+LANGUAGE = 'zh'
+INCREMENTAL = False #True refreshes the link cache and only fetches new or changed URLs, changed articles are appended to OUTPUT_FILEPATH
+REEXTRACT = False #True re-runs extract_article over the newest page of each URL in ARCHIVE_DIR instead of crawling, overwrites OUTPUT_FILEPATH
+RETRY_FAILED = True #Retry failed URLs at the end of the run as their backoff runs out, see retryqueue.py
+RETRY_ONLY = False #True only retries URLs that failed in earlier runs and appends what is recovered to OUTPUT_FILEPATH
+REPORT_DIR = 'reports' #A JSON run report with per stage metrics is saved here after every run
+PROMETHEUS_FILEPATH = None #Set to e.g. 'reports/zb.prom' to also save the metrics in Prometheus text format
+ERROR_LINK = 'errorlinks/errorlinks_zb.txt'
 DEFAULT_WEBSITE = 'https://www.zaobao.com.sg/'
 SITEMAP = 'https://www.zaobao.com.sg/sitemap.xml'
 HEADERS = {
@@ -21,64 +48,108 @@ HEADERS = {
     }
 BLACKLISTED_LINKS = ['/zodiac/']
 
-s = requests.Session()
-s.headers.update(HEADERS)
-
-def gather_urls(save_to_cache = False):
-    article_list = []
-    sitemap_subpages_list = []
-
-    #Returns 1 if link needs to be skipped, 0 if okay
-    def determine_skip_link(link):
-        if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
+Log_Format = "%(message)s"
+logging.basicConfig(filename = ERROR_LINK,
+                    filemode = "a", #Emptied by retryqueue.import_errorlinks once its URLs are committed to the crawl state
+                    format = Log_Format, 
+                    level = logging.ERROR)
+logger = logging.getLogger()
+
+s = transport.requests_session(HEADERS)
+
+#Returns 1 if link needs to be skipped, 0 if okay
+def determine_skip_link(link):
+    if link == f'{DEFAULT_WEBSITE}': #Ignore front page aka (DEFAULT_WEBSITE)
+        return True
+    for blacklisted_link in BLACKLISTED_LINKS:
+        if link.find(blacklisted_link) != -1:
             return True
-        for blacklisted_link in BLACKLISTED_LINKS:
-            if link.find(blacklisted_link) != -1:
-                return True
-        
-        return False
     
-    r = s.get(SITEMAP)
-    soup = BeautifulSoup(r.text, 'lxml')
+    return False
 
-    for loc_element in soup.find_all('loc'):
-        link = loc_element.get_text()
-        if link == 'https://www.zaobao.com.sg/sitemaps/sitemap-0.xml': #Skip page 0 of sitemap
+#Returns True for sub-sitemaps of the sitemap index that are not crawled
+def determine_skip_sitemap(link):
+    return link == 'https://www.zaobao.com.sg/sitemaps/sitemap-0.xml' #Skip page 0 of sitemap
+
+#Yields (link, lastmod) as each sub-sitemap is parsed, the sub-sitemaps are fetched concurrently
+def iter_urls(run_metrics = None):
+    for link, lastmod in sitemaps.discover([SITEMAP], HEADERS, skip_sitemap=determine_skip_sitemap, metrics=run_metrics):
+        if determine_skip_link(link): 
             continue
-        sitemap_subpages_list.append(link)
+        yield link, lastmod
 
-    
-    total_pages = len(sitemap_subpages_list)
-    for idx, sitemap_subpage in enumerate(sitemap_subpages_list):
-        r = s.get(sitemap_subpage)
-        soup = BeautifulSoup(r.text, 'html.parser')
-
-        for loc_element in soup.find_all(text=lambda tag: isinstance(tag, bs4.CData)):
-            link = loc_element.string.strip()
-            if determine_skip_link(link): 
-                continue
-            article_list.append(link)
-        
-        print(f'Scraping URLs from page {idx+1}/{total_pages}')
+def gather_urls(save_to_cache = False):
+    article_list = []
+    lastmod_list = [] #Sitemap <lastmod> of each link, '' if missing
+
+    for link, lastmod in iter_urls():
+        article_list.append(link)
+        lastmod_list.append(lastmod)
+        print(f'Found {len(article_list)} URLs', end = '\r')
 
     if save_to_cache:
-        with open(CACHE_FILEPATH, 'w', encoding='utf-8') as cache_file:
-            for link in article_list:
-                cache_file.write(link + '\n')
-            print(f'Saved URLs into {CACHE_FILEPATH}')
+        linkcache.save_links(CACHE_FILEPATH, article_list, lastmod_list)
+        print(f'Saved URLs into {CACHE_FILEPATH}')
 
     return article_list
 
-def scrape_article(article):
-    output = ''
+def handle_fetch_error(article, e):
+    print(e)
+    logger.error(f'{article}\t{e}')
+    return
 
+def scrape_article(article):
     try:
         r = s.get(article)
     except Exception as e:
-        print(e)
-        return ''
+        return handle_fetch_error(article, e)
+
+    return extract_article(article, r.text)
+
+def extract_article(article, html):
+    if OUTPUT_FORMAT != 'text':
+        return extract_record(article, html)
+    if EXTRACTOR == 'lxml':
+        return extract_article_lxml(article, html)
+    return extract_article_bs4(article, html)
+
+RAWHTML = extractors.find_by_class('div', 'article-content-rawhtml')
+STREAM_RULE = None #No skip marker, every page is read whole
+
+#Paragraph texts of the article, None for pages without paragraphs
+def extract_paragraphs_lxml(article, root):
+    rawhtml_div = extractors.first(RAWHTML, root)
+    if rawhtml_div is None: #Skip if article has no paragraph
+        return
+
+    paragraphs = []
+    for paragraph in extractors.PARAGRAPHS(rawhtml_div):
+        text = extractors.get_text(paragraph)
+        if text.find('\u00A0') != -1: #Ignore non breaking space chars
+            continue
+        paragraphs.append(text)
+
+    return paragraphs
+
+#Same output as extract_article_bs4, but each selector runs once on a plain lxml tree
+def extract_article_lxml(article, html):
+    paragraphs = extract_paragraphs_lxml(article, extractors.parse_html(html))
+    if paragraphs is None:
+        return
+    return ''.join(text + '\n' for text in paragraphs)
+
+#One record per article for OUTPUT_FORMAT 'jsonl' or 'parquet', always from the lxml selectors
+def extract_record(article, html):
+    root = extractors.parse_html(html)
+    paragraphs = extract_paragraphs_lxml(article, root)
+    if not paragraphs:
+        return
+    return records.build_record('zb', article, root, paragraphs)
 
-    soup = BeautifulSoup(r.text, 'lxml')
+def extract_article_bs4(article, html):
+    output = ''
+
+    soup = BeautifulSoup(html, 'lxml')
 
     if not soup.find('div', class_='article-content-rawhtml'): #Skip if article has no paragraph
         return
@@ -91,37 +162,12 @@ def scrape_article(article):
     return output
 
 
-def main():
-    print(f'{USE_CACHE=}')
-
-    if USE_CACHE:
-        if os.path.isfile(CACHE_FILEPATH) and os.path.getsize(CACHE_FILEPATH) > 0:
-            print('Using URLs from cache file')
-
-            with open(CACHE_FILEPATH, 'r', encoding='utf-8') as cache_file:
-                article_list = [line.strip() for line in cache_file]
-        else:
-            print('Cache file does not exist... creating now')
-            article_list = gather_urls(save_to_cache=True)
-    else:
-        article_list = gather_urls(save_to_cache=False)
-    
-    print('Starting article scraping...')
-
-    results = []
-    if NUM_URLS_TO_SCRAPE != -1:
-        article_list = article_list[:NUM_URLS_TO_SCRAPE]
-
-    with concurrent.futures.ProcessPoolExecutor() as executor: 
-        for article in tqdm(executor.map(scrape_article, article_list), total=len(article_list)):
-            results.append(article)
+#Text written to OUTPUT_FILEPATH for an engine.CrawlResult, None writes nothing
+def format_output(crawled):
+    return crawled.result
 
-    gc.collect()
-
-    with open(OUTPUT_FILEPATH, 'w', encoding='utf-8') as output_file:
-        for page in results:
-            if page:
-                output_file.write(page)
+def main():
+    sitemapsite.main('zb', sys.modules[__name__])
 
 if __name__ == '__main__':
     t1 = time.perf_counter()
@@ -0,0 +1,143 @@
+import concurrent.futures
+import itertools
+import os
+import re
+import sys
+import time
+from engine import NUM_PARSERS
+
+#SENTENCE SEGMENTATION, ONE SENTENCE PER LINE FOR THE BACK TRANSLATION PIPELINE
+#Chinese is split after 。！？ (and !?), English after . ! ? followed by a capital, except after the common
+#abbreviations and initials below. Closing quotes and brackets stay with the sentence they close.
+#  python segment.py output/zb_corpus.txt zh                     writes output/zb_corpus.sentences.txt
+#  python segment.py output/smd_corpus.zh output/smd_corpus.en   writes output/smd_corpus.sentences.zh and .en
+#Files are read in chunks of CHUNK_LINES lines that are split on all cores and written back in order, so any
+#size of corpus streams through in bounded memory. Blank lines, the article and term separators, are kept.
+#The SMD pair stays aligned line for line: a zh line and its en line are only split when both give the same
+#number of sentences, otherwise the pair is written whole.
+#The scrapers can also split inline as articles are written, see SPLIT_SENTENCES.
+
+CHUNK_LINES = 10000 #Lines per task sent to a segmentation process
+ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'gen', 'col', 'lt', 'sgt', 'capt', 'gov', 'sen', 'rep',
+    'no', 'vs', 'etc', 'inc', 'ltd', 'co', 'corp', 'dept', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec'}
+LANGUAGES = ('zh', 'en')
+
+CLOSING = '」』”’）)\\]"\''
+ZH_SENTENCE = re.compile(f'[^。！？!?]+(?:[。！？!?]+[{CLOSING}]*)?|[。！？!?]+[{CLOSING}]*')
+EN_BOUNDARY = re.compile(f'[.!?]+[{CLOSING}]*\\s+(?=[“‘"\'(\\[]?[A-Z0-9])')
+INITIALISM = re.compile(r'(?:[a-z]\.)+[a-z]?') #u.s. e.g. p.m.
+
+def split_zh(paragraph):
+    return [sentence.strip() for sentence in ZH_SENTENCE.findall(paragraph) if sentence.strip()]
+
+def split_en(paragraph):
+    sentences = []
+    start = 0
+    for boundary in EN_BOUNDARY.finditer(paragraph):
+        word = paragraph[max(paragraph.rfind(' ', start, boundary.start()) + 1, start):boundary.start()].lstrip('“‘"\'([').lower()
+        if paragraph[boundary.start()] == '.' and (word in ABBREVIATIONS or len(word) == 1 or INITIALISM.fullmatch(word + '.')):
+            continue
+        sentences.append(paragraph[start:boundary.end()].strip())
+        start = boundary.end()
+    sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+SPLITTERS = {'zh': split_zh, 'en': split_en}
+
+#Sentences of one line of text, a blank line stays one blank line
+def split_sentences(line, language):
+    if not line.strip():
+        return ['']
+    return SPLITTERS[language](line)
+
+#A line of text per paragraph becomes a line per sentence
+def segment_text(text, language):
+    return '\n'.join(sentence for line in text.split('\n') for sentence in split_sentences(line, language))
+
+#Article text or records.py record as the writers write it with SPLIT_SENTENCES, a record keeps its paragraphs
+#and gets their sentences as well
+def segment_article(article, language):
+    if isinstance(article, dict):
+        return {**article, 'sentences': [sentence for paragraph in article['paragraphs'] for sentence in SPLITTERS[language](paragraph)]}
+    return segment_text(article, language)
+
+#(zh sentences, en sentences) of an aligned pair of lines, the pair itself if they do not split alike
+def split_pair(zh_line, en_line):
+    zh_sentences, en_sentences = split_sentences(zh_line, 'zh'), split_sentences(en_line, 'en')
+    if len(zh_sentences) == len(en_sentences):
+        return zh_sentences, en_sentences
+    return [zh_line.strip()], [en_line.strip()]
+
+#Chunk workers, they return the number of lines they were given with what those lines became
+def segment_lines(lines, language):
+    return len(lines), [sentence for line in lines for sentence in split_sentences(line.rstrip('\n'), language)]
+
+def segment_pairs(pairs):
+    zh_out, en_out = [], []
+    for zh_line, en_line in pairs:
+        zh_sentences, en_sentences = split_pair(zh_line.rstrip('\n'), en_line.rstrip('\n'))
+        zh_out += zh_sentences
+        en_out += en_sentences
+    return len(pairs), (zh_out, en_out)
+
+def iter_chunks(lines, chunk_lines = CHUNK_LINES):
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_lines))
+        if not chunk:
+            return
+        yield chunk
+
+#Runs fn over every chunk on all cores and yields the results in order, like archive.reextract
+def map_chunks(fn, chunks, args = (), num_workers = NUM_PARSERS):
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        pending = []
+        while True:
+            #Keep every process busy without reading the whole file up front
+            for chunk in chunks:
+                pending.append(executor.submit(fn, chunk, *args))
+                if len(pending) >= num_workers * 2:
+                    break
+            if not pending:
+                return
+            yield pending.pop(0).result()
+
+#output/zb_corpus.txt -> output/zb_corpus.sentences.txt
+def sentences_filepath(filepath):
+    root, ext = os.path.splitext(filepath)
+    return f'{root}.sentences{ext}'
+
+#Returns (lines read, sentences written)
+def segment_file(filepath, language, output_filepath = None, num_workers = NUM_PARSERS):
+    num_lines = num_sentences = 0
+    with open(filepath, 'r', encoding='utf-8') as input_file, open(output_filepath or sentences_filepath(filepath), 'w', encoding='utf-8') as output_file:
+        for num_chunk_lines, sentences in map_chunks(segment_lines, iter_chunks(input_file), (language,), num_workers):
+            output_file.write(''.join(sentence + '\n' for sentence in sentences))
+            num_lines += num_chunk_lines
+            num_sentences += len(sentences)
+    return num_lines, num_sentences
+
+#Returns (line pairs read, sentence pairs written), a file longer than the other is cut to the shorter one's length
+def segment_pair_files(zh_filepath, en_filepath, num_workers = NUM_PARSERS):
+    num_pairs = num_sentences = 0
+    with open(zh_filepath, 'r', encoding='utf-8') as zh_file, open(en_filepath, 'r', encoding='utf-8') as en_file, \
+        open(sentences_filepath(zh_filepath), 'w', encoding='utf-8') as zh_output, open(sentences_filepath(en_filepath), 'w', encoding='utf-8') as en_output:
+        for num_chunk_pairs, (zh_sentences, en_sentences) in map_chunks(segment_pairs, iter_chunks(zip(zh_file, en_file)), (), num_workers):
+            zh_output.write(''.join(sentence + '\n' for sentence in zh_sentences))
+            en_output.write(''.join(sentence + '\n' for sentence in en_sentences))
+            num_pairs += num_chunk_pairs
+            num_sentences += len(zh_sentences)
+    return num_pairs, num_sentences
+
+if __name__ == '__main__':
+    t1 = time.perf_counter()
+    if len(sys.argv) == 3 and sys.argv[2] in LANGUAGES:
+        num_lines, num_sentences = segment_file(sys.argv[1], sys.argv[2])
+        print(f'Split {num_lines} lines into {num_sentences} sentences, see {sentences_filepath(sys.argv[1])}')
+    elif len(sys.argv) == 3:
+        num_pairs, num_sentences = segment_pair_files(sys.argv[1], sys.argv[2])
+        print(f'Split {num_pairs} line pairs into {num_sentences} sentence pairs, see {sentences_filepath(sys.argv[1])} and {sentences_filepath(sys.argv[2])}')
+    else:
+        print('Usage: python segment.py <corpus> zh|en, or python segment.py <zh file> <en file> for an aligned pair')
+    t2 = time.perf_counter()
+    print(f'Program took {t2-t1} seconds to complete')
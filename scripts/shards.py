@@ -0,0 +1,185 @@
+import collections
+import glob
+import gzip
+import os
+from writer import ArticleWriter, FLUSH_EVERY
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#SHARDED, COMPRESSED CORPUS OUTPUT WITH A DOCUMENT INDEX
+#OUTPUT_FILEPATH output/cna_corpus.txt becomes output/cna_corpus-00000.txt.zst, output/cna_corpus-00001.txt.zst...
+#each with an index output/cna_corpus-00000.idx. Documents are written in blocks, each block is its own
+#zstd frame or gzip member, so any document can be read by decompressing only the block it is in.
+
+COMPRESSION = 'zstd' if zstandard else 'gzip' #zstd needs the zstandard package
+COMPRESS_LEVEL = {'zstd': 10, 'gzip': 6}
+SHARD_SIZE = 256 << 20 #Compressed bytes per shard before a new one is started
+SHARD_DOCS = 100000 #Documents per shard before a new one is started
+BLOCK_SIZE = 1 << 20 #Uncompressed bytes per block, also cut at every flush
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+
+#One index line: where the document's block is in the shard and where the document is in the decompressed block
+IndexEntry = collections.namedtuple('IndexEntry', ['block_offset', 'block_length', 'doc_offset', 'doc_length', 'num_paragraphs', 'url'])
+
+def compress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=COMPRESS_LEVEL['zstd']).compress(data)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL['gzip'])
+
+def decompress(data, shard_filepath):
+    if shard_filepath.endswith(EXTENSIONS['zstd']):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+#Shards of an output filepath in order, whatever their compression
+def list_shards(filepath):
+    root, ext = os.path.splitext(filepath)
+    return sorted(glob.glob(f'{root}-[0-9][0-9][0-9][0-9][0-9]{ext}.*'))
+
+def shard_filepath(filepath, shard_num, compression):
+    root, ext = os.path.splitext(filepath)
+    return f'{root}-{shard_num:05d}{ext}{EXTENSIONS[compression]}'
+
+def index_filepath(shard_filepath):
+    return shard_filepath.rsplit('.', 2)[0] + '.idx'
+
+def iter_index(shard_filepath):
+    with open(index_filepath(shard_filepath), 'r', encoding='utf-8') as index_file:
+        for line in index_file:
+            block_offset, block_length, doc_offset, doc_length, num_paragraphs, url = line.rstrip('\n').split('\t', 5)
+            yield IndexEntry(int(block_offset), int(block_length), int(doc_offset), int(doc_length), int(num_paragraphs), url)
+
+def count_documents(filepath):
+    return sum(1 for shard in list_shards(filepath) for _ in iter_index(shard))
+
+#Reads one document, only its block is decompressed
+def read_document(shard_filepath, entry):
+    with open(shard_filepath, 'rb') as shard_file:
+        shard_file.seek(entry.block_offset)
+        block = decompress(shard_file.read(entry.block_length), shard_filepath)
+    return block[entry.doc_offset:entry.doc_offset + entry.doc_length].decode('utf-8')
+
+#Yields (IndexEntry, text) for every document of a shard, decompressing each block once
+def iter_documents(shard_filepath):
+    block_offset = block = None
+    with open(shard_filepath, 'rb') as shard_file:
+        for entry in iter_index(shard_filepath):
+            if entry.block_offset != block_offset:
+                shard_file.seek(entry.block_offset)
+                block_offset, block = entry.block_offset, decompress(shard_file.read(entry.block_length), shard_filepath)
+            yield entry, block[entry.doc_offset:entry.doc_offset + entry.doc_length].decode('utf-8')
+
+#Drop-in replacement for ArticleWriter that writes filepath as shards
+#With a state.CrawlState each shard is cut back to its committed offset on open and its index to the blocks
+#left, like ArticleWriter does with its single file. Every run then starts a new shard after the existing ones.
+#Without a state, mode 'w' deletes the existing shards and 'a' starts after them.
+class ShardWriter(ArticleWriter):
+    def __init__(self, filepath, mode = 'w', flush_every = FLUSH_EVERY, state = None, metrics = None, dedup = None, quality = None, sentence_language = None, compression = COMPRESSION, shard_size = SHARD_SIZE, shard_docs = SHARD_DOCS, block_size = BLOCK_SIZE):
+        self.filepath = filepath
+        self.state = state
+        self.metrics = metrics
+        self.dedup = dedup
+        self.quality = quality
+        self.sentence_language = sentence_language
+        self.compression = compression
+        self.shard_size = shard_size
+        self.shard_docs = shard_docs
+        self.block_size = block_size
+        self.flush_every = flush_every
+        self.num_unflushed = 0
+        self.num_written = 0
+
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        for shard in list_shards(filepath):
+            if state is not None:
+                self._recover(shard, state.get_offset(shard))
+            elif mode == 'w':
+                self._remove(shard)
+        shards = list_shards(filepath)
+        self.shard_num = int(os.path.basename(shards[-1]).rsplit('-', 1)[1][:5]) + 1 if shards else 0
+        self.shard_file = self.index_file = None #Opened on the first document, a run that writes nothing leaves no shard
+        self.block = bytearray()
+        self.block_docs = [] #(doc_offset, doc_length, num_paragraphs, url) of the documents in block
+
+    def _remove(self, shard):
+        os.remove(shard)
+        if os.path.exists(index_filepath(shard)):
+            os.remove(index_filepath(shard))
+
+    #Cuts a shard back to the blocks committed with the state, an empty shard is deleted
+    def _recover(self, shard, offset):
+        if offset == 0:
+            self._remove(shard)
+            return
+        os.truncate(shard, offset)
+        entries = [entry for entry in iter_index(shard) if entry.block_offset + entry.block_length <= offset]
+        with open(index_filepath(shard), 'w', encoding='utf-8') as index_file:
+            index_file.writelines(self._index_line(entry) for entry in entries)
+
+    def _index_line(self, entry):
+        return '\t'.join(map(str, entry)) + '\n'
+
+    def _open_shard(self):
+        self.shard_filepath = shard_filepath(self.filepath, self.shard_num, self.compression)
+        self.shard_file = open(self.shard_filepath, 'wb')
+        self.index_file = open(index_filepath(self.shard_filepath), 'w', encoding='utf-8')
+        self.shard_offset = 0
+        self.num_shard_docs = 0
+
+    def _close_shard(self):
+        self.shard_file.close()
+        self.index_file.close()
+        self.shard_file = self.index_file = None
+        self.shard_num += 1
+
+    def _write_text(self, article, crawled):
+        if self.shard_file is None:
+            self._open_shard()
+        data = article.encode('utf-8')
+        num_paragraphs = sum(1 for line in article.split('\n') if line.strip())
+        self.block_docs.append((len(self.block), len(data), num_paragraphs, crawled.url if crawled is not None else ''))
+        self.block += data
+        self.num_shard_docs += 1
+        if len(self.block) >= self.block_size:
+            self._write_block()
+        if self.num_shard_docs >= self.shard_docs or self.shard_offset >= self.shard_size:
+            self.flush() #Commits the shard's final offset before the next shard is started
+            self._close_shard()
+        return len(data)
+
+    #Compresses the block into the shard, its index lines follow once it is written
+    def _write_block(self):
+        if not self.block_docs:
+            return
+        frame = compress(bytes(self.block), self.compression)
+        self.shard_file.write(frame)
+        self.index_file.writelines(self._index_line(IndexEntry(self.shard_offset, len(frame), *doc)) for doc in self.block_docs)
+        self.shard_offset += len(frame)
+        self.block = bytearray()
+        self.block_docs = []
+
+    #Cuts the block short, so everything written so far can be committed
+    def flush(self):
+        self.num_unflushed = 0
+        if self.dedup is not None:
+            self.dedup.commit()
+        if self.quality is not None:
+            self.quality.flush()
+        if self.shard_file is None:
+            if self.state is not None:
+                self.state.commit()
+            return
+        self._write_block()
+        self.shard_file.flush()
+        self.index_file.flush()
+        if self.state is not None:
+            os.fsync(self.shard_file.fileno())
+            os.fsync(self.index_file.fileno())
+            self.state.commit(self.shard_filepath, self.shard_offset)
+
+    def close(self):
+        self.flush()
+        if self.shard_file is not None:
+            self._close_shard()
@@ -0,0 +1,175 @@
+import asyncio
+import aiohttp
+import heapq
+import queue
+import threading
+import transport
+from lxml import etree
+
+#PARALLEL STREAMING SITEMAP DISCOVERY SHARED BY THE SCRAPERS
+
+NUM_CONCURRENT = 16 #Sitemap pages fetched at the same time
+MAX_PENDING_LINKS = 100000 #New sitemap pages are only started while fewer links than this wait to be consumed
+TIMEOUT = 300 #Seconds allowed per sitemap page
+CONNECT_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+CHUNK_SIZE = 1 << 16
+
+_END = object()
+
+#Parses a sitemap as its bytes arrive, calls on_link(loc, lastmod) for <url> and on_sitemap(loc) for <sitemap> entries
+#Entries are cleared once read so a large sitemap is never held as a whole tree
+class SitemapParser:
+    def __init__(self, on_link, on_sitemap):
+        self.parser = etree.XMLPullParser(events=('end',), tag=('{*}url', '{*}sitemap'), recover=True, huge_tree=True)
+        self.on_link = on_link
+        self.on_sitemap = on_sitemap
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+        self._read_events()
+
+    def close(self):
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError: #Not XML at all, e.g. an error page
+            return
+        self._read_events()
+
+    def _read_events(self):
+        for _, element in self.parser.read_events():
+            loc = (element.findtext('{*}loc') or '').strip()
+            if loc:
+                if etree.QName(element).localname == 'sitemap':
+                    self.on_sitemap(loc)
+                else:
+                    self.on_link(loc, (element.findtext('{*}lastmod') or '').strip())
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+#One sitemap page, items are its entries in document order: (loc, lastmod) for <url>, the Page of a sub-sitemap
+#for <sitemap>. position orders the pages the way a sequential depth first crawl would visit them.
+class Page:
+    def __init__(self, position, url):
+        self.position = position
+        self.url = url
+        self.items = []
+        self.done = False
+
+async def _discover(sitemap_urls, headers, skip_sitemap, num_concurrent, metrics, links):
+    root = Page((), None)
+    to_fetch = [] #Heap of (position, Page) not started yet, the earliest page is fetched first
+    #Depth first walk of the pages releasing their entries in order, [page, index of its next item]. Pages fetched
+    #out of order hold their links (num_held) until every page before them is done, as engine does for ordered output.
+    cursor = [[root, 0]]
+    num_held = 0
+
+    def add_page(parent, url):
+        page = Page(parent.position + (len(parent.items),), url)
+        parent.items.append(page)
+        heapq.heappush(to_fetch, (page.position, page))
+
+    def release():
+        nonlocal num_held
+        while cursor:
+            page, idx = cursor[-1]
+            if idx == len(page.items):
+                if not page.done:
+                    return
+                cursor.pop()
+                continue
+            cursor[-1][1] += 1
+            item, page.items[idx] = page.items[idx], None
+            if isinstance(item, Page):
+                cursor.append([item, 0])
+            else:
+                num_held -= 1
+                links.put(item)
+
+    for sitemap_url in sitemap_urls:
+        add_page(root, sitemap_url)
+    root.done = True
+    release()
+
+    async def fetch(session, page):
+        def on_link(loc, lastmod):
+            nonlocal num_held
+            page.items.append((loc, lastmod))
+            num_held += 1
+            if metrics is not None:
+                metrics.count_links(1)
+
+        def on_sitemap(loc):
+            if not (skip_sitemap and skip_sitemap(loc)):
+                add_page(page, loc)
+
+        parser = SitemapParser(on_link, on_sitemap)
+        start = asyncio.get_running_loop().time()
+        num_bytes = 0
+        for attempt in range(CONNECT_RETRIES + 1):
+            try:
+                async with session.get(page.url, trace_request_ctx=metrics) as r:
+                    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                        num_bytes += len(chunk)
+                        parser.feed(chunk)
+                        release()
+                break
+            except aiohttp.ClientConnectorError:
+                if attempt == CONNECT_RETRIES:
+                    raise
+                await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+        parser.close()
+        page.done = True
+        release()
+        if metrics is not None:
+            metrics.observe('discovery', asyncio.get_running_loop().time() - start, num_bytes)
+
+    async def worker(session):
+        while cursor:
+            #Backpressure, a page only starts when the consumer has caught up and not too many links are held back.
+            #The page the walk waits for is always the earliest one left, it may start regardless.
+            if to_fetch and (links.qsize() + num_held <= MAX_PENDING_LINKS or to_fetch[0][1] is cursor[-1][0]):
+                _, page = heapq.heappop(to_fetch)
+                await fetch(session, page)
+            else:
+                await asyncio.sleep(0.1)
+
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with transport.session(transport.connector(num_concurrent, num_concurrent), timeout, headers) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(num_concurrent)]
+        try:
+            #Workers return once every page is walked, a worker that raised ends discovery
+            for task in asyncio.as_completed(workers):
+                await task
+        finally:
+            for task in workers:
+                task.cancel()
+
+#Fetches sitemap_urls concurrently, following sitemap indexes, and yields (loc, lastmod) as soon as each
+#entry is parsed instead of after the last page. Entries come in the same order as from fetching the pages one by
+#one, a sub-sitemap's entries where the index lists it, so NUM_URLS_TO_SCRAPE and the link cache are the same every run. skip_sitemap(loc) can leave out sub-sitemaps of an index.
+#metrics is an optional metrics.RunMetrics for the discovery stage, one latency sample per sitemap page
+def discover(sitemap_urls, headers = None, skip_sitemap = None, num_concurrent = NUM_CONCURRENT, metrics = None):
+    links = queue.Queue()
+
+    def run():
+        try:
+            asyncio.run(_discover(sitemap_urls, headers, skip_sitemap, num_concurrent, metrics, links))
+        except BaseException as e:
+            links.put(e)
+        finally:
+            links.put(_END)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    while True:
+        item = links.get()
+        if item is _END:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+    thread.join()
@@ -0,0 +1,129 @@
+import itertools
+import archive
+import dedup
+import engine
+import linkcache
+import metrics
+import profiling
+import records
+import retryqueue
+from state import CrawlState
+from frontier import Frontier
+from tqdm import tqdm
+
+#ONE SITEMAP SITE'S CRAWL, FROM ITS LINK CACHE AND CRAWL STATE TO ITS OUTPUT AND RUN REPORT
+#main() of every sitemap scraper runs it on its own, crawl_all.py runs several together, so a setting at the top
+#of a scraper (RESUME, INCREMENTAL, REEXTRACT, ARCHIVE_DIR, STREAM_FETCH, DEDUP, QUALITY_FILTER...) is wired up here once
+
+#engine.SiteJob crawling article_list with the scraper's extractor, HEADERS, ORDERED_OUTPUT and STREAM_RULE
+def site_job(name, scraper, article_list, html_archive = None, request_headers = None, run_metrics = None):
+    return engine.SiteJob(name, article_list, scraper.extract_article, scraper.handle_fetch_error, scraper.HEADERS,
+        getattr(scraper, 'ORDERED_OUTPUT', False), html_archive, request_headers, run_metrics,
+        scraper.STREAM_RULE if scraper.STREAM_FETCH else None)
+
+#The steps of a sitemap scraper's run, split up so crawl_all.py can crawl the sites together
+#dedup_index is the dedup.DedupIndex shared by the sites, used if the scraper has DEDUP set
+#With REEXTRACT set the articles come from ARCHIVE_DIR instead, nothing is fetched and there is no crawl state
+class SitemapSite:
+    def __init__(self, name, scraper, dedup_index = None):
+        self.name = name
+        self.scraper = scraper
+        self.metrics = metrics.RunMetrics(name)
+        self.state = self.frontier = self.html_archive = None
+        self.retry = False
+        self.num_access_denied = 0
+        self.num_nones = 0
+        if scraper.REEXTRACT:
+            print(f'{name}: re-extracting articles from {scraper.ARCHIVE_DIR}')
+            self.article_list, self.num_articles = None, archive.count_records(scraper.ARCHIVE_DIR)
+        else:
+            self.retry = scraper.RETRY_FAILED or scraper.RETRY_ONLY
+            self.state = CrawlState(scraper.STATE_FILEPATH)
+            if not scraper.RESUME:
+                self.state.reset()
+
+            print(f'{name}: queued {retryqueue.import_errorlinks(scraper.ERROR_LINK, self.state)} URLs from {scraper.ERROR_LINK} for retrying')
+
+            if scraper.RETRY_ONLY:
+                link_list, num_articles = [], 0
+            else:
+                link_list, num_articles = linkcache.load_articles(scraper.CACHE_FILEPATH, lambda: scraper.iter_urls(self.metrics), scraper.USE_CACHE, getattr(scraper, 'NUM_URLS_TO_SCRAPE', -1), refresh=scraper.INCREMENTAL, sample=scraper.SAMPLE_URLS)
+            #Drop URLs listed more than once and skip the state lookup for URLs no earlier run has seen
+            self.frontier = Frontier()
+            self.frontier.mark_seen(self.state.iter_urls())
+            link_list = self.frontier.filter(link_list)
+            if scraper.INCREMENTAL:
+                self.article_list, self.num_articles = self.state.skip_unchanged(link_list, known=self.frontier.may_have_seen)
+            else:
+                self.article_list, self.num_articles = self.state.skip_finished(link_list, num_articles, known=self.frontier.may_have_seen)
+            self.html_archive = archive.HtmlArchive(scraper.ARCHIVE_DIR) if scraper.ARCHIVE_DIR else None
+        self.options = records.scraper_options(name, scraper, self.metrics, dedup_index)
+        self.output_file = records.open_output(scraper.OUTPUT_FORMAT, scraper.OUTPUT_FILEPATH, scraper.RECORDS_FILEPATH, scraper.OUTPUT_SHARDS, state=self.state, **self.options)
+
+    def job(self, article_list):
+        return site_job(self.name, self.scraper, article_list, self.html_archive, self.state.request_headers, self.metrics)
+
+    #The site's results when it runs on its own: the crawl or re-extraction, then the retries as they come due
+    def results(self):
+        if self.scraper.REEXTRACT:
+            return archive.reextract(self.scraper.ARCHIVE_DIR, self.scraper.extract_article)
+        results = engine.crawl_job(self.job(self.article_list))
+        if self.retry:
+            results = itertools.chain(results, retryqueue.crawl_failed(self.state, self.output_file, lambda retry_list: engine.crawl_job(self.job(retry_list))))
+        return results
+
+    def write(self, crawled):
+        if crawled.status == engine.ACCESS_DENIED:
+            self.num_access_denied += 1
+        elif crawled.result is None and crawled.status != engine.NOT_MODIFIED:
+            self.num_nones += 1
+        self.output_file.write(self.scraper.format_output(crawled), crawled)
+
+    #Flushes first, so the outcome of the previous pass is committed before the state is asked
+    def due_retries(self):
+        self.output_file.flush()
+        return self.state.due_retries()
+
+    def next_retry_wait(self):
+        return self.state.next_retry_wait()
+
+    def close(self):
+        self.output_file.close()
+        quality_filter = self.options['quality']
+        if quality_filter:
+            print(f'{self.name}: rejected {dict(quality_filter.num_rejected)} paragraphs, see {self.scraper.REJECTED_FILEPATH}')
+            quality_filter.close()
+        self.metrics.finish()
+        print(f'{self.name}: run report saved to {self.metrics.write_json(self.scraper.REPORT_DIR)}')
+        if self.scraper.PROMETHEUS_FILEPATH:
+            self.metrics.write_prometheus(self.scraper.PROMETHEUS_FILEPATH)
+        if self.state:
+            print(f'{self.name}: ', end='')
+            retryqueue.print_summary(self.state)
+            self.state.close()
+        if self.html_archive:
+            self.html_archive.close()
+        if self.frontier:
+            print(f'{self.name}: skipped {self.frontier.num_duplicates} duplicate URLs')
+        print(f'{self.name}: {self.num_access_denied} access denied, {self.num_nones} without an article')
+
+#main() of a sitemap scraper, crawls or re-extracts the site on its own
+def main(name, scraper):
+    for setting in ('USE_CACHE', 'RESUME', 'INCREMENTAL', 'REEXTRACT', 'RETRY_ONLY'):
+        print(f'{setting}={getattr(scraper, setting)}')
+
+    if profiling.enabled(): #python scrape_<site>.py --profile, see profiling.py
+        profiling.profile_site(name, scraper)
+        return
+
+    dedup_index = dedup.DedupIndex() if scraper.DEDUP else None
+    site = SitemapSite(name, scraper, dedup_index)
+    print('Starting article scraping...')
+    try:
+        for crawled in tqdm(site.results(), total=site.num_articles):
+            site.write(crawled)
+    finally:
+        site.close()
+        if dedup_index:
+            dedup.print_report(dedup_index)
+            dedup_index.close()
@@ -0,0 +1,202 @@
+import sqlite3
+import threading
+import time
+from engine import ACCESS_DENIED, DONE, EMPTY, ERROR, NOT_MODIFIED
+
+#PER URL CRAWL STATE SO AN INTERRUPTED CRAWL CAN RESUME WHERE IT STOPPED
+#AND A LATER CRAWL ONLY FETCHES NEW OR CHANGED URLS
+
+FINISHED_STATUSES = (DONE, EMPTY) #Skipped on restart, access denied and errors are fetched again
+FAILED_STATUSES = (ERROR, ACCESS_DENIED) #Retried once their backoff is over, see retryqueue.py
+MAX_ATTEMPTS = 5 #A URL that failed this many times in a row is given up on
+RETRY_DELAY = 30 #Seconds after the first failure before a retry, doubled for each further failure
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL,
+    num_bytes INTEGER NOT NULL DEFAULT 0,
+    lastmod TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    reason TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    filepath TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+'''
+#Columns added after the first version of the schema, added to older state files on open
+NEW_COLUMNS = ['lastmod TEXT', 'etag TEXT', 'last_modified TEXT', 'attempts INTEGER NOT NULL DEFAULT 0', 'reason TEXT']
+
+#attempts counts failures in a row, it is 1 for a new failure and back to 0 once the URL succeeds
+UPSERT = '''
+INSERT INTO urls (url, status, updated, num_bytes, lastmod, etag, last_modified, attempts, reason) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET status = excluded.status, updated = excluded.updated, num_bytes = excluded.num_bytes,
+    lastmod = COALESCE(excluded.lastmod, urls.lastmod), etag = excluded.etag, last_modified = excluded.last_modified,
+    attempts = CASE WHEN excluded.attempts THEN urls.attempts + 1 ELSE 0 END, reason = excluded.reason
+'''
+#A 304 keeps the stored status and validators, only the check time and sitemap lastmod move on
+TOUCH = 'UPDATE urls SET updated = ?, lastmod = COALESCE(?, lastmod) WHERE url = ?'
+#Failed URLs still below MAX_ATTEMPTS with the time their next retry is due, failures from before
+#attempts was stored count as one failure
+RETRIES = f'''
+SELECT url, updated + ? * (1 << (MAX(attempts, 1) - 1)) AS due FROM urls
+WHERE status IN ({",".join("?" * len(FAILED_STATUSES))}) AND attempts < ?
+'''
+
+#Time the next retry of a URL that failed attempts times in a row is due
+def retry_due(updated, attempts):
+    return updated + RETRY_DELAY * 2 ** (max(attempts, 1) - 1)
+
+#Statuses are buffered and only committed together with the output file offset they belong to,
+#so after a crash the output is truncated back to exactly the articles marked as done
+class CrawlState:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute('PRAGMA journal_mode=WAL') #Lets the engine thread read while we write
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(urls)')]
+        for column in NEW_COLUMNS:
+            if column.split()[0] not in columns:
+                self.conn.execute(f'ALTER TABLE urls ADD COLUMN {column}')
+        self.pending = []
+        self.touched = []
+        #Filled by skip_unchanged in the engine thread for URLs that are in flight
+        self.lastmods = {}
+        self.validators = {}
+        self.local = threading.local()
+
+    #Connection for the thread that is currently reading, sqlite3 connections cannot be shared between threads
+    def reader(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.filepath)
+        return self.local.conn
+
+    def record(self, url, status, num_bytes = 0, etag = None, last_modified = None, reason = None):
+        lastmod = self.lastmods.pop(url, None)
+        if status == NOT_MODIFIED:
+            self.touched.append((time.time(), lastmod, url))
+            return
+        self.pending.append((url, status, time.time(), num_bytes, lastmod, etag, last_modified, int(status in FAILED_STATUSES), reason))
+
+    def commit(self, output_filepath = None, offset = None):
+        with self.conn:
+            self.conn.executemany(UPSERT, self.pending)
+            self.conn.executemany(TOUCH, self.touched)
+            if output_filepath is not None:
+                self.conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?)', (output_filepath, offset))
+        self.pending = []
+        self.touched = []
+
+    def get_offset(self, output_filepath):
+        row = self.conn.execute('SELECT offset FROM outputs WHERE filepath = ?', (output_filepath,)).fetchone()
+        return row[0] if row else 0
+
+    def get_status(self, url):
+        row = self.conn.execute('SELECT status FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM urls LIMIT 1').fetchone() is None
+
+    #Every URL with a stored status, used to fill a frontier.Frontier with the URLs of earlier runs
+    def iter_urls(self):
+        for (url,) in self.conn.execute('SELECT url FROM urls'):
+            yield url
+
+    #Takes (url, sitemap lastmod) pairs and returns (articles, num_articles) without the URLs finished in earlier runs
+    #num_articles is None when it is not known up front. That includes any state with URLs in it, the state may hold
+    #URLs that are not in links (other NUM_URLS_TO_SCRAPE limits, retries, older sitemaps), so how many of links it
+    #skips is only known once they have all been looked up
+    #known(url) returning False, e.g. frontier.Frontier.may_have_seen, skips the lookup for URLs new to this state
+    def skip_finished(self, links, num_articles, known = None):
+        def unfinished():
+            now = time.time()
+            for article, lastmod in links:
+                row = None
+                if known is None or known(article):
+                    row = self.reader().execute('SELECT status, updated, attempts FROM urls WHERE url = ?', (article,)).fetchone()
+                if row and (row[0] in FINISHED_STATUSES or self._waiting(row, now)):
+                    continue
+                self.lastmods[article] = lastmod or None
+                yield article
+
+        return unfinished(), num_articles if self.is_empty() else None
+
+    #Takes (url, sitemap lastmod) pairs and returns (articles, None), num_articles is unknown until the end
+    #Finished URLs are skipped without a request when their lastmod is unchanged, or when there is
+    #no lastmod and nothing to send a conditional request with. Everything else is fetched.
+    def skip_unchanged(self, links, known = None):
+        def changed():
+            now = time.time()
+            for article, lastmod in links:
+                row = None
+                if known is None or known(article):
+                    row = self.reader().execute('SELECT status, updated, attempts, lastmod, etag, last_modified FROM urls WHERE url = ?', (article,)).fetchone()
+                if row and self._waiting(row, now):
+                    continue
+                if row and row[0] in FINISHED_STATUSES:
+                    _, _, _, stored_lastmod, etag, last_modified = row
+                    if lastmod and lastmod == stored_lastmod:
+                        continue
+                    if not lastmod and not etag and not last_modified:
+                        continue
+                    headers = {}
+                    if etag:
+                        headers['If-None-Match'] = etag
+                    if last_modified:
+                        headers['If-Modified-Since'] = last_modified
+                    if headers:
+                        self.validators[article] = headers
+                self.lastmods[article] = lastmod or None
+                yield article
+
+        return changed(), None
+
+    #A failed URL that is given up on or still backing off, row starts with (status, updated, attempts)
+    def _waiting(self, row, now):
+        status, updated, attempts = row[:3]
+        return status in FAILED_STATUSES and (attempts >= MAX_ATTEMPTS or retry_due(updated, attempts) > now)
+
+    #Queues (url, reason) pairs that failed outside the state, e.g. read from an errorlinks file
+    #URLs the state already has are left alone
+    def add_failures(self, failures):
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO urls (url, status, updated, attempts, reason) VALUES (?, ?, 0, 1, ?)',
+                ((url, ERROR, reason) for url, reason in failures))
+
+    #Failed URLs whose retry is due now
+    def due_retries(self):
+        now = time.time()
+        return [url for url, due in self.conn.execute(RETRIES, (RETRY_DELAY, *FAILED_STATUSES, MAX_ATTEMPTS)) if due <= now]
+
+    #Seconds until the next retry is due, None when no failed URL is left to retry
+    def next_retry_wait(self):
+        dues = [due for _, due in self.conn.execute(RETRIES, (RETRY_DELAY, *FAILED_STATUSES, MAX_ATTEMPTS))]
+        return max(min(dues) - time.time(), 0) if dues else None
+
+    #Returns (num_retrying, num_given_up) for the failed URLs
+    def count_failed(self):
+        placeholders = ",".join("?" * len(FAILED_STATUSES))
+        num_given_up = self.conn.execute(f'SELECT COUNT(*) FROM urls WHERE status IN ({placeholders}) AND attempts >= ?', (*FAILED_STATUSES, MAX_ATTEMPTS)).fetchone()[0]
+        num_failed = self.conn.execute(f'SELECT COUNT(*) FROM urls WHERE status IN ({placeholders})', FAILED_STATUSES).fetchone()[0]
+        return num_failed - num_given_up, num_given_up
+
+    #Passed to engine.crawl as request_headers, gives the conditional headers for a URL from skip_unchanged
+    def request_headers(self, article):
+        return self.validators.pop(article, None)
+
+    #Forget every URL and output offset, the next ArticleWriter starts its file from scratch
+    def reset(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM urls')
+            self.conn.execute('DELETE FROM outputs')
+        self.pending = []
+        self.touched = []
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,64 @@
+import collections
+
+#STREAMING FETCH THAT STOPS DOWNLOADING A PAGE ONCE IT IS KNOWN TO BE SKIPPED
+#With a StreamRule the engine scans each response as it arrives for skip markers, signals that make the whole
+#page irrelevant: ST's premium flag, 8world's Access denied title, CNA's Page Not found title. Once one shows up
+#the engine stops reading and closes the response, and only the bytes read so far are parsed. extract_article
+#still sees the marker element and skips the page as it would for the whole page. Pages without a marker are
+#always read and parsed whole.
+#Markers inside <script>, <style> and <!-- comments --> are not counted, there they are text and not the
+#element the extractors look for, so a page that only mentions a marker in them is read whole.
+#The scan only looks at bytes, nothing is parsed on the event loop.
+
+#skip_markers are byte strings that make the rest of the page irrelevant, e.g. b'class="paid-premium st-flag-1"'
+StreamRule = collections.namedtuple('StreamRule', ['skip_markers'])
+
+#Why a page was cut short, counted by metrics.RunMetrics.count_stream_stop
+SKIPPED = 'skip_marker'
+
+#Openings of the parts of a page whose content is not markup, and how each one ends
+RAW_TEXT = {b'<script': b'</script', b'<style': b'</style', b'<!--': b'-->'}
+
+#Collects the body of one response, feed() returns SKIPPED once the rest can be dropped
+class StreamScanner:
+    def __init__(self, rule):
+        self.rule = rule
+        self.body = bytearray()
+        self.lower = bytearray() #Lowercased copy of body, tag names are matched in any case
+        self.pos = 0 #Everything before this has been scanned
+        self.raw_end = None #End of the script, style or comment the scan is in, else None
+        self.marker_end = None #Where the marker found ends, the scan then waits for the end of its tag
+        self.overlap = max((len(token) for token in (*rule.skip_markers, *RAW_TEXT)), default=0)
+
+    def feed(self, chunk):
+        self.body += chunk
+        self.lower += chunk.lower()
+        while self.marker_end is None:
+            if self.raw_end is not None:
+                end = self.lower.find(self.raw_end, self.pos)
+                if end == -1:
+                    self.pos = max(len(self.body) - len(self.raw_end) + 1, self.pos)
+                    return None
+                self.pos = end + len(self.raw_end)
+                self.raw_end = None
+
+            #The first marker or raw text opening after pos decides what comes next
+            first, token = -1, None
+            for marker in self.rule.skip_markers:
+                found = self.body.find(marker, self.pos)
+                if found != -1 and (first == -1 or found < first):
+                    first, token = found, marker
+            for opening in RAW_TEXT:
+                found = self.lower.find(opening, self.pos)
+                if found != -1 and (first == -1 or found < first):
+                    first, token = found, opening
+            if token is None:
+                self.pos = max(len(self.body) - self.overlap + 1, self.pos)
+                return None
+            if token not in RAW_TEXT:
+                self.marker_end = first + len(token)
+                break
+            self.raw_end = RAW_TEXT[token]
+            self.pos = first + len(token)
+        #Stops after the > that ends the marker's tag, so the parser sees the whole tag and not a cut off one
+        return SKIPPED if self.body.find(b'>', self.marker_end) != -1 else None
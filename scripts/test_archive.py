@@ -0,0 +1,20 @@
+import operator
+import archive
+
+#A URL archived by two runs is re-extracted once, from the page the later run fetched
+def test_reextract_keeps_newest_record(tmp_path):
+    for body in (b'old', b'new'):
+        with archive.HtmlArchive(str(tmp_path)) as html_archive:
+            html_archive.write('https://example.com/a', archive.build_record('https://example.com/a', body, 'utf-8'))
+            html_archive.write(f'https://example.com/{body.decode()}', archive.build_record(f'https://example.com/{body.decode()}', body, 'utf-8'))
+
+    assert len(archive.list_shards(str(tmp_path))) == 2
+    assert archive.count_records(str(tmp_path)) == 3
+    #operator.add stands in for extract_article(url, html), it can be sent to the parse processes
+    results = list(archive.reextract(str(tmp_path), operator.add, num_parsers=1))
+    assert [(crawled.url, crawled.result) for crawled in results] == [
+        ('https://example.com/old', 'https://example.com/oldold'),
+        ('https://example.com/a', 'https://example.com/anew'),
+        ('https://example.com/new', 'https://example.com/newnew'),
+    ]
+    assert [crawled.idx for crawled in results] == [0, 1, 2]
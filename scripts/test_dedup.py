@@ -0,0 +1,22 @@
+import dedup
+
+SHARED = 'The same wire story, syndicated word for word by two of the sites in one run.'
+
+#Two crawls writing to one index at the same time, neither flushes in between. The second must neither wait
+#for the first nor miss the paragraph the first one added.
+def test_two_writers_share_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, 'BUSY_TIMEOUT', 1) #A writer left holding the lock fails the test within a second
+    filepath = str(tmp_path / 'dedup.sqlite')
+    first, second = dedup.DedupIndex(filepath), dedup.DedupIndex(filepath)
+
+    assert first.filter(f'{SHARED}\nOnly in the first article.', 'https://a.example.com/1', 'a') == f'{SHARED}\nOnly in the first article.'
+    assert second.filter(f'Only in the second article.\n{SHARED}', 'https://b.example.com/2', 'b') == 'Only in the second article.'
+    assert first.filter(f'{SHARED}\nOnly in the first article.', 'https://a.example.com/1', 'a') == f'{SHARED}\nOnly in the first article.'
+
+    first.commit()
+    second.commit()
+    counts = second.site_counts()
+    assert counts['a']['paragraphs'] == 4 and counts['a']['exact_duplicates'] == 0
+    assert counts['b']['paragraphs'] == 2 and counts['b']['exact_duplicates'] == 1
+    first.close()
+    second.close()
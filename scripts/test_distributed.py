@@ -0,0 +1,32 @@
+import types
+import distributed
+import engine
+import workqueue
+
+#A node whose lease ran out before it noticed, and that then leases the same batch again, has to write the
+#results of the new lease only, however the results of the two leases arrive
+def test_expired_batch_leased_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(distributed, 'LEASE_SECONDS', -1) #Every lease has run out as soon as it is taken
+    scraper = types.SimpleNamespace(OUTPUT_FORMAT='text', OUTPUT_SHARDS=False, OUTPUT_FILEPATH=str(tmp_path / 'corpus.txt'),
+        RECORDS_FILEPATH=str(tmp_path / 'corpus.jsonl'), REJECTED_FILEPATH=str(tmp_path / 'rejected.txt'), QUALITY_FILTER=False, SPLIT_SENTENCES=False, format_output=lambda crawled: crawled.result)
+    work_queue = workqueue.SqliteQueue(str(tmp_path / 'queue.sqlite'))
+    work_queue.enqueue(['https://example.com/a', 'https://example.com/b'], num_partitions=1, batch_size=2)
+    node = distributed.Node(scraper, work_queue, 'node')
+
+    urls = node.leased_urls()
+    first = [next(urls), next(urls)]
+    second = [next(urls), next(urls)] #The same batch, leased again with a new token
+    assert sorted(first) == sorted(second)
+    assert len(node.leases) == 1
+
+    node.add_result(engine.CrawlResult(0, first[0], 'old\n', engine.DONE, 4))
+    node.add_result(engine.CrawlResult(2, second[0], 'new\n', engine.DONE, 4))
+    node.add_result(engine.CrawlResult(1, first[1], 'old\n', engine.DONE, 4))
+    node.add_result(engine.CrawlResult(3, second[1], 'new\n', engine.DONE, 4))
+    node.output_file.close()
+
+    assert not node.leases and not node.lease_of
+    assert node.num_lost == 0
+    assert work_queue.counts()[0] == {workqueue.COMPLETED: 1}
+    with open(node.filepath, 'r', encoding='utf-8') as output_file:
+        assert output_file.read() == 'new\nnew\n'
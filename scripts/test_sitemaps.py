@@ -0,0 +1,50 @@
+import asyncio
+import threading
+from aiohttp import web
+import sitemaps
+
+PORT = 8761
+BASE = f'http://127.0.0.1:{PORT}'
+#The index lists page 0 to 3, page 0 is the slowest and page 2 is an index of its own
+DELAYS = {'0': 0.5, '1': 0.0, '2': 0.2, '2a': 0.3, '2b': 0.0, '3': 0.1}
+
+def urlset(name):
+    return '<urlset>' + ''.join(f'<url><loc>{BASE}/{name}/{num}</loc><lastmod>2024-01-0{num + 1}</lastmod></url>' for num in range(3)) + '</urlset>'
+
+def sitemapindex(names):
+    return '<sitemapindex>' + ''.join(f'<sitemap><loc>{BASE}/sitemap-{name}.xml</loc></sitemap>' for name in names) + '</sitemapindex>'
+
+async def handle(request):
+    name = request.match_info['name']
+    if name == 'index':
+        return web.Response(text=sitemapindex(['0', '1', '2', '3']), content_type='application/xml')
+    await asyncio.sleep(DELAYS[name])
+    if name == '2':
+        return web.Response(text=sitemapindex(['2a', '2b']), content_type='application/xml')
+    return web.Response(text=urlset(name), content_type='application/xml')
+
+def serve(started, stopped):
+    async def run():
+        app = web.Application()
+        app.router.add_get('/sitemap-{name}.xml', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        started.set()
+        while not stopped.is_set():
+            await asyncio.sleep(0.05)
+        await runner.cleanup()
+    asyncio.run(run())
+
+#Pages finish out of order, links still come in the order of fetching the pages one by one
+def test_discover_in_page_order():
+    started, stopped = threading.Event(), threading.Event()
+    thread = threading.Thread(target=serve, args=(started, stopped), daemon=True)
+    thread.start()
+    started.wait()
+    try:
+        links = list(sitemaps.discover([f'{BASE}/sitemap-index.xml'], num_concurrent=4))
+    finally:
+        stopped.set()
+        thread.join()
+    assert links == [(f'{BASE}/{name}/{num}', f'2024-01-0{num + 1}') for name in ('0', '1', '2a', '2b', '3') for num in range(3)]
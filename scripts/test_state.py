@@ -0,0 +1,17 @@
+import engine
+from state import CrawlState
+
+#The state's finished URLs are not all in the links of this run, so the number left to crawl is not known up front
+def test_skip_finished_total(tmp_path):
+    state = CrawlState(str(tmp_path / 'state.sqlite'))
+    links = [('https://example.com/a', None), ('https://example.com/b', None)]
+    articles, num_articles = state.skip_finished(iter(links), 2)
+    assert num_articles == 2 and list(articles) == ['https://example.com/a', 'https://example.com/b']
+
+    for url in ('https://example.com/a', 'https://example.com/x', 'https://example.com/y'): #x and y are from another run's links
+        state.record(url, engine.DONE)
+    state.commit()
+    articles, num_articles = state.skip_finished(iter(links), 2)
+    assert num_articles is None
+    assert list(articles) == ['https://example.com/b']
+    state.close()
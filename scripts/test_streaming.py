@@ -0,0 +1,53 @@
+import asyncio
+import engine
+import streaming
+
+RULE = streaming.StreamRule((b'class="paid-premium st-flag-1"',))
+CONTAINER = b'<div class="article-content"><p>First paragraph</p><p>Second paragraph</p></div>'
+
+#Stands in for an aiohttp response, handing out the page in chunks of chunk_size bytes
+class FakeResponse:
+    def __init__(self, page, chunk_size):
+        self.content = self
+        self.chunks = [page[i:i + chunk_size] for i in range(0, len(page), chunk_size)]
+        self.num_sent = 0
+        self.closed = False
+
+    async def iter_any(self):
+        for chunk in self.chunks:
+            self.num_sent += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+def read(page, chunk_size = 16):
+    response = FakeResponse(page, chunk_size)
+    body, stop, num_read = asyncio.run(engine.read_streamed(response, RULE))
+    return response, body, stop, num_read
+
+#A marker in a script or comment ahead of the article container is text, not the premium flag element,
+#so the page has to be read whole
+def test_marker_in_script_before_container():
+    page = (b'<html><head><SCRIPT>var flags = \'class="paid-premium st-flag-1"\';</SCRIPT></head><body>'
+        b'<!-- class="paid-premium st-flag-1" -->' + CONTAINER + b'</body></html>')
+    response, body, stop, num_read = read(page)
+    assert stop is None
+    assert body == page and num_read == len(page)
+    assert not response.closed
+
+#The premium flag element ahead of the article container stops the download after its tag
+def test_marker_before_container():
+    page = b'<html><body><div class="paid-premium st-flag-1">Premium</div>' + CONTAINER + b'x' * 10000 + b'</body></html>'
+    response, body, stop, num_read = read(page)
+    assert stop == streaming.SKIPPED
+    assert response.closed and response.num_sent < len(response.chunks)
+    assert num_read == len(body) < len(page)
+    assert body.startswith(b'<html><body><div class="paid-premium st-flag-1">')
+
+#A marker split across chunks is still found, and one whose tag has not ended yet waits for the rest of it
+def test_marker_across_chunks():
+    scanner = streaming.StreamScanner(RULE)
+    assert scanner.feed(b'<html><body><div class="paid-prem') is None
+    assert scanner.feed(b'ium st-flag-1" id="flag"') is None
+    assert scanner.feed(b'>Premium</div>') == streaming.SKIPPED
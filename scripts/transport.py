@@ -0,0 +1,84 @@
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
+#HTTP TRANSPORT SHARED BY THE CRAWL ENGINE, SITEMAP DISCOVERY AND THE SCRAPERS' requests SESSIONS
+#Connections are pooled and kept alive per host, responses are compressed, host names are resolved once
+#per DNS_CACHE_SECONDS. aiohttp only speaks HTTP/1.1, so there is no HTTP/2 multiplexing, requests to a host
+#reuse its pool of keep-alive connections instead. How often they are reused is counted in metrics.RunMetrics.
+
+POOL_SIZE = None #Connections open at once, None matches the pool to the concurrency of the crawl or discovery
+LIMIT_PER_HOST = None #Connections open to one host, None matches it to the per host request limit
+KEEPALIVE_TIMEOUT = 30 #Seconds an idle connection is kept for the next request to its host
+DNS_CACHE_SECONDS = 300 #Seconds a resolved host name is reused, None keeps it for the whole run
+#br is only asked for when the brotli package can decode it, aiohttp and requests both decode it with it
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+REQUESTS_POOL_SIZE = 32 #Connections kept per host by a scraper's requests session
+CONNECT_RETRIES = 3 #Same policy as engine.CONNECT_RETRIES and engine.BACKOFF_FACTOR
+BACKOFF_FACTOR = 0.5
+
+#Connection pool for concurrency requests at once, at most per_host_limit of them to the same host
+#per_host_limit is an int or a {host: limit} dict like engine.HostLimiter takes
+def connector(concurrency, per_host_limit):
+    if isinstance(per_host_limit, dict):
+        per_host_limit = max(per_host_limit.values(), default=concurrency)
+    return aiohttp.TCPConnector(limit=POOL_SIZE or concurrency, limit_per_host=LIMIT_PER_HOST or per_host_limit,
+        keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=DNS_CACHE_SECONDS, use_dns_cache=True,
+        resolver=aiohttp.AsyncResolver() if aiodns else None)
+
+#Counts new and reused connections, connection setup time and DNS cache hits into the metrics.RunMetrics
+#passed to a request as trace_request_ctx. Requests without one are not counted.
+def trace_config():
+    config = aiohttp.TraceConfig()
+
+    async def on_connection_create_start(session, context, params):
+        context.start = session.loop.time()
+
+    async def on_connection_create_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.count_connection('created', session.loop.time() - context.start)
+
+    async def on_connection_reuseconn(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.count_connection('reused')
+
+    async def on_dns_cache_hit(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.count_connection('dns_cache_hit')
+
+    async def on_dns_cache_miss(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.count_connection('dns_cache_miss')
+
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_connection_reuseconn.append(on_connection_reuseconn)
+    config.on_dns_cache_hit.append(on_dns_cache_hit)
+    config.on_dns_cache_miss.append(on_dns_cache_miss)
+    return config
+
+#aiohttp session over a connector(), headers are sent with every request on top of Accept-Encoding
+def session(connection_pool, timeout, headers = None):
+    return aiohttp.ClientSession(connector=connection_pool, timeout=timeout, headers={'Accept-Encoding': ACCEPT_ENCODING, **(headers or {})}, trace_configs=[trace_config()])
+
+#requests.Session for the scrapers' sequential code paths (gather_urls, scrape_article), with a pool of
+#pool_size keep-alive connections per host and connection retries
+def requests_session(headers, pool_size = REQUESTS_POOL_SIZE):
+    s = requests.Session()
+    s.headers.update({'Accept-Encoding': ACCEPT_ENCODING, **headers})
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=Retry(connect=CONNECT_RETRIES, backoff_factor=BACKOFF_FACTOR))
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
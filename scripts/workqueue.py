@@ -0,0 +1,187 @@
+import collections
+import sqlite3
+import threading
+import time
+import uuid
+from frontier import fingerprint
+from state import FAILED_STATUSES, MAX_ATTEMPTS
+
+#LEASE BASED WORK QUEUE FOR CRAWLING ONE SITE FROM SEVERAL MACHINES, SEE distributed.py
+#The link cache is split into NUM_PARTITIONS by URL hash and each partition into batches. A node leases a batch,
+#crawls it and completes it together with the offset of its output file the batch was written up to. A batch whose
+#lease runs out, because its node died or hung, goes back to the queue for another node. Completing checks the
+#lease token, so a node that lost its lease cannot commit the batch a second time.
+#SqliteQueue is a stand-in that works for nodes sharing a disk. Another backend (a database server, Redis...)
+#only needs the same methods: enqueue, lease, renew, release, complete, requeue_failed, get_offset, num_pending, counts.
+
+NUM_PARTITIONS = 64
+BATCH_SIZE = 500 #URLs per batch, a batch is written to the output as a whole once all its URLs are done
+LEASE_SECONDS = 300 #A node renews its leases well before this, see distributed.py
+BUSY_TIMEOUT = 60 #Seconds a node waits for another node's transaction before giving up
+
+QUEUED = 'queued'
+LEASED = 'leased'
+COMPLETED = 'completed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY,
+    partition INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    node TEXT,
+    token TEXT,
+    expires REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    url TEXT PRIMARY KEY,
+    batch INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS items_batch ON items (batch);
+CREATE TABLE IF NOT EXISTS outputs (
+    filepath TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+'''
+
+#A leased batch, token identifies this lease of it
+Lease = collections.namedtuple('Lease', ['batch', 'token', 'urls'])
+
+#Partition of a URL, variants of a URL (see frontier.url_key) always land in the same one
+def partition(url, num_partitions = NUM_PARTITIONS):
+    return fingerprint(url) % num_partitions
+
+class SqliteQueue:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    #The queue is used from the crawl's feeder thread as well as the main thread, one connection each.
+    #Transactions are started by hand with BEGIN IMMEDIATE so two nodes cannot lease the same batch.
+    def _conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.filepath, timeout=BUSY_TIMEOUT, isolation_level=None)
+        return self.local.conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def _add_batch(self, conn, partition_num):
+        return conn.execute('INSERT INTO batches (partition, status) VALUES (?, ?)', (partition_num, QUEUED)).lastrowid
+
+    #Adds the URLs to the queue in batches of batch_size per partition, URLs already queued are left out,
+    #so enqueueing the same link cache again only adds what is new. Returns the number of URLs added.
+    def enqueue(self, urls, num_partitions = NUM_PARTITIONS, batch_size = BATCH_SIZE):
+        buffers = collections.defaultdict(list)
+        num_added = 0
+
+        def add(partition_num, batch_urls):
+            def work(conn):
+                batch = self._add_batch(conn, partition_num)
+                num_new = 0
+                for url in batch_urls:
+                    num_new += conn.execute('INSERT OR IGNORE INTO items (url, batch, status) VALUES (?, ?, ?)', (url, batch, QUEUED)).rowcount
+                if num_new == 0:
+                    conn.execute('DELETE FROM batches WHERE id = ?', (batch,))
+                return num_new
+            return self._transaction(work)
+
+        for url in urls:
+            partition_num = partition(url, num_partitions)
+            buffers[partition_num].append(url)
+            if len(buffers[partition_num]) >= batch_size:
+                num_added += add(partition_num, buffers.pop(partition_num))
+        for partition_num, batch_urls in sorted(buffers.items()):
+            num_added += add(partition_num, batch_urls)
+        return num_added
+
+    #Leases the next queued batch to node for lease_seconds, None when nothing is queued right now
+    #Batches whose lease ran out are queued again first. partitions, if given, are preferred over the others.
+    def lease(self, node, lease_seconds = LEASE_SECONDS, partitions = None):
+        def work(conn):
+            now = time.time()
+            conn.execute('UPDATE batches SET status = ?, node = NULL, token = NULL WHERE status = ? AND expires < ?', (QUEUED, LEASED, now))
+            order = 'id'
+            if partitions:
+                order = f'partition IN ({",".join(str(int(p)) for p in partitions)}) DESC, id'
+            row = conn.execute(f'SELECT id FROM batches WHERE status = ? ORDER BY {order} LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute('UPDATE batches SET status = ?, node = ?, token = ?, expires = ? WHERE id = ?', (LEASED, node, token, now + lease_seconds, row[0]))
+            urls = [url for (url,) in conn.execute('SELECT url FROM items WHERE batch = ? AND status = ? ORDER BY rowid', (row[0], QUEUED))]
+            return Lease(row[0], token, urls)
+        return self._transaction(work)
+
+    #Extends a lease, False if it was already lost to another node
+    def renew(self, lease, lease_seconds = LEASE_SECONDS):
+        def work(conn):
+            return conn.execute('UPDATE batches SET expires = ? WHERE id = ? AND token = ? AND status = ?', (time.time() + lease_seconds, lease.batch, lease.token, LEASED)).rowcount == 1
+        return self._transaction(work)
+
+    #Hands a batch back without completing it, e.g. when the node is stopped
+    def release(self, lease):
+        def work(conn):
+            conn.execute('UPDATE batches SET status = ?, node = NULL, token = NULL WHERE id = ? AND token = ? AND status = ?', (QUEUED, lease.batch, lease.token, LEASED))
+        self._transaction(work)
+
+    #Marks the batch as completed with the (url, status, reason) of each of its URLs and records that
+    #output_filepath is written up to offset, in one transaction. output_filepath is None for a batch that wrote nothing.
+    #False if the lease was lost, the caller then has to cut its output back, another node has the batch.
+    def complete(self, lease, results, output_filepath, offset):
+        def work(conn):
+            if conn.execute('UPDATE batches SET status = ?, expires = NULL WHERE id = ? AND token = ? AND status = ?', (COMPLETED, lease.batch, lease.token, LEASED)).rowcount != 1:
+                return False
+            conn.executemany('UPDATE items SET status = ?, attempts = CASE WHEN ? THEN attempts + 1 ELSE 0 END, reason = ? WHERE url = ?',
+                ((status, status in FAILED_STATUSES, reason, url) for url, status, reason in results))
+            if output_filepath is not None:
+                conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?)', (output_filepath, offset))
+            return True
+        return self._transaction(work)
+
+    #Puts failed URLs below max_attempts into new batches, returns the number of URLs queued again
+    def requeue_failed(self, max_attempts = MAX_ATTEMPTS, batch_size = BATCH_SIZE):
+        def work(conn):
+            placeholders = ",".join("?" * len(FAILED_STATUSES))
+            rows = conn.execute(f'SELECT items.url, batches.partition FROM items JOIN batches ON items.batch = batches.id WHERE items.status IN ({placeholders}) AND items.attempts < ? ORDER BY batches.partition, items.rowid',
+                (*FAILED_STATUSES, max_attempts)).fetchall()
+            by_partition = collections.defaultdict(list)
+            for url, partition_num in rows:
+                by_partition[partition_num].append(url)
+            for partition_num, urls in by_partition.items():
+                for start in range(0, len(urls), batch_size):
+                    batch = self._add_batch(conn, partition_num)
+                    conn.executemany('UPDATE items SET batch = ?, status = ? WHERE url = ?', ((batch, QUEUED, url) for url in urls[start:start + batch_size]))
+            return len(rows)
+        return self._transaction(work)
+
+    #Offset output_filepath was committed up to, 0 if it is unknown
+    def get_offset(self, output_filepath):
+        row = self._conn().execute('SELECT offset FROM outputs WHERE filepath = ?', (output_filepath,)).fetchone()
+        return row[0] if row else 0
+
+    #Batches queued or leased, the crawl is over once this is 0 and no failure is left to retry
+    def num_pending(self):
+        return self._conn().execute('SELECT COUNT(*) FROM batches WHERE status != ?', (COMPLETED,)).fetchone()[0]
+
+    #Returns ({batch status: count}, {url status: count})
+    def counts(self):
+        conn = self._conn()
+        return dict(conn.execute('SELECT status, COUNT(*) FROM batches GROUP BY status').fetchall()), dict(conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall())
+
+    def close(self):
+        self._conn().close()
+        del self.local.conn
@@ -0,0 +1,87 @@
+import os
+import time
+import segment
+
+#STREAMING OUTPUT WRITER SHARED BY THE SCRAPERS
+
+FLUSH_EVERY = 100 #Articles written between flushes, at most this many are lost on a crash
+
+#Writes articles to disk as they complete instead of collecting them in a results list
+#Ordering is left to engine.crawl(ordered=True), which bounds how many articles are held back
+#With a state.CrawlState, URL statuses are committed together with the flushed file offset and the
+#file is cut back to the last committed offset on open, so a restarted crawl never loses or repeats articles
+#metrics is an optional metrics.RunMetrics for the write stage and the results written
+#quality is an optional quality.QualityFilter and dedup an optional dedup.SiteDedup, the paragraphs they drop
+#are taken out before an article is written, rejected ones before they reach the dedup index
+#sentence_language 'zh' or 'en' writes what is left one sentence per line, see segment.py
+class ArticleWriter:
+    def __init__(self, filepath, mode = 'w', flush_every = FLUSH_EVERY, state = None, metrics = None, dedup = None, quality = None, sentence_language = None):
+        self.filepath = filepath
+        self.state = state
+        self.metrics = metrics
+        self.dedup = dedup
+        self.quality = quality
+        self.sentence_language = sentence_language
+        if state is not None:
+            with open(filepath, 'a', encoding='utf-8'):
+                pass
+            os.truncate(filepath, state.get_offset(filepath))
+            mode = 'a'
+
+        self.output_file = open(filepath, mode, encoding='utf-8')
+        self.flush_every = flush_every
+        self.num_unflushed = 0
+        self.num_written = 0
+
+    #Empty results (None, '') are skipped, crawled is the engine.CrawlResult to mark in the state
+    #article is the text to write, or a record for the writers in records.py
+    def write(self, article, crawled = None):
+        start = time.perf_counter()
+        if self.state is not None and crawled is not None:
+            self.state.record(crawled.url, crawled.status, crawled.num_bytes, crawled.etag, crawled.last_modified, crawled.reason)
+        if self.quality is not None and article and crawled is not None:
+            article = self.quality.filter(article, crawled.url)
+        if self.dedup is not None and article and crawled is not None:
+            article = self.dedup.filter(article, crawled.url)
+        #Counted before sentence splitting, so paragraphs stay comparable with runs that do not split
+        if self.metrics is not None and crawled is not None:
+            self.metrics.count_result(crawled, article)
+        if self.sentence_language is not None and article:
+            article = segment.segment_article(article, self.sentence_language)
+            if self.metrics is not None:
+                self.metrics.count_sentences(article)
+        if not article:
+            return
+        num_bytes = self._write_text(article, crawled)
+        self.num_written += 1
+        self.num_unflushed += 1
+        if self.num_unflushed >= self.flush_every:
+            self.flush()
+        if self.metrics is not None:
+            self.metrics.observe('write', time.perf_counter() - start, num_bytes)
+
+    #Writes one non empty article, returns the number of bytes it takes
+    def _write_text(self, article, crawled):
+        self.output_file.write(article)
+        return len(article.encode('utf-8'))
+
+    def flush(self):
+        self.output_file.flush()
+        self.num_unflushed = 0
+        if self.state is not None:
+            os.fsync(self.output_file.fileno())
+            self.state.commit(self.filepath, self.output_file.tell())
+        if self.dedup is not None:
+            self.dedup.commit()
+        if self.quality is not None:
+            self.quality.flush()
+
+    def close(self):
+        self.flush()
+        self.output_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()